@@ -1,65 +1,475 @@
-import sqlite3
+from conexion import get_conexion, transaccion
 
-def init_db():
-    conn = sqlite3.connect('biblioteca.db')
-    c = conn.cursor()
-    # Tabla base de usuarios
-    c.execute('''CREATE TABLE IF NOT EXISTS usuarios
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  nombre TEXT NOT NULL,
-                  email TEXT UNIQUE NOT NULL,
-                  password_hash TEXT NOT NULL,
-                  tipo TEXT NOT NULL)''')
-    # Tabla para bibliotecarios
-    c.execute('''CREATE TABLE IF NOT EXISTS bibliotecarios
-                 (usuario_id INTEGER PRIMARY KEY,
-                  universidad TEXT NOT NULL,
-                  FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
-    # Tabla para universitarios
-    c.execute('''CREATE TABLE IF NOT EXISTS universitarios
-                 (usuario_id INTEGER PRIMARY KEY,
-                  universidad TEXT NOT NULL,
-                  FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
-    # Tabla para admin
-    c.execute('''CREATE TABLE IF NOT EXISTS admin
-                 (usuario_id INTEGER PRIMARY KEY,
-                  FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
+def _columnas(c, tabla):
+    return {fila[1] for fila in c.execute(f"PRAGMA table_info({tabla})")}
+
+
+def _agregar_estado_prestamos(c):
+    # Bases creadas antes de is_activo / fch_devolucion_real
+    columnas = _columnas(c, 'prestamos')
+    if 'is_activo' not in columnas:
+        c.execute("ALTER TABLE prestamos ADD COLUMN is_activo INTEGER NOT NULL DEFAULT 1")
+    if 'fch_devolucion_real' not in columnas:
+        c.execute("ALTER TABLE prestamos ADD COLUMN fch_devolucion_real DATE")
+
+
+def _agregar_disponibles(c):
+    # Hasta ahora el CLI descontaba cantidad en cada prestamo: en esas bases cantidad
+    # son las copias en estante y el total es cantidad + prestamos activos.
+    # En la base de Django (la que tiene django_migrations) cantidad siempre fue el total.
+    activos = "(SELECT COUNT(*) FROM prestamos p WHERE p.libro_id = libros.id AND p.is_activo = 1)"
+    if 'disponibles' not in _columnas(c, 'libros'):
+        c.execute("ALTER TABLE libros ADD COLUMN disponibles INTEGER CHECK (disponibles >= 0)")
+        es_django = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'django_migrations'").fetchone()
+        if not es_django:
+            c.execute(f"UPDATE libros SET disponibles = cantidad, cantidad = cantidad + {activos}")
+    c.execute(f"UPDATE libros SET disponibles = cantidad - {activos} WHERE disponibles IS NULL")
+
+
+# Estadisticas de circulacion (migracion 14, ver estadisticas.py). Un prestamo aporta
+# +1 prestamo el dia de fch_prestamo y, ya devuelto, +1 devolucion (con sus dias y si fue
+# atrasada) el dia de fch_devolucion_real. Los triggers restan el aporte de la fila
+# anterior y suman el de la nueva.
+# (tabla, columnas clave, valores clave, origen del genero / universidad)
+_TABLAS_ESTADISTICAS = [
+    ('estadisticas_libros', 'libro_id', '{f}.libro_id', ''),
+    ('estadisticas_libros_dia', 'dia, libro_id', '{dia}, {f}.libro_id', ''),
+    ('estadisticas_generos_dia', 'dia, genero', '{dia}, genero', 'FROM libros WHERE id = {f}.libro_id AND'),
+    ('estadisticas_universidades_dia', 'dia, universidad', '{dia}, universidad',
+     'FROM universitarios WHERE usuario_id = {f}.universitario_id AND'),
+]
+
+
+def _sql_aporte(f, signo):
+    """Sentencias que suman (signo 1) o restan (signo -1) el aporte de la fila f (new / old) de prestamos."""
+    aportes = [
+        # Prestamo
+        (f"date({f}.fch_prestamo)", f"{signo}, 0, 0, 0", "1"),
+        # Devolucion
+        (f"date({f}.fch_devolucion_real)",
+         f"0, {signo}, {signo} * (date({f}.fch_devolucion_real) > date({f}.fch_devolucion)), "
+         f"{signo} * CAST(julianday({f}.fch_devolucion_real) - julianday({f}.fch_prestamo) AS INTEGER)",
+         f"{f}.is_activo = 0 AND {f}.fch_devolucion_real IS NOT NULL"),
+    ]
+    sentencias = []
+    for tabla, claves, valores, origen in _TABLAS_ESTADISTICAS:
+        for dia, contadores, condicion in aportes:
+            sentencias.append(
+                f"INSERT INTO {tabla} ({claves}, prestamos, devoluciones, atrasadas, dias_prestado) "
+                f"SELECT {valores.format(f=f, dia=dia)}, {contadores} {origen.format(f=f) or 'WHERE'} {condicion} "
+                f"ON CONFLICT ({claves}) DO UPDATE SET prestamos = prestamos + excluded.prestamos, "
+                f"devoluciones = devoluciones + excluded.devoluciones, atrasadas = atrasadas + excluded.atrasadas, "
+                f"dias_prestado = dias_prestado + excluded.dias_prestado;")
+    return "\n".join(sentencias)
+
+
+def _crear_estadisticas(c):
+    for tabla, claves, _, _ in _TABLAS_ESTADISTICAS:
+        columnas = {'dia': 'dia TEXT NOT NULL', 'libro_id': 'libro_id INTEGER NOT NULL',
+                    'genero': 'genero TEXT NOT NULL', 'universidad': 'universidad TEXT NOT NULL'}
+        c.execute(f"""CREATE TABLE IF NOT EXISTS {tabla}
+                      ({', '.join(columnas[clave] for clave in claves.split(', '))},
+                       prestamos INTEGER NOT NULL DEFAULT 0,
+                       devoluciones INTEGER NOT NULL DEFAULT 0,
+                       atrasadas INTEGER NOT NULL DEFAULT 0,      -- devoluciones despues de fch_devolucion
+                       dias_prestado INTEGER NOT NULL DEFAULT 0,  -- suma de dias de las devoluciones
+                       PRIMARY KEY ({claves})) WITHOUT ROWID""")
+    # Los libros mas prestados de toda la historia se leen en orden del indice
+    c.execute("CREATE INDEX IF NOT EXISTS idx_estadisticas_libros_prestamos ON estadisticas_libros (prestamos)")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS prestamos_estadisticas_ai AFTER INSERT ON prestamos BEGIN
+                  {_sql_aporte('new', 1)}
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS prestamos_estadisticas_au
+                  AFTER UPDATE OF universitario_id, libro_id, fch_prestamo, fch_devolucion, is_activo, fch_devolucion_real
+                  ON prestamos BEGIN
+                  {_sql_aporte('old', -1)}
+                  {_sql_aporte('new', 1)}
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS prestamos_estadisticas_ad AFTER DELETE ON prestamos BEGIN
+                  {_sql_aporte('old', -1)}
+                  END""")
+    # Los prestamos anteriores a la migracion. Copia fija de estadisticas.reconstruir_en (tal
+    # como era al publicar la migracion): la migracion no cambia si despues cambia ese modulo
+    movimientos = """
+        SELECT date(fch_prestamo) AS dia, libro_id, universitario_id,
+               1 AS prestamos, 0 AS devoluciones, 0 AS atrasadas, 0 AS dias_prestado
+        FROM prestamos
+        UNION ALL
+        SELECT date(fch_devolucion_real), libro_id, universitario_id, 0, 1,
+               date(fch_devolucion_real) > date(fch_devolucion),
+               CAST(julianday(fch_devolucion_real) - julianday(fch_prestamo) AS INTEGER)
+        FROM prestamos
+        WHERE is_activo = 0 AND fch_devolucion_real IS NOT NULL"""
+    sumas = ("SUM(prestamos) AS prestamos, SUM(devoluciones) AS devoluciones, "
+             "SUM(atrasadas) AS atrasadas, SUM(dias_prestado) AS dias_prestado")
+    c.execute(f"""INSERT INTO estadisticas_libros_dia (dia, libro_id, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT dia, libro_id, {sumas} FROM ({movimientos}) GROUP BY dia, libro_id""")
+    c.execute(f"""INSERT INTO estadisticas_libros (libro_id, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT libro_id, {sumas} FROM estadisticas_libros_dia GROUP BY libro_id""")
+    c.execute(f"""INSERT INTO estadisticas_generos_dia (dia, genero, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT e.dia, l.genero, {sumas}
+                  FROM estadisticas_libros_dia e JOIN libros l ON l.id = e.libro_id
+                  GROUP BY e.dia, l.genero""")
+    c.execute(f"""INSERT INTO estadisticas_universidades_dia (dia, universidad, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT m.dia, u.universidad, {sumas}
+                  FROM ({movimientos}) m JOIN universitarios u ON u.usuario_id = m.universitario_id
+                  GROUP BY m.dia, u.universidad""")
 
-    # Tabla de libros
-    c.execute('''CREATE TABLE IF NOT EXISTS libros
+
+def _auditoria_sin_usuario(c):
+    # SQLite no quita un NOT NULL con ALTER: se rehace la tabla con los mismos ids, los
+    # mismos indices y el mismo contador AUTOINCREMENT (los ids archivados no se repiten)
+    secuencia = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'auditoria'").fetchone()
+    c.execute("""CREATE TABLE auditoria_nueva
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  titulo TEXT NOT NULL,
-                  autor TEXT NOT NULL,
-                  genero TEXT NOT NULL,
-                  año INTEGER NOT NULL,
-                  cantidad INTEGER NOT NULL,
-                  isbn TEXT UNIQUE NOT NULL)''')
+                  usuario_id INTEGER,                  -- NULL: usuario de Django sin fila en usuarios
+                  accion TEXT NOT NULL,
+                  tabla_afectada TEXT NOT NULL,
+                  detalle TEXT,
+                  fecha DATE NOT NULL,
+                  FOREIGN KEY (usuario_id) REFERENCES usuarios (id))""")
+    c.execute("""INSERT INTO auditoria_nueva (id, usuario_id, accion, tabla_afectada, detalle, fecha)
+                 SELECT id, usuario_id, accion, tabla_afectada, detalle, fecha FROM auditoria""")
+    c.execute("DROP TABLE auditoria")
+    c.execute("ALTER TABLE auditoria_nueva RENAME TO auditoria")
+    if secuencia:
+        c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'auditoria'", secuencia)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_fecha ON auditoria (fecha)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_usuario_fecha ON auditoria (usuario_id, fecha)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_tabla_fecha ON auditoria (tabla_afectada, fecha)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_auditoria_accion_fecha ON auditoria (accion, fecha)")
+
+
+# Migraciones versionadas del esquema. Cada entrada es (version, descripcion, pasos);
+# un paso es una sentencia SQL o una funcion que recibe el cursor.
+# La version aplicada se guarda en PRAGMA user_version, asi las bases existentes
+# se actualizan en el mismo archivo sin volver a correr migraciones ya aplicadas.
+# Nunca modificar una migracion ya publicada: agregar una nueva al final.
+MIGRACIONES = [
+    (1, "Columnas de estado de prestamos", [
+        _agregar_estado_prestamos,
+    ]),
+    (2, "Indices de prestamos", [
+        # mostrar_mis_prestamos: WHERE universitario_id = ? AND is_activo = 1
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_universitario_activo ON prestamos (universitario_id, is_activo, fch_devolucion)",
+        # mostrar_todos_prestamos_activos: WHERE is_activo = 1 ORDER BY fch_devolucion
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_activos_devolucion ON prestamos (fch_devolucion) WHERE is_activo = 1",
+        # Prestamos activos por libro (eliminar libro, disponibilidad)
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_libro_activo ON prestamos (libro_id) WHERE is_activo = 1",
+    ]),
+    (3, "Indices de auditoria", [
+        # Consultas por fecha (el rowid queda al final del indice: orden (fecha, id))
+        "CREATE INDEX IF NOT EXISTS idx_auditoria_fecha ON auditoria (fecha)",
+        # Historial de un usuario ordenado por fecha
+        "CREATE INDEX IF NOT EXISTS idx_auditoria_usuario_fecha ON auditoria (usuario_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS idx_auditoria_tabla_fecha ON auditoria (tabla_afectada, fecha)",
+    ]),
+    (4, "Busqueda de texto completo del catalogo (FTS5)", [
+        # Indice externo sobre libros: sin acentos (remove_diacritics) y con prefijos de 2 y 3 letras
+        """CREATE VIRTUAL TABLE IF NOT EXISTS libros_fts USING fts5(
+               titulo, autor, genero,
+               content='libros', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS libros_fts_ai AFTER INSERT ON libros BEGIN
+               INSERT INTO libros_fts (rowid, titulo, autor, genero) VALUES (new.id, new.titulo, new.autor, new.genero);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS libros_fts_ad AFTER DELETE ON libros BEGIN
+               INSERT INTO libros_fts (libros_fts, rowid, titulo, autor, genero) VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+           END""",
+        # Solo cuando cambian columnas indexadas (no en cada prestamo que toca cantidad)
+        """CREATE TRIGGER IF NOT EXISTS libros_fts_au AFTER UPDATE OF titulo, autor, genero ON libros BEGIN
+               INSERT INTO libros_fts (libros_fts, rowid, titulo, autor, genero) VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+               INSERT INTO libros_fts (rowid, titulo, autor, genero) VALUES (new.id, new.titulo, new.autor, new.genero);
+           END""",
+        # Indexa los libros que ya existian
+        "INSERT INTO libros_fts (libros_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Cache local de valores de la UF", [
+        """CREATE TABLE IF NOT EXISTS valores_uf
+               (fecha TEXT PRIMARY KEY,          -- YYYY-MM-DD
+                valor REAL NOT NULL,
+                actualizado TEXT NOT NULL)""",
+    ]),
+    (6, "Indice de usuarios por tipo para los listados paginados", [
+        # El rowid queda al final: sirve para WHERE tipo = ? AND id > ? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_usuarios_tipo ON usuarios (tipo)",
+    ]),
+    (7, "Vista de prestamos con dias restantes y estado calculados en SQL", [
+        # Reemplaza al indice parcial de la migracion 2: sirve para activos y devueltos por fecha
+        "DROP INDEX IF EXISTS idx_prestamos_activos_devolucion",
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_activo_devolucion ON prestamos (is_activo, fch_devolucion)",
+        # Filtrar por las columnas base (is_activo, fch_devolucion) para que se use el indice;
+        # dias_restantes y estado son solo para mostrar y ordenar.
+        """CREATE VIEW IF NOT EXISTS vista_prestamos AS
+           SELECT p.id, p.universitario_id, u.nombre AS nombre_universitario,
+                  p.libro_id, l.titulo, p.dias, p.fch_prestamo, p.fch_devolucion,
+                  p.is_activo, p.fch_devolucion_real,
+                  CAST(julianday(p.fch_devolucion) - julianday('now', 'localtime', 'start of day') AS INTEGER) AS dias_restantes,
+                  CASE WHEN p.is_activo = 1 AND p.fch_devolucion < date('now', 'localtime')
+                       THEN CAST(julianday('now', 'localtime', 'start of day') - julianday(p.fch_devolucion) AS INTEGER)
+                       ELSE 0 END AS dias_atraso,
+                  CASE WHEN p.is_activo = 0 THEN 'DEVUELTO'
+                       WHEN p.fch_devolucion < date('now', 'localtime') THEN 'ATRASADO'
+                       WHEN p.fch_devolucion = date('now', 'localtime') THEN 'HOY'
+                       ELSE 'ACTIVO' END AS estado
+           FROM prestamos p
+           JOIN usuarios u ON p.universitario_id = u.id
+           JOIN libros l ON p.libro_id = l.id""",
+    ]),
+    (8, "Contador de copias disponibles (cantidad = total de copias)", [
+        _agregar_disponibles,
+        # Libros insertados sin indicar disponibles (ej: desde el admin de Django)
+        """CREATE TRIGGER IF NOT EXISTS libros_disponibles_ai AFTER INSERT ON libros
+           WHEN new.disponibles IS NULL BEGIN
+               UPDATE libros SET disponibles = new.cantidad WHERE id = new.id;
+           END""",
+        # Al editar el total de copias se ajustan las disponibles en la misma diferencia;
+        # el CHECK impide dejar el total por debajo de las copias prestadas
+        """CREATE TRIGGER IF NOT EXISTS libros_disponibles_au AFTER UPDATE OF cantidad ON libros
+           WHEN new.cantidad <> old.cantidad BEGIN
+               UPDATE libros SET disponibles = disponibles + (new.cantidad - old.cantidad) WHERE id = new.id;
+           END""",
+    ]),
+    (9, "Version del catalogo para respuestas condicionales (ETag / Last-Modified)", [
+        """CREATE TABLE IF NOT EXISTS versiones
+               (tabla TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                modificado TEXT NOT NULL)            -- YYYY-MM-DD HH:MM:SS (UTC)""",
+        "INSERT OR IGNORE INTO versiones (tabla, version, modificado) VALUES ('libros', 1, datetime('now'))",
+        # Cualquier cambio en libros (incluye prestamos, que mueven disponibles) cambia la version
+        """CREATE TRIGGER IF NOT EXISTS libros_version_ai AFTER INSERT ON libros BEGIN
+               UPDATE versiones SET version = version + 1, modificado = datetime('now') WHERE tabla = 'libros';
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS libros_version_au AFTER UPDATE ON libros BEGIN
+               UPDATE versiones SET version = version + 1, modificado = datetime('now') WHERE tabla = 'libros';
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS libros_version_ad AFTER DELETE ON libros BEGIN
+               UPDATE versiones SET version = version + 1, modificado = datetime('now') WHERE tabla = 'libros';
+           END""",
+        # Orden por titulo / autor / genero / año con cursor (columna, id): el rowid queda al final del indice
+        "CREATE INDEX IF NOT EXISTS idx_libros_titulo ON libros (titulo)",
+        "CREATE INDEX IF NOT EXISTS idx_libros_autor ON libros (autor)",
+        "CREATE INDEX IF NOT EXISTS idx_libros_genero ON libros (genero)",
+        "CREATE INDEX IF NOT EXISTS idx_libros_año ON libros (año)",
+    ]),
+    (10, "Busqueda de usuarios (FTS5) y prestamos por libro", [
+        # Mismo esquema que libros_fts (migracion 4): sin acentos y con prefijos
+        """CREATE VIRTUAL TABLE IF NOT EXISTS usuarios_fts USING fts5(
+               nombre, email,
+               content='usuarios', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS usuarios_fts_ai AFTER INSERT ON usuarios BEGIN
+               INSERT INTO usuarios_fts (rowid, nombre, email) VALUES (new.id, new.nombre, new.email);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS usuarios_fts_ad AFTER DELETE ON usuarios BEGIN
+               INSERT INTO usuarios_fts (usuarios_fts, rowid, nombre, email) VALUES ('delete', old.id, old.nombre, old.email);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS usuarios_fts_au AFTER UPDATE OF nombre, email ON usuarios BEGIN
+               INSERT INTO usuarios_fts (usuarios_fts, rowid, nombre, email) VALUES ('delete', old.id, old.nombre, old.email);
+               INSERT INTO usuarios_fts (rowid, nombre, email) VALUES (new.id, new.nombre, new.email);
+           END""",
+        "INSERT INTO usuarios_fts (usuarios_fts) VALUES ('rebuild')",
+        # Prestamos (activos y devueltos) de los libros que coinciden con una busqueda
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_libro ON prestamos (libro_id)",
+    ]),
+    (11, "Registro de cambios para la sincronizacion incremental (/api/changes/)", [
+        # Una fila por escritura; el id (AUTOINCREMENT) es el cursor monotono de los clientes.
+        # propietario = universitario dueño del prestamo, para filtrar el feed de cada alumno
+        """CREATE TABLE IF NOT EXISTS cambios
+               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tabla TEXT NOT NULL,                 -- libros / prestamos / usuarios
+                registro_id INTEGER NOT NULL,
+                propietario INTEGER,
+                operacion TEXT NOT NULL,             -- I / U / D
+                fecha TEXT NOT NULL DEFAULT (datetime('now')))""",
+        "CREATE INDEX IF NOT EXISTS idx_cambios_fecha ON cambios (fecha)",
+        # Hasta que id se podaron cambios antiguos (los cursores anteriores deben recargar todo)
+        "INSERT OR IGNORE INTO versiones (tabla, version, modificado) VALUES ('cambios_podados', 0, datetime('now'))",
+        """CREATE TRIGGER IF NOT EXISTS libros_cambios_ai AFTER INSERT ON libros BEGIN
+               INSERT INTO cambios (tabla, registro_id, operacion) VALUES ('libros', new.id, 'I');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS libros_cambios_au AFTER UPDATE ON libros BEGIN
+               INSERT INTO cambios (tabla, registro_id, operacion) VALUES ('libros', new.id, 'U');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS libros_cambios_ad AFTER DELETE ON libros BEGIN
+               INSERT INTO cambios (tabla, registro_id, operacion) VALUES ('libros', old.id, 'D');
+           END""",
+        # Los prestamos tambien cambian el conteo de prestamos activos del universitario
+        """CREATE TRIGGER IF NOT EXISTS prestamos_cambios_ai AFTER INSERT ON prestamos BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('prestamos', new.id, new.universitario_id, 'I');
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', new.universitario_id, new.universitario_id, 'U');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS prestamos_cambios_au AFTER UPDATE ON prestamos BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('prestamos', new.id, new.universitario_id, 'U');
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', new.universitario_id, new.universitario_id, 'U');
+               -- Si el prestamo cambia de universitario, el anterior deja de verlo
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion)
+                   SELECT 'prestamos', old.id, old.universitario_id, 'D' WHERE old.universitario_id <> new.universitario_id;
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion)
+                   SELECT 'usuarios', old.universitario_id, old.universitario_id, 'U' WHERE old.universitario_id <> new.universitario_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS prestamos_cambios_ad AFTER DELETE ON prestamos BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('prestamos', old.id, old.universitario_id, 'D');
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', old.universitario_id, old.universitario_id, 'U');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS usuarios_cambios_au AFTER UPDATE OF nombre, email ON usuarios BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', new.id, new.id, 'U');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS usuarios_cambios_ad AFTER DELETE ON usuarios BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', old.id, old.id, 'D');
+           END""",
+        # El listado de usuarios del panel son los universitarios
+        """CREATE TRIGGER IF NOT EXISTS universitarios_cambios_ai AFTER INSERT ON universitarios BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', new.usuario_id, new.usuario_id, 'I');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS universitarios_cambios_ad AFTER DELETE ON universitarios BEGIN
+               INSERT INTO cambios (tabla, registro_id, propietario, operacion) VALUES ('usuarios', old.usuario_id, old.usuario_id, 'D');
+           END""",
+    ]),
+    (12, "Indice de los archivos de auditoria (ver archivo_auditoria.py)", [
+        # Un segmento por archivo comprimido; un mes sellado tiene uno o mas segmentos
+        """CREATE TABLE IF NOT EXISTS auditoria_archivo
+               (archivo TEXT PRIMARY KEY,           -- nombre dentro de la carpeta de archivo
+                periodo TEXT NOT NULL,              -- YYYY-MM
+                filas INTEGER NOT NULL,
+                primer_id INTEGER NOT NULL,
+                ultimo_id INTEGER NOT NULL,
+                fecha_min TEXT NOT NULL,
+                fecha_max TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                sellado TEXT NOT NULL DEFAULT (datetime('now', 'localtime')))""",
+        "CREATE INDEX IF NOT EXISTS idx_auditoria_archivo_periodo ON auditoria_archivo (periodo, fecha_min)",
+        # Que usuarios aparecen en cada segmento: la consulta de un usuario solo abre esos archivos
+        """CREATE TABLE IF NOT EXISTS auditoria_archivo_usuarios
+               (usuario_id INTEGER NOT NULL,
+                archivo TEXT NOT NULL,
+                filas INTEGER NOT NULL,
+                PRIMARY KEY (usuario_id, archivo)) WITHOUT ROWID""",
+    ]),
+    (13, "Indice de auditoria por accion (consulta de auditoria)", [
+        # Junto con los de la migracion 3 cada filtro (usuario, accion, tabla, fechas) tiene
+        # un indice que termina en (fecha, rowid): el orden de la paginacion por clave
+        "CREATE INDEX IF NOT EXISTS idx_auditoria_accion_fecha ON auditoria (accion, fecha)",
+    ]),
+    (14, "Estadisticas de circulacion por dia (libro, genero, universidad)", [
+        _crear_estadisticas,
+    ]),
+    (15, "Registro de multas por atraso (ver multas.py)", [
+        # Una fila por prestamo atrasado: ACUMULANDO mientras sigue activo (la recalcula el
+        # proceso nocturno), FINAL desde que se registra la devolucion
+        """CREATE TABLE IF NOT EXISTS multas
+               (prestamo_id INTEGER PRIMARY KEY,
+                universitario_id INTEGER NOT NULL,
+                dias_atraso INTEGER NOT NULL,
+                monto_uf REAL NOT NULL,
+                valor_uf REAL,                       -- NULL si no se conocia la UF: se cobra en UF
+                monto_clp REAL,
+                calculada TEXT NOT NULL,             -- YYYY-MM-DD: dia hasta el que se cuenta el atraso
+                estado TEXT NOT NULL,                -- ACUMULANDO / FINAL
+                actualizado TEXT NOT NULL DEFAULT (datetime('now', 'localtime')))""",
+        "CREATE INDEX IF NOT EXISTS idx_multas_universitario ON multas (universitario_id)",
+        "CREATE INDEX IF NOT EXISTS idx_multas_estado ON multas (estado)",
+        # Devoluciones atrasadas anteriores, con la UF guardada de ese dia (si esta). La tarifa
+        # es la de multas.py al publicar la migracion (0.01 UF por dia), fija: si la tarifa
+        # cambia, cambia para las multas nuevas, no lo que hace esta migracion
+        """INSERT OR IGNORE INTO multas (prestamo_id, universitario_id, dias_atraso, monto_uf, valor_uf, monto_clp, calculada, estado)
+           SELECT id, universitario_id, dias, dias * 0.01, uf, ROUND(dias * 0.01 * uf), real, 'FINAL'
+           FROM (SELECT p.id, p.universitario_id, date(p.fch_devolucion_real) AS real,
+                        CAST(julianday(p.fch_devolucion_real) - julianday(p.fch_devolucion) AS INTEGER) AS dias,
+                        (SELECT valor FROM valores_uf WHERE fecha <= date(p.fch_devolucion_real) ORDER BY fecha DESC LIMIT 1) AS uf
+                 FROM prestamos p
+                 WHERE p.is_activo = 0 AND date(p.fch_devolucion_real) > date(p.fch_devolucion))""",
+    ]),
+    (16, "Auditoria sin usuario_id (usuarios de Django sin fila en usuarios)", [
+        _auditoria_sin_usuario,
+    ]),
+]
+
+
+def init_db():
+    with transaccion() as c:
+        # Tabla base de usuarios
+        c.execute('''CREATE TABLE IF NOT EXISTS usuarios
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      nombre TEXT NOT NULL,
+                      email TEXT UNIQUE NOT NULL,
+                      password_hash TEXT NOT NULL,
+                      tipo TEXT NOT NULL)''')
+        # Tabla para bibliotecarios
+        c.execute('''CREATE TABLE IF NOT EXISTS bibliotecarios
+                     (usuario_id INTEGER PRIMARY KEY,
+                      universidad TEXT NOT NULL,
+                      FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
+        # Tabla para universitarios
+        c.execute('''CREATE TABLE IF NOT EXISTS universitarios
+                     (usuario_id INTEGER PRIMARY KEY,
+                      universidad TEXT NOT NULL,
+                      FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
+        # Tabla para admin
+        c.execute('''CREATE TABLE IF NOT EXISTS admin
+                     (usuario_id INTEGER PRIMARY KEY,
+                      FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
+
+        # Tabla de libros
+        c.execute('''CREATE TABLE IF NOT EXISTS libros
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      titulo TEXT NOT NULL,
+                      autor TEXT NOT NULL,
+                      genero TEXT NOT NULL,
+                      año INTEGER NOT NULL,
+                      cantidad INTEGER NOT NULL,                     -- Total de copias
+                      isbn TEXT UNIQUE NOT NULL,
+                      disponibles INTEGER CHECK (disponibles >= 0)   -- Copias en estante (ver prestamos.py)
+                      )''')
                   
-    # Tabla de prestamos
-    c.execute('''CREATE TABLE IF NOT EXISTS prestamos
+        # Tabla de prestamos
+        c.execute('''CREATE TABLE IF NOT EXISTS prestamos
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      universitario_id INTEGER NOT NULL,
+                      libro_id INTEGER NOT NULL,
+                      dias INTEGER NOT NULL,
+                      fch_prestamo DATE NOT NULL,
+                      fch_devolucion DATE NOT NULL,
+                      is_activo INTEGER NOT NULL DEFAULT 1,         -- NUEVO: 1=Activo, 0=Devuelto
+                      fch_devolucion_real DATE,                      -- NUEVO: Fecha en que se devuelve
+                      FOREIGN KEY (universitario_id) REFERENCES universitarios (usuario_id),
+                      FOREIGN KEY (libro_id) REFERENCES libros (id))''')
+
+         # Tabla de auditoría
+        c.execute('''CREATE TABLE IF NOT EXISTS auditoria
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  universitario_id INTEGER NOT NULL,
-                  libro_id INTEGER NOT NULL,
-                  dias INTEGER NOT NULL,
-                  fch_prestamo DATE NOT NULL,
-                  fch_devolucion DATE NOT NULL,
-                  is_activo INTEGER NOT NULL DEFAULT 1,         -- NUEVO: 1=Activo, 0=Devuelto
-                  fch_devolucion_real DATE,                      -- NUEVO: Fecha en que se devuelve
-                  FOREIGN KEY (universitario_id) REFERENCES universitarios (usuario_id),
-                  FOREIGN KEY (libro_id) REFERENCES libros (id))''')
-
-     # Tabla de auditoría
-    c.execute('''CREATE TABLE IF NOT EXISTS auditoria
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              usuario_id INTEGER NOT NULL,
-              accion TEXT NOT NULL,
-              tabla_afectada TEXT NOT NULL,
-              detalle TEXT,
-              fecha DATE NOT NULL,
-              FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
+                  usuario_id INTEGER NOT NULL,
+                  accion TEXT NOT NULL,
+                  tabla_afectada TEXT NOT NULL,
+                  detalle TEXT,
+                  fecha DATE NOT NULL,
+                  FOREIGN KEY (usuario_id) REFERENCES usuarios (id))''')
               
-    conn.commit()
-    conn.close()
+    migrar()
+
+
+def version_actual(c):
+    return c.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrar():
+    """Aplica en orden las migraciones pendientes segun PRAGMA user_version."""
+    # IMMEDIATE: si dos terminales arrancan a la vez, solo una aplica las migraciones
+    with transaccion('IMMEDIATE') as c:
+        version = version_actual(c)
+        for numero, descripcion, pasos in MIGRACIONES:
+            if numero <= version:
+                continue
+            for paso in pasos:
+                if callable(paso):
+                    paso(c)
+                else:
+                    c.execute(paso)
+            c.execute(f"PRAGMA user_version = {numero}")
+            print(f"Migración {numero} aplicada: {descripcion}")
+    # Actualiza las estadisticas del planificador para los indices nuevos
+    get_conexion().execute("PRAGMA optimize")
+
 
 init_db()
 print("Base de datos cargada exitosamente.")
\ No newline at end of file
@@ -0,0 +1,239 @@
+import os
+import sys
+import gzip
+import json
+import heapq
+from collections import Counter
+from datetime import date
+from itertools import groupby, islice
+
+import conexion
+from conexion import get_conexion, transaccion
+from listados import TAMANO_PAGINA
+
+# Particion mensual de la auditoria.
+# La tabla auditoria solo guarda los ultimos MESES_EN_CALIENTE meses; los meses
+# anteriores se sellan: sus filas se exportan a un archivo comprimido (JSON por linea,
+# ordenado por fecha e id) y se borran de la base. Asi biblioteca.db no crece con
+# el historial y el VACUUM / respaldo toman un tiempo acotado.
+#
+# Los archivos no se modifican nunca. Si llegan filas tardias de un mes ya sellado
+# (ej: auditoria_pendiente.jsonl reintentado), se sellan en un segmento nuevo del mismo mes.
+# El indice de segmentos esta en la base (tablas auditoria_archivo*, migracion 12) y
+# tambien en indice.jsonl dentro de la carpeta, para poder leer el archivo sin la base.
+#
+# consultar() recorre los segmentos archivados y la tabla como una sola secuencia;
+# pagina() la corta en paginas por clave (fecha, id), como listados.py.
+
+# Un semestre completo queda en la tabla: "lo que hizo X el semestre pasado" se responde
+# con los indices, sin abrir archivos
+MESES_EN_CALIENTE = 6
+TAMANO_BLOQUE = 5000      # Lineas por escritura al archivo comprimido
+
+SQL_FILAS = "SELECT id, usuario_id, accion, tabla_afectada, detalle, fecha FROM auditoria"
+
+
+def carpeta():
+    """Carpeta de los archivos (BIBLIOTECA_AUDITORIA_ARCHIVO o auditoria_archivo junto a la base)."""
+    ruta = os.environ.get('BIBLIOTECA_AUDITORIA_ARCHIVO')
+    if not ruta:
+        ruta = os.path.join(os.path.dirname(os.path.abspath(conexion.DB_PATH)), 'auditoria_archivo')
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def _periodo_siguiente(periodo):
+    anio, mes = map(int, periodo.split('-'))
+    anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return f"{anio:04d}-{mes:02d}"
+
+
+def periodo_limite(meses=MESES_EN_CALIENTE, hoy=None):
+    """Primer mes (YYYY-MM) que se queda en la tabla; los anteriores se pueden sellar."""
+    hoy = hoy or date.today()
+    total = hoy.year * 12 + hoy.month - 1 - (meses - 1)
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def _sincronizar_carpeta(ruta):
+    # Que el rename quede en disco antes de borrar las filas (no existe en Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(ruta, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def sellar_periodo(periodo):
+    """
+    Exporta las filas del mes a un segmento nuevo y las borra de la tabla.
+    Devuelve los datos del segmento (dict) o None si el mes no tenia filas.
+    """
+    desde, hasta = f"{periodo}-01", f"{_periodo_siguiente(periodo)}-01"
+    conn = get_conexion()
+    previos = conn.execute("SELECT COUNT(*) FROM auditoria_archivo WHERE periodo = ?", (periodo,)).fetchone()[0]
+    nombre = f"auditoria-{periodo}.jsonl.gz" if previos == 0 else f"auditoria-{periodo}.{previos + 1}.jsonl.gz"
+    ruta_carpeta = carpeta()
+    ruta = os.path.join(ruta_carpeta, nombre)
+
+    # Un solo SELECT = una foto de la tabla; las filas que lleguen despues tienen ids mayores
+    filas = 0
+    usuarios = Counter()
+    primer_id = ultimo_id = fecha_min = fecha_max = None
+    with open(ruta + '.tmp', 'wb') as crudo:
+        with gzip.GzipFile(fileobj=crudo, mode='wb', compresslevel=6, mtime=0) as comprimido:
+            lineas = []
+            for fila in conn.execute(f"{SQL_FILAS} WHERE fecha >= ? AND fecha < ? ORDER BY fecha, id", (desde, hasta)):
+                lineas.append(json.dumps(fila, ensure_ascii=False))
+                if len(lineas) == TAMANO_BLOQUE:
+                    comprimido.write(("\n".join(lineas) + "\n").encode('utf-8'))
+                    lineas.clear()
+                filas += 1
+                usuarios[fila[1]] += 1
+                primer_id = fila[0] if primer_id is None else min(primer_id, fila[0])
+                ultimo_id = fila[0] if ultimo_id is None else max(ultimo_id, fila[0])
+                fecha_min = fecha_min or fila[5]
+                fecha_max = fila[5]
+            if lineas:
+                comprimido.write(("\n".join(lineas) + "\n").encode('utf-8'))
+        crudo.flush()
+        os.fsync(crudo.fileno())
+    if filas == 0:
+        os.remove(ruta + '.tmp')
+        return None
+    # Si quedo un archivo de un intento anterior que no alcanzo a registrarse, se reemplaza
+    os.replace(ruta + '.tmp', ruta)
+    _sincronizar_carpeta(ruta_carpeta)
+
+    segmento = {
+        'archivo': nombre, 'periodo': periodo, 'filas': filas,
+        'primer_id': primer_id, 'ultimo_id': ultimo_id,
+        'fecha_min': fecha_min, 'fecha_max': fecha_max,
+        'bytes': os.path.getsize(ruta),
+    }
+    with transaccion('IMMEDIATE') as c:
+        c.execute("""INSERT OR REPLACE INTO auditoria_archivo
+                     (archivo, periodo, filas, primer_id, ultimo_id, fecha_min, fecha_max, bytes)
+                     VALUES (:archivo, :periodo, :filas, :primer_id, :ultimo_id, :fecha_min, :fecha_max, :bytes)""", segmento)
+        c.executemany("INSERT OR REPLACE INTO auditoria_archivo_usuarios (usuario_id, archivo, filas) VALUES (?, ?, ?)",
+                      [(usuario_id, nombre, cantidad) for usuario_id, cantidad in usuarios.items() if usuario_id is not None])
+        c.execute("DELETE FROM auditoria WHERE fecha >= ? AND fecha < ? AND id <= ?", (desde, hasta, ultimo_id))
+
+    with open(os.path.join(ruta_carpeta, 'indice.jsonl'), 'a', encoding='utf-8') as indice:
+        indice.write(json.dumps({**segmento, 'usuarios': sorted(u for u in usuarios if u is not None)}) + "\n")
+    return segmento
+
+
+def rotar(meses=MESES_EN_CALIENTE, vacuum=False):
+    """Sella todos los meses anteriores a los que quedan en caliente. Devuelve los segmentos creados."""
+    limite = periodo_limite(meses)
+    conn = get_conexion()
+    sellados = []
+    while True:
+        # MIN(fecha) usa idx_auditoria_fecha: no recorre la tabla
+        mas_antigua = conn.execute("SELECT MIN(fecha) FROM auditoria").fetchone()[0]
+        if mas_antigua is None or mas_antigua[:7] >= limite:
+            break
+        segmento = sellar_periodo(mas_antigua[:7])
+        if segmento is None:
+            # Fecha con formato inesperado: no se puede ubicar en un mes
+            print(f"No se pudo sellar la auditoría desde {mas_antigua!r} (formato de fecha inválido).")
+            break
+        sellados.append(segmento)
+    if sellados:
+        if vacuum:
+            conn.execute("VACUUM")
+        # Con WAL el archivo de la base se achica recien al pasar el WAL a la base
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sellados
+
+
+def _leer_segmento(nombre):
+    with gzip.open(os.path.join(carpeta(), nombre), 'rt', encoding='utf-8') as archivo:
+        for linea in archivo:
+            yield tuple(json.loads(linea))
+
+
+def _clave(fila):
+    return (fila[5], fila[0])
+
+
+def _archivadas(usuario_id, desde, hasta):
+    sql = "SELECT periodo, archivo FROM auditoria_archivo WHERE 1 = 1"
+    parametros = []
+    if usuario_id is not None:
+        sql += " AND archivo IN (SELECT archivo FROM auditoria_archivo_usuarios WHERE usuario_id = ?)"
+        parametros.append(usuario_id)
+    if desde:
+        # desde puede ser la fecha de la ultima fila vista (paginacion)
+        sql += " AND fecha_max >= ?"
+        parametros.append(desde)
+    if hasta:
+        sql += " AND fecha_min < ?"
+        parametros.append(hasta)
+    segmentos = get_conexion().execute(sql + " ORDER BY periodo, archivo", parametros).fetchall()
+    # Los meses no se solapan: se leen en orden; los segmentos de un mismo mes se intercalan
+    for _, del_periodo in groupby(segmentos, key=lambda s: s[0]):
+        yield from heapq.merge(*[_leer_segmento(archivo) for _, archivo in del_periodo], key=_clave)
+
+
+def _en_tabla(usuario_id, accion, tabla, desde, hasta, despues_de):
+    condiciones, parametros = [], []
+    for columna, valor in (('usuario_id', usuario_id), ('accion', accion), ('tabla_afectada', tabla)):
+        if valor is not None:
+            condiciones.append(f"{columna} = ?")
+            parametros.append(valor)
+    if desde:
+        condiciones.append("fecha >= ?")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("fecha < ?")
+        parametros.append(hasta)
+    if despues_de is not None:
+        condiciones.append("(fecha, id) > (?, ?)")
+        parametros.extend(despues_de)
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    yield from get_conexion().execute(f"{SQL_FILAS}{where} ORDER BY fecha, id", parametros)
+
+
+def consultar(usuario_id=None, accion=None, tabla=None, desde=None, hasta=None, despues_de=None):
+    """
+    Genera los eventos (id, usuario_id, accion, tabla_afectada, detalle, fecha) ordenados por
+    fecha e id, de los meses archivados y de la tabla. desde se incluye, hasta no ('YYYY-MM-DD').
+    despues_de = (fecha, id) de la última fila vista: sigue desde ahí.
+    """
+    def coincide(fila):
+        return ((usuario_id is None or fila[1] == usuario_id)
+                and (accion is None or fila[2] == accion)
+                and (tabla is None or fila[3] == tabla)
+                and (not desde or fila[5] >= desde)
+                and (not hasta or fila[5] < hasta)
+                and (despues_de is None or _clave(fila) > tuple(despues_de)))
+
+    inicio = max(desde or '', despues_de[0] if despues_de else '')
+    archivadas = filter(coincide, _archivadas(usuario_id, inicio, hasta))
+    en_tabla = _en_tabla(usuario_id, accion, tabla, desde, hasta, despues_de)
+    # Puede haber filas tardias de meses ya sellados en la tabla: se intercalan por fecha
+    return heapq.merge(archivadas, en_tabla, key=_clave)
+
+
+def pagina(usuario_id=None, accion=None, tabla=None, desde=None, hasta=None, despues_de=None, tamano=TAMANO_PAGINA):
+    """Devuelve (filas, clave_siguiente) como listados.obtener_pagina; clave_siguiente es (fecha, id) o None."""
+    filas = list(islice(consultar(usuario_id, accion, tabla, desde, hasta, despues_de), tamano + 1))
+    if len(filas) <= tamano:
+        return filas, None
+    filas = filas[:tamano]
+    return filas, _clave(filas[-1])
+
+
+if __name__ == "__main__":
+    # Uso: python archivo_auditoria.py [--meses N] [--vacuum]
+    import BD # Asegura el esquema antes de sellar
+    argumentos = sys.argv[1:]
+    meses = int(argumentos[argumentos.index('--meses') + 1]) if '--meses' in argumentos else MESES_EN_CALIENTE
+    segmentos = rotar(meses, vacuum='--vacuum' in argumentos)
+    for segmento in segmentos:
+        print(f"{segmento['archivo']}: {segmento['filas']} eventos ({segmento['bytes']} bytes)")
+    if not segmentos:
+        print(f"No hay meses de auditoría por archivar (se mantienen {meses} meses en la base).")
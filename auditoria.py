@@ -0,0 +1,117 @@
+import os
+import json
+import sqlite3
+import time
+import threading
+import atexit
+from datetime import datetime
+from conexion import transaccion
+
+# Escritor de auditoria con buffer: los eventos se acumulan en memoria y se
+# guardan juntos con executemany en una sola transaccion (un solo fsync).
+# Un solo hilo de fondo (con su propia conexion, abierta una vez) guarda lo pendiente
+# a los INTERVALO_FLUSH segundos del primer evento.
+# ARCHIVO_PENDIENTES solo cubre los errores de la base (sqlite3.Error). Al salir normalmente
+# atexit guarda el buffer, pero si el proceso se cae (kill -9, corte de luz) se pierden los
+# eventos que estaban solo en memoria: hasta TAMANO_LOTE eventos o INTERVALO_FLUSH segundos.
+# Los eventos que no se pueden perder se registran con cursor, en la transaccion del cambio.
+
+TAMANO_LOTE = 50          # Se guarda al juntar esta cantidad de eventos
+INTERVALO_FLUSH = 2.0     # ...o a los pocos segundos del primer evento pendiente
+
+# Si la base no esta disponible los eventos se guardan aqui y se reintentan en el siguiente flush
+ARCHIVO_PENDIENTES = 'auditoria_pendiente.jsonl'
+
+SQL_INSERT = "INSERT INTO auditoria (usuario_id, accion, tabla_afectada, detalle, fecha) VALUES (?, ?, ?, ?, ?)"
+
+_buffer = []
+_lock = threading.Lock()
+_hay_pendientes = threading.Event()
+_hilo = None
+
+
+def _fila(usuario_id, accion, tabla_afectada, detalle):
+    fch_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return (usuario_id, accion, tabla_afectada, detalle, fch_actual)
+
+
+def registrar(usuario_id, accion, tabla_afectada, detalle, cursor=None):
+    """
+    Registra un evento de auditoria.
+    Con cursor, el evento se escribe en la transaccion en curso (se confirma o
+    se descarta junto con el cambio que audita). Sin cursor, queda en el buffer.
+    """
+    fila = _fila(usuario_id, accion, tabla_afectada, detalle)
+    if cursor is not None:
+        cursor.execute(SQL_INSERT, fila)
+        return
+
+    global _hilo
+    with _lock:
+        _buffer.append(fila)
+        lleno = len(_buffer) >= TAMANO_LOTE
+        if not lleno:
+            if _hilo is None or not _hilo.is_alive():
+                _hilo = threading.Thread(target=_vaciar_periodicamente, name='auditoria', daemon=True)
+                _hilo.start()
+            _hay_pendientes.set()
+    if lleno:
+        flush()
+
+
+def _vaciar_periodicamente():
+    while True:
+        _hay_pendientes.wait()
+        time.sleep(INTERVALO_FLUSH)
+        try:
+            flush()
+        except Exception as e:
+            # El hilo sigue vivo: los eventos quedan en el archivo de pendientes
+            print(f"Error al registrar auditoría: {e}")
+
+
+def _leer_pendientes():
+    # Se renombra primero para que dos procesos no reintenten el mismo archivo
+    if not os.path.exists(ARCHIVO_PENDIENTES):
+        return [], None
+    tomado = f"{ARCHIVO_PENDIENTES}.{os.getpid()}"
+    try:
+        os.replace(ARCHIVO_PENDIENTES, tomado)
+    except OSError:
+        return [], None
+    with open(tomado, encoding='utf-8') as archivo:
+        filas = [tuple(json.loads(linea)) for linea in archivo if linea.strip()]
+    return filas, tomado
+
+
+def _guardar_pendientes(filas):
+    with open(ARCHIVO_PENDIENTES, 'a', encoding='utf-8') as archivo:
+        for fila in filas:
+            archivo.write(json.dumps(fila, ensure_ascii=False) + "\n")
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+
+def flush():
+    """Guarda todos los eventos pendientes en una sola transaccion."""
+    with _lock:
+        filas = list(_buffer)
+        _buffer.clear()
+        _hay_pendientes.clear()
+
+    pendientes, tomado = _leer_pendientes()
+    filas = pendientes + filas
+    if not filas:
+        return
+
+    try:
+        with transaccion() as c:
+            c.executemany(SQL_INSERT, filas)
+    except sqlite3.Error as e:
+        print(f"Error al registrar auditoría, se reintentará más tarde: {e}")
+        _guardar_pendientes(filas)
+    if tomado:
+        os.remove(tomado)
+
+
+atexit.register(flush)
@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+import conexion
+
+# Base de datos de las pruebas del CLI. BD.py crea y migra la base al importarse: antes de
+# importarlo conexion.DB_PATH apunta a un directorio temporal, nunca a la biblioteca.db real.
+# Cada prueba (BaseDePrueba) usa despues una base nueva en su propio directorio temporal,
+# asi los archivos de prueba no comparten la base aunque se ejecuten juntos.
+_al_importar = tempfile.TemporaryDirectory()
+conexion.DB_PATH = os.path.join(_al_importar.name, 'biblioteca_test.db')
+
+import BD
+
+
+class BaseDePrueba(unittest.TestCase):
+    """Prueba con una base nueva y migrada (BD.init_db) en self.directorio."""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.addCleanup(setattr, conexion, 'DB_PATH', conexion.DB_PATH)
+        # Las limpiezas corren en orden inverso: primero se cierran las conexiones
+        self.addCleanup(conexion.cerrar_conexiones)
+        conexion.cerrar_conexiones()
+        self.directorio = directorio.name
+        conexion.DB_PATH = os.path.join(self.directorio, 'biblioteca_test.db')
+        BD.init_db()
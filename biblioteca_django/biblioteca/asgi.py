@@ -11,6 +11,7 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biblioteca.settings')
+# Perfil ASGI: pool de hilos para la BD en las vistas async (ver settings_asgi.py)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biblioteca.settings_asgi')
 
 application = get_asgi_application()
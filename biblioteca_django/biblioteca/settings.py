@@ -10,11 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Modulos compartidos con el CLI (BD.py, multas.py) en la raiz del proyecto
+if str(BASE_DIR.parent) not in sys.path:
+    sys.path.append(str(BASE_DIR.parent))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -46,6 +51,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.roles.RolMiddleware',
+    'core.utils.AuditoriaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +88,29 @@ DATABASES = {
 }
 
 
+# Cache (roles en sesion y catalogo serializado, ver core/cache_catalogo.py)
+# Con varios procesos conviene una cache compartida (Redis / Memcached) para que
+# la invalidacion de un proceso llegue a los demas; con LocMem cada proceso
+# nota los cambios de otro a mas tardar en cache_catalogo.VERIFICAR_CADA segundos.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'biblioteca',
+    }
+}
+
+# Auditoria (core/utils.py): los eventos de cada request los guarda un hilo escritor,
+# varios requests por transaccion. False: un bulk_create al final de cada request.
+AUDITORIA_EN_SEGUNDO_PLANO = True
+
+# Eventos de auditoria que la base no pudo guardar (uno por linea, JSON)
+AUDITORIA_NO_GUARDADA = BASE_DIR / 'auditoria_no_guardada.jsonl'
+
+# Meses de auditoria ya sellados por archivo_auditoria.py (carpeta junto a la base)
+AUDITORIA_ARCHIVO = BASE_DIR / 'auditoria_archivo'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,24 @@
+"""
+Perfil de despliegue ASGI: un proceso con event loop atiende muchas conexiones del
+panel a la vez y las consultas de las vistas async van a un pool de hilos propio
+(core/asincrono.py), cada uno con su conexion a SQLite.
+
+    pip install uvicorn
+    DJANGO_SETTINGS_MODULE=biblioteca.settings_asgi uvicorn biblioteca.asgi:application --workers 1
+
+Con mas de un worker hay que pasar a una cache compartida (ver CACHES en settings.py).
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# Hilos con conexion propia para las vistas async. SQLite en WAL permite lecturas en
+# paralelo; las escrituras siguen siendo de a una (timeout espera el candado).
+HILOS_BD = 16
+
+DATABASES['default']['OPTIONS'] = {
+    'timeout': 20,
+    'init_command': 'PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL;',
+}
+# Las conexiones de los hilos del pool se reutilizan entre requests; asincrono.en_pool
+# cierra las que quedaron con errores antes de usarlas.
+DATABASES['default']['CONN_MAX_AGE'] = None
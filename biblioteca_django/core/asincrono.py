@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+# Pool de hilos para las consultas de las vistas async (perfil ASGI, ver biblioteca/settings_asgi.py).
+# El ORM async de Django manda todo al mismo hilo compartido (thread_sensitive): con
+# cientos de conexiones del panel las consultas quedarian en fila de a una. Aqui cada
+# hilo del pool tiene su propia conexion a SQLite y, con WAL, las lecturas van en paralelo.
+#
+# HILOS_BD = 0 (valor por defecto, WSGI y pruebas) usa el hilo compartido como el ORM async:
+# mismo hilo y misma conexion que el resto del request.
+
+HILOS_BD_POR_DEFECTO = 0
+
+_pool = None
+_candado = threading.Lock()
+
+
+def hilos_bd():
+    return getattr(settings, 'HILOS_BD', HILOS_BD_POR_DEFECTO)
+
+
+def _obtener_pool():
+    global _pool
+    with _candado:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=hilos_bd(), thread_name_prefix='bd')
+        return _pool
+
+
+def _con_conexion_sana(funcion, *args, **kwargs):
+    # Los hilos del pool no pasan por request_started / request_finished: aqui se
+    # cierran las conexiones vencidas (CONN_MAX_AGE) o con errores antes de usarlas
+    close_old_connections()
+    return funcion(*args, **kwargs)
+
+
+async def en_pool(funcion, *args, **kwargs):
+    """Ejecuta funcion (síncrona, puede usar el ORM) en un hilo del pool de la BD y devuelve su resultado."""
+    if not hilos_bd():
+        # El hilo compartido si pasa por request_finished: sus conexiones las maneja Django
+        return await sync_to_async(partial(funcion, *args, **kwargs), thread_sensitive=True)()
+    llamada = partial(_con_conexion_sana, funcion, *args, **kwargs)
+    return await sync_to_async(llamada, thread_sensitive=False, executor=_obtener_pool())()
+
+
+
+def bajo_asgi(request):
+    """
+    True si el request llegó por ASGI. Con WSGI (wsgi.py, runserver) Django junta en una lista
+    una respuesta en flujo async antes de enviarla: ahí hay que usar un generador síncrono.
+    """
+    return isinstance(request, ASGIRequest)
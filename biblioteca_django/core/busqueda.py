@@ -0,0 +1,101 @@
+import re
+
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Libro, Prestamo, Universitario
+from .serializadores import libro_serializer, iterar_prestamos, iterar_universitarios
+
+# Busqueda del catalogo sobre el indice FTS5 libros_fts, y de usuarios sobre usuarios_fts.
+# Los indices y sus triggers se crean con las migraciones de BD.py (migraciones 4 y 10),
+# igual que el resto de las tablas de los modelos no administrados.
+
+TIPOS = ('books', 'users', 'loans')
+LIMITE = 10
+MAX_LIMITE = 50
+
+POR_PAGINA = 20
+
+# Peso de cada columna en bm25: titulo, autor, genero
+PESOS_BM25 = (10.0, 5.0, 1.0)
+
+
+def expresion_fts(texto):
+    """Convierte el texto de búsqueda en una consulta FTS5 por prefijos: 'garcia cien' -> '"garcia"* "cien"*'."""
+    terminos = re.findall(r'\w+', texto or '')
+    return " ".join(f'"{termino}"*' for termino in terminos)
+
+
+def buscar_libros(texto, pagina=1, por_pagina=POR_PAGINA):
+    """Devuelve (libros, hay_mas) ordenados por relevancia bm25."""
+    consulta = expresion_fts(texto)
+    if not consulta:
+        return [], False
+    pagina = max(1, int(pagina))
+
+    libros = list(Libro.objects.raw(
+        f"""
+        SELECT l.* FROM libros_fts
+        JOIN libros l ON l.id = libros_fts.rowid
+        WHERE libros_fts MATCH %s
+        ORDER BY bm25(libros_fts, {', '.join(str(p) for p in PESOS_BM25)})
+        LIMIT %s OFFSET %s
+        """,
+        [consulta, por_pagina + 1, (pagina - 1) * por_pagina],
+    ))
+    return libros[:por_pagina], len(libros) > por_pagina
+
+
+def _ids_coincidentes(tabla_fts, consulta):
+    return RawSQL(f"SELECT rowid FROM {tabla_fts} WHERE {tabla_fts} MATCH %s", [consulta])
+
+
+def _grupo(filas, hay_mas):
+    return {'results': filas, 'has_more': hay_mas}
+
+
+def buscar_usuarios(texto, limite=LIMITE):
+    """Universitarios cuyo nombre o email coincide, serializados. Devuelve (filas, hay_mas)."""
+    consulta = expresion_fts(texto)
+    if not consulta:
+        return [], False
+    universitarios = (Universitario.objects
+                      .filter(usuario_id__in=_ids_coincidentes('usuarios_fts', consulta))
+                      .order_by('usuario__nombre', 'usuario_id')[:limite + 1])
+    filas = list(iterar_universitarios(universitarios))
+    return filas[:limite], len(filas) > limite
+
+
+def buscar_prestamos(texto, limite=LIMITE, universitario_id=None):
+    """
+    Préstamos cuyo libro o universitario coincide, activos primero. Devuelve (filas, hay_mas).
+    Con universitario_id solo se buscan los préstamos de ese universitario.
+    """
+    consulta = expresion_fts(texto)
+    if not consulta:
+        return [], False
+    prestamos = Prestamo.objects.filter(
+        Q(libro_id__in=_ids_coincidentes('libros_fts', consulta))
+        | Q(universitario_id__in=_ids_coincidentes('usuarios_fts', consulta))
+    )
+    if universitario_id is not None:
+        prestamos = prestamos.filter(universitario_id=universitario_id)
+    prestamos = prestamos.order_by('-is_activo', '-fch_prestamo', '-id')[:limite + 1]
+    filas = list(iterar_prestamos(prestamos))
+    return filas[:limite], len(filas) > limite
+
+
+def buscar_todo(texto, tipos=TIPOS, limite=LIMITE, es_bibliotecario=False, universitario_id=None):
+    """
+    Búsqueda global de la barra superior: un grupo {'results', 'has_more'} por tipo pedido.
+    Los usuarios solo se buscan para bibliotecarios; los demás ven solo sus préstamos.
+    """
+    grupos = {}
+    if 'books' in tipos:
+        libros, hay_mas = buscar_libros(texto, 1, limite)
+        grupos['books'] = _grupo([libro_serializer(libro) for libro in libros], hay_mas)
+    if 'users' in tipos and es_bibliotecario:
+        grupos['users'] = _grupo(*buscar_usuarios(texto, limite))
+    if 'loans' in tipos:
+        grupos['loans'] = _grupo(*buscar_prestamos(texto, limite, None if es_bibliotecario else universitario_id))
+    return grupos
@@ -0,0 +1,115 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+
+from .catalogo import version_catalogo
+from .models import Libro
+from .serializadores import libro_serializer
+
+# Cache del catalogo serializado (paginas de /api/books/ y libros individuales).
+# Las claves llevan la version del catalogo (tabla versiones, migracion 9): cuando
+# el catalogo cambia, las claves viejas simplemente dejan de usarse y expiran solas.
+#
+# La version se guarda en la cache por VERIFICAR_CADA segundos:
+# - las vistas que escriben envian catalogo_modificado al confirmar y la version se
+#   vuelve a leer en el acto (write-through);
+# - las escrituras del CLI suben la version en la BD (triggers) y se notan a mas
+#   tardar en VERIFICAR_CADA segundos. Ese es el maximo de datos viejos.
+
+VERIFICAR_CADA = 5      # segundos
+TTL_PAYLOAD = 600
+
+CLAVE_VERSION = 'catalogo:version'
+CLAVES_CONTADORES = {'hits': 'catalogo:hits', 'misses': 'catalogo:misses'}
+
+catalogo_modificado = Signal()
+
+
+def _leer_version():
+    version, modificado = version_catalogo()
+    datos = (version, modificado, time.time())
+    cache.set(CLAVE_VERSION, datos, VERIFICAR_CADA)
+    return datos
+
+
+def version():
+    """(version, modificado) del catálogo; como mucho VERIFICAR_CADA segundos de antigüedad."""
+    datos = cache.get(CLAVE_VERSION)
+    if datos is None:
+        datos = _leer_version()
+    return datos[0], datos[1]
+
+
+def _al_modificar_catalogo(sender, **kwargs):
+    _leer_version()
+
+
+catalogo_modificado.connect(_al_modificar_catalogo, dispatch_uid='cache_catalogo')
+
+
+def notificar_cambio():
+    """Llamar al escribir en libros o préstamos: la cache se actualiza cuando la transacción se confirma."""
+    transaction.on_commit(lambda: catalogo_modificado.send(sender=Libro))
+
+
+def _contar(resultado, cantidad=1):
+    clave = CLAVES_CONTADORES[resultado]
+    cache.add(clave, 0, None)
+    try:
+        cache.incr(clave, cantidad)
+    except ValueError:
+        # La clave se expulsó entre add e incr
+        cache.set(clave, cantidad, None)
+
+
+def obtener(clave, generar):
+    """Devuelve (valor, desde_cache). Si no está en la cache para la versión actual, lo genera y lo guarda."""
+    actual, _ = version()
+    clave = f'catalogo:{actual}:{clave}'
+    valor = cache.get(clave)
+    if valor is not None:
+        _contar('hits')
+        return valor, True
+    _contar('misses')
+    valor = generar()
+    cache.set(clave, valor, TTL_PAYLOAD)
+    return valor, False
+
+
+def libros_por_id(ids, actual=None):
+    """
+    Libros serializados por id (dict id -> payload); solo consulta la BD por los que no están en la cache.
+    actual permite usar una versión recién leída de la BD cuando no se aceptan datos viejos (feed de cambios).
+    """
+    if actual is None:
+        actual, _ = version()
+    claves = {libro_id: f'catalogo:{actual}:libro:{libro_id}' for libro_id in ids}
+    en_cache = cache.get_many(claves.values())
+    resultado = {libro_id: en_cache[clave] for libro_id, clave in claves.items() if clave in en_cache}
+    faltantes = [libro_id for libro_id in ids if libro_id not in resultado]
+    if resultado:
+        _contar('hits', len(resultado))
+    if faltantes:
+        _contar('misses', len(faltantes))
+        nuevos = {libro.pk: libro_serializer(libro) for libro in Libro.objects.filter(pk__in=faltantes)}
+        cache.set_many({claves[libro_id]: data for libro_id, data in nuevos.items()}, TTL_PAYLOAD)
+        resultado.update(nuevos)
+    return resultado
+
+
+def estadisticas():
+    """Aciertos, fallos y antigüedad de la versión usada (para el panel de bibliotecarios)."""
+    contadores = cache.get_many(CLAVES_CONTADORES.values())
+    hits = contadores.get(CLAVES_CONTADORES['hits'], 0)
+    misses = contadores.get(CLAVES_CONTADORES['misses'], 0)
+    datos = cache.get(CLAVE_VERSION)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        'version': datos[0] if datos else None,
+        'version_age_seconds': round(time.time() - datos[2], 1) if datos else None,
+        'max_staleness_seconds': VERIFICAR_CADA,
+    }
@@ -0,0 +1,125 @@
+import time
+
+from django.db import connection, transaction
+
+from .cache_catalogo import libros_por_id
+from .catalogo import version_catalogo
+from .models import Prestamo, Universitario
+from .serializadores import iterar_prestamos, iterar_universitarios
+
+# Feed de cambios para /api/changes/: el frontend guarda un cursor (id de la tabla
+# cambios) y pide solo lo que cambio despues, en vez de recargar las tablas completas.
+# La tabla cambios la llenan triggers (migracion 11 de BD.py), asi tambien llegan
+# las escrituras hechas desde el CLI.
+#
+# Varios cambios de la misma fila se juntan en uno: se devuelve el estado actual de
+# la fila, y si ya no existe (o el usuario ya no puede verla) se devuelve su id como borrado.
+
+TAMANO_PAGINA = 200
+RETENCION_DIAS = 7
+INTERVALO_PODA = 3600   # segundos entre podas, por proceso
+
+GRUPOS = {'libros': 'books', 'prestamos': 'loans', 'usuarios': 'users'}
+
+_ultima_poda = 0.0
+
+
+def cursor_actual():
+    """Último id de la tabla cambios (cursor inicial de un cliente que recién cargó todo)."""
+    with connection.cursor() as c:
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM cambios")
+        return c.fetchone()[0]
+
+
+def _podados_hasta(c):
+    c.execute("SELECT version FROM versiones WHERE tabla = 'cambios_podados'")
+    fila = c.fetchone()
+    return fila[0] if fila else 0
+
+
+def podar(dias=RETENCION_DIAS):
+    """Borra los cambios más antiguos que la retención y registra hasta qué id se podó."""
+    with transaction.atomic(), connection.cursor() as c:
+        c.execute("SELECT MAX(id) FROM cambios WHERE fecha < datetime('now', %s)", [f'-{int(dias)} days'])
+        hasta = c.fetchone()[0]
+        if hasta is None:
+            return 0
+        c.execute("DELETE FROM cambios WHERE id <= %s", [hasta])
+        borrados = c.rowcount
+        c.execute("UPDATE versiones SET version = MAX(version, %s), modificado = datetime('now') WHERE tabla = 'cambios_podados'", [hasta])
+    return borrados
+
+
+def _podar_si_corresponde():
+    global _ultima_poda
+    if time.monotonic() - _ultima_poda > INTERVALO_PODA:
+        _ultima_poda = time.monotonic()
+        podar()
+
+
+def cambios_desde(desde, es_bibliotecario, universitario_id, tamano=TAMANO_PAGINA):
+    """
+    Devuelve los cambios posteriores al cursor desde:
+    {'cursor', 'has_more', 'reset', 'books': {'upserts', 'deletes'}, 'loans': {...}, 'users': {...}}.
+    reset=True indica que el cursor es anterior a la última poda y el cliente debe recargar todo.
+    Un universitario solo recibe libros y sus propios préstamos.
+    """
+    _podar_si_corresponde()
+    respuesta = {'cursor': desde, 'has_more': False, 'reset': False}
+    grupos = GRUPOS if es_bibliotecario else {'libros': 'books', 'prestamos': 'loans'}
+    for grupo in grupos.values():
+        respuesta[grupo] = {'upserts': [], 'deletes': []}
+
+    filtro, parametros = "", [desde]
+    if not es_bibliotecario:
+        filtro = "AND (tabla = 'libros' OR (tabla = 'prestamos' AND propietario = %s))"
+        parametros.append(universitario_id)
+
+    with connection.cursor() as c:
+        if desde < _podados_hasta(c):
+            respuesta['reset'] = True
+            respuesta['cursor'] = cursor_actual()
+            return respuesta
+        c.execute(f"""
+            SELECT tabla, registro_id, MAX(id) AS ultimo
+            FROM cambios
+            WHERE id > %s {filtro}
+            GROUP BY tabla, registro_id
+            ORDER BY ultimo
+            LIMIT %s
+        """, parametros + [tamano + 1])
+        filas = c.fetchall()
+
+    if len(filas) > tamano:
+        filas = filas[:tamano]
+        respuesta['has_more'] = True
+    if not filas:
+        return respuesta
+    respuesta['cursor'] = filas[-1][2]
+
+    ids = {tabla: [] for tabla in grupos}
+    for tabla, registro_id, _ in filas:
+        if tabla in ids:
+            ids[tabla].append(registro_id)
+
+    # Estado actual de las filas cambiadas: una consulta por tabla
+    actuales = {}
+    if ids['libros']:
+        # Version leida de la BD (no la de la cache, que puede tener segundos de atraso):
+        # el cursor avanza y un libro viejo no se volveria a enviar
+        version, _ = version_catalogo()
+        actuales['libros'] = list(libros_por_id(ids['libros'], version).values())
+    if ids['prestamos']:
+        prestamos = Prestamo.objects.filter(pk__in=ids['prestamos'])
+        if not es_bibliotecario:
+            prestamos = prestamos.filter(universitario_id=universitario_id)
+        actuales['prestamos'] = list(iterar_prestamos(prestamos))
+    if ids.get('usuarios'):
+        actuales['usuarios'] = list(iterar_universitarios(Universitario.objects.filter(usuario_id__in=ids['usuarios'])))
+
+    for tabla, grupo in grupos.items():
+        vigentes = actuales.get(tabla, [])
+        encontrados = {fila['id'] for fila in vigentes}
+        respuesta[grupo]['upserts'] = vigentes
+        respuesta[grupo]['deletes'] = [registro_id for registro_id in ids[tabla] if registro_id not in encontrados]
+    return respuesta
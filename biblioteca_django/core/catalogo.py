@@ -0,0 +1,125 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Libro
+
+# Listado del catalogo para /api/books/: paginas por cursor (keyset), proyeccion de
+# campos y version del catalogo para responder 304 si nada cambio.
+# La tabla versiones y sus triggers se crean con las migraciones de BD.py (migracion 9).
+
+TAMANO_PAGINA = 100
+MAX_TAMANO_PAGINA = 500
+
+CAMPOS = ('id', 'titulo', 'autor', 'genero', 'año', 'cantidad', 'disponibles', 'isbn')
+ORDENES = ('id', 'titulo', 'autor', 'genero', 'año')
+
+
+def version_catalogo():
+    """Devuelve (version, modificado) del catálogo; modificado es un datetime en UTC."""
+    with connection.cursor() as c:
+        c.execute("SELECT version, modificado FROM versiones WHERE tabla = 'libros'")
+        fila = c.fetchone()
+    if not fila:
+        return 0, None
+    return fila[0], datetime.strptime(fila[1], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def etag_catalogo(version, parametros):
+    """ETag fuerte: la misma versión del catálogo con otros parámetros es otra representación."""
+    consulta = "&".join(f"{k}={v}" for k, v in sorted(parametros.items()))
+    return f"libros-{version}-{hashlib.sha1(consulta.encode('utf-8')).hexdigest()[:12]}"
+
+
+def codificar_cursor(orden, valores):
+    datos = json.dumps({'o': orden, 'v': valores}, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(datos).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, orden):
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        valor, ultimo_id = datos['v']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Cursor inválido.")
+    if datos.get('o') != orden:
+        raise ValueError("El cursor corresponde a otro orden.")
+    return valor, ultimo_id
+
+
+def leer_parametros(get):
+    """Valida los parámetros del listado (QueryDict) y devuelve un dict normalizado."""
+    campos = [c.strip() for c in get.get('fields', '').split(',') if c.strip()] or list(CAMPOS)
+    desconocidos = [c for c in campos if c not in CAMPOS]
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}.")
+
+    orden = get.get('ordering', 'id').strip() or 'id'
+    if orden.lstrip('-') not in ORDENES:
+        raise ValueError(f"Orden inválido. Opciones: {', '.join(ORDENES)} (con '-' para descendente).")
+
+    try:
+        tamano = min(max(int(get.get('page_size', TAMANO_PAGINA)), 1), MAX_TAMANO_PAGINA)
+        año = int(get['año']) if get.get('año') else None
+    except ValueError:
+        raise ValueError("page_size y año deben ser números enteros.")
+
+    return {
+        'fields': ",".join(campos),
+        'ordering': orden,
+        'page_size': tamano,
+        'cursor': get.get('cursor', ''),
+        'genero': get.get('genero', '').strip(),
+        'autor': get.get('autor', '').strip(),
+        'año': año if año is not None else '',
+        'disponible': get.get('disponible', '') in ('1', 'true'),
+    }
+
+
+def listar_libros(parametros):
+    """Devuelve (filas, siguiente_cursor) con solo los campos pedidos; siguiente_cursor es None en la última página."""
+    campos = parametros['fields'].split(',')
+    orden = parametros['ordering']
+    columna = orden.lstrip('-')
+    descendente = orden.startswith('-')
+
+    libros = Libro.objects.all()
+    if parametros['genero']:
+        libros = libros.filter(genero=parametros['genero'])
+    if parametros['autor']:
+        libros = libros.filter(autor=parametros['autor'])
+    if parametros['año'] != '':
+        libros = libros.filter(año=parametros['año'])
+    if parametros['disponible']:
+        libros = libros.filter(disponibles__gt=0)
+
+    if parametros['cursor']:
+        valor, ultimo_id = decodificar_cursor(parametros['cursor'], orden)
+        # (columna, id) > (valor, ultimo_id) escrito como rango sobre la columna para usar su indice
+        mayor, mayor_igual = ('lt', 'lte') if descendente else ('gt', 'gte')
+        if columna == 'id':
+            libros = libros.filter(**{f'id__{mayor}': ultimo_id})
+        else:
+            libros = libros.filter(
+                Q(**{f'{columna}__{mayor_igual}': valor}),
+                Q(**{f'{columna}__{mayor}': valor}) | Q(**{f'id__{mayor}': ultimo_id}),
+            )
+
+    signo = '-' if descendente else ''
+    libros = libros.order_by(f'{signo}{columna}', f'{signo}id')
+
+    # Las columnas del cursor se leen aunque no se pidan y luego se quitan de la respuesta
+    leidas = list(dict.fromkeys(campos + [columna, 'id']))
+    tamano = parametros['page_size']
+    filas = list(libros.values(*leidas)[:tamano + 1])
+
+    siguiente = None
+    if len(filas) > tamano:
+        filas = filas[:tamano]
+        siguiente = codificar_cursor(orden, [filas[-1][columna], filas[-1]['id']])
+    return [{campo: fila[campo] for campo in campos} for fila in filas], siguiente
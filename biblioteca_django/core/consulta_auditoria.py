@@ -0,0 +1,149 @@
+import gzip
+import heapq
+import json
+import os
+from datetime import datetime, timedelta
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import connection
+
+from .catalogo import codificar_cursor, decodificar_cursor
+
+# Consulta del registro de auditoria para /api/audit/: filtros por usuario, accion,
+# tabla y rango de fechas, paginas por cursor (fecha, id) como el catalogo.
+# Incluye los meses sellados por archivo_auditoria.py (raiz del proyecto): su indice
+# esta en las tablas auditoria_archivo* (migracion 12 de BD.py) y las filas en los
+# archivos de settings.AUDITORIA_ARCHIVO. Los indices de la tabla (migraciones 3 y 13)
+# cubren cada filtro junto con el orden por fecha.
+
+TAMANO_PAGINA = 100
+MAX_TAMANO_PAGINA = 500
+ORDEN = 'fecha'
+
+# fecha se lee como texto: el conversor DATE de Django la convierte en None
+SQL_FILAS = ("SELECT id, usuario_id, accion, tabla_afectada, detalle, CAST(fecha AS TEXT) "
+             "FROM auditoria")
+
+
+def _fecha(get, nombre):
+    texto = get.get(nombre, '').strip()
+    if not texto:
+        return None
+    try:
+        return datetime.strptime(texto, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"{nombre} debe tener el formato AAAA-MM-DD.")
+
+
+def leer_filtros(get):
+    """Valida los filtros (QueryDict) y devuelve (filtros, despues_de, tamano). hasta es inclusivo."""
+    try:
+        usuario_id = int(get['user_id']) if get.get('user_id') else None
+        tamano = min(max(int(get.get('page_size', TAMANO_PAGINA)), 1), MAX_TAMANO_PAGINA)
+    except ValueError:
+        raise ValueError("user_id y page_size deben ser números enteros.")
+    desde, hasta = _fecha(get, 'from'), _fecha(get, 'to')
+    filtros = {
+        'usuario_id': usuario_id,
+        'accion': get.get('action', '').strip().upper() or None,
+        'tabla': get.get('table', '').strip().lower() or None,
+        'desde': desde.strftime('%Y-%m-%d') if desde else None,
+        # Internamente hasta se excluye: el dia siguiente
+        'hasta': (hasta + timedelta(days=1)).strftime('%Y-%m-%d') if hasta else None,
+    }
+    despues_de = None
+    if get.get('cursor'):
+        fecha, ultimo_id = decodificar_cursor(get['cursor'], ORDEN)
+        despues_de = (str(fecha), int(ultimo_id))
+    return filtros, despues_de, tamano
+
+
+def _clave(fila):
+    return (fila[5], fila[0])
+
+
+def _leer_segmento(nombre):
+    with gzip.open(os.path.join(settings.AUDITORIA_ARCHIVO, nombre), 'rt', encoding='utf-8') as archivo:
+        for linea in archivo:
+            yield tuple(json.loads(linea))
+
+
+def _archivadas(usuario_id, desde, hasta):
+    sql = "SELECT periodo, archivo FROM auditoria_archivo WHERE 1 = 1"
+    parametros = []
+    if usuario_id is not None:
+        sql += " AND archivo IN (SELECT archivo FROM auditoria_archivo_usuarios WHERE usuario_id = %s)"
+        parametros.append(usuario_id)
+    if desde:
+        sql += " AND fecha_max >= %s"
+        parametros.append(desde)
+    if hasta:
+        sql += " AND fecha_min < %s"
+        parametros.append(hasta)
+    with connection.cursor() as c:
+        c.execute(sql + " ORDER BY periodo, archivo", parametros)
+        segmentos = c.fetchall()
+    # Los meses no se solapan; los segmentos de un mismo mes se intercalan
+    for _, del_periodo in groupby(segmentos, key=lambda s: s[0]):
+        yield from heapq.merge(*[_leer_segmento(archivo) for _, archivo in del_periodo], key=_clave)
+
+
+def _en_tabla(filtros, despues_de, limite):
+    condiciones, parametros = [], []
+    for columna, clave in (('usuario_id', 'usuario_id'), ('accion', 'accion'), ('tabla_afectada', 'tabla')):
+        if filtros[clave] is not None:
+            condiciones.append(f"{columna} = %s")
+            parametros.append(filtros[clave])
+    if filtros['desde']:
+        condiciones.append("fecha >= %s")
+        parametros.append(filtros['desde'])
+    if filtros['hasta']:
+        condiciones.append("fecha < %s")
+        parametros.append(filtros['hasta'])
+    if despues_de is not None:
+        condiciones.append("(fecha, id) > (%s, %s)")
+        parametros.extend(despues_de)
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    with connection.cursor() as c:
+        c.execute(f"{SQL_FILAS}{where} ORDER BY fecha, id LIMIT %s", parametros + [limite])
+        return c.fetchall()
+
+
+def _filas(filtros, despues_de, limite):
+    def coincide(fila):
+        return ((filtros['usuario_id'] is None or fila[1] == filtros['usuario_id'])
+                and (filtros['accion'] is None or fila[2] == filtros['accion'])
+                and (filtros['tabla'] is None or fila[3] == filtros['tabla'])
+                and (not filtros['desde'] or fila[5] >= filtros['desde'])
+                and (not filtros['hasta'] or fila[5] < filtros['hasta'])
+                and (despues_de is None or _clave(fila) > despues_de))
+
+    inicio = max(filtros['desde'] or '', despues_de[0] if despues_de else '')
+    archivadas = filter(coincide, _archivadas(filtros['usuario_id'], inicio, filtros['hasta']))
+    # Filas tardias de meses ya sellados pueden seguir en la tabla: se intercalan por fecha
+    return list(islice(heapq.merge(archivadas, _en_tabla(filtros, despues_de, limite), key=_clave), limite))
+
+
+def _evento(fila):
+    id_evento, usuario_id, accion, tabla, detalle, fecha = fila
+    try:
+        # log_auditoria guarda los datos extra como JSON
+        detalle = json.loads(detalle) if detalle and detalle.startswith('{') else detalle
+    except ValueError:
+        pass
+    return {'id': id_evento, 'usuario_id': usuario_id, 'accion': accion,
+            'tabla_afectada': tabla, 'detalle': detalle, 'fecha': fecha}
+
+
+def pagina(filtros, despues_de=None, tamano=TAMANO_PAGINA):
+    """Devuelve (eventos, siguiente) ordenados por fecha e id; siguiente es (fecha, id) o None en la última página."""
+    filas = _filas(filtros, despues_de, tamano + 1)
+    if len(filas) <= tamano:
+        return [_evento(fila) for fila in filas], None
+    filas = filas[:tamano]
+    return [_evento(fila) for fila in filas], _clave(filas[-1])
+
+
+def cursor_de(siguiente):
+    return codificar_cursor(ORDEN, list(siguiente)) if siguiente else None
@@ -0,0 +1,27 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# El esquema de la biblioteca (tablas de la biblioteca, columnas nuevas, indices, triggers,
+# FTS, auditoria, etc.) lo crea y migra BD.py en la raiz del proyecto, el mismo que usa el CLI.
+# Los modelos de Django no son administrados: este comando aplica esas migraciones a la
+# base de Django. Correrlo despues de "python manage.py migrate" y al actualizar el codigo.
+
+
+class Command(BaseCommand):
+    help = "Aplica las migraciones de BD.py (esquema compartido con el CLI) a la base de datos de Django."
+
+    def handle(self, *args, **options):
+        nombre = str(settings.DATABASES['default']['NAME'])
+        import conexion  # Raiz del proyecto, en sys.path desde settings.py
+        conexion.cerrar_conexiones()
+        conexion.DB_PATH = nombre
+        ya_importado = 'BD' in sys.modules
+        import BD  # Al importarse crea las tablas base y aplica las migraciones pendientes
+        if ya_importado:
+            BD.init_db()
+        with conexion.transaccion() as c:
+            version = BD.version_actual(c)
+        conexion.cerrar_conexiones()
+        self.stdout.write(self.style.SUCCESS(f"{nombre}: esquema de la biblioteca en la versión {version}."))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Auditoria',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('usuario_id', models.IntegerField()),
+                ('accion', models.TextField()),
+                ('tabla_afectada', models.TextField()),
+                ('detalle', models.TextField(null=True)),
+                ('fecha', models.TextField()),
+            ],
+            options={
+                'db_table': 'auditoria',
+                'managed': False,
+            },
+        ),
+    ]
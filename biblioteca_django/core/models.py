@@ -46,8 +46,10 @@ class Libro(models.Model):
     autor = models.TextField()
     genero = models.TextField()
     año = models.IntegerField()
-    cantidad = models.IntegerField()
+    cantidad = models.IntegerField()  # Total de copias
     isbn = models.TextField(unique=True)
+    # Copias en estante: la mantienen los prestamos y devoluciones (ver prestamos.py en la raiz)
+    disponibles = models.IntegerField(null=True)
 
     class Meta:
         managed = False
@@ -64,7 +66,21 @@ class Prestamo(models.Model):
     dias = models.IntegerField()
     fch_prestamo = models.DateField()
     fch_devolucion = models.DateField()
+    is_activo = models.BooleanField(default=True)
+    fch_devolucion_real = models.DateField(null=True, blank=True)
 
     class Meta:
         managed = False
         db_table = 'prestamos'
+
+class Auditoria(models.Model):
+    id = models.AutoField(primary_key=True)
+    usuario_id = models.IntegerField(null=True)  # Id en usuarios de quien hizo el cambio; NULL si no tiene fila (migracion 16)
+    accion = models.TextField()
+    tabla_afectada = models.TextField()
+    detalle = models.TextField(null=True)  # Texto, o JSON con 'mensaje' y datos del cambio (ver utils.py)
+    fecha = models.TextField()             # 'YYYY-MM-DD HH:MM:SS' hora local, igual que el CLI (auditoria.py)
+
+    class Meta:
+        managed = False
+        db_table = 'auditoria'
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+from django.db import connection
+
+# Reportes de circulacion para /api/reports/<reporte>/. Leen solo las tablas
+# estadisticas_* (migracion 14 de BD.py), que los triggers de prestamos mantienen en
+# la misma transaccion de cada prestamo o devolucion, tambien los hechos desde Django.
+# Para reconstruirlas: python estadisticas.py --reconstruir (raiz del proyecto).
+
+TOP_LIBROS = 10
+MAX_TOP_LIBROS = 100
+
+SUMAS = ("SUM(prestamos) AS prestamos, SUM(devoluciones) AS devoluciones, "
+         "SUM(atrasadas) AS atrasadas, SUM(dias_prestado) AS dias_prestado")
+
+
+def leer_parametros(get):
+    """Valida from / to (AAAA-MM-DD, inclusivos) y limit. Devuelve (desde, hasta, limite)."""
+    fechas = []
+    for nombre in ('from', 'to'):
+        texto = get.get(nombre, '').strip()
+        try:
+            fechas.append(datetime.strptime(texto, '%Y-%m-%d').strftime('%Y-%m-%d') if texto else None)
+        except ValueError:
+            raise ValueError(f"{nombre} debe tener el formato AAAA-MM-DD.")
+    try:
+        limite = min(max(int(get.get('limit', TOP_LIBROS)), 1), MAX_TOP_LIBROS)
+    except ValueError:
+        raise ValueError("limit debe ser un número entero.")
+    return fechas[0], fechas[1], limite
+
+
+def _fila(nombre, prestamos, devoluciones, atrasadas, dias_prestado):
+    return {
+        'nombre': nombre,
+        'prestamos': prestamos,
+        'devoluciones': devoluciones,
+        'promedio_dias': round(dias_prestado / devoluciones, 1) if devoluciones else None,
+        'tasa_atraso': round(atrasadas / devoluciones, 3) if devoluciones else None,
+    }
+
+
+def _rango(desde, hasta):
+    condiciones, parametros = [], []
+    if desde:
+        condiciones.append("dia >= %s")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("dia <= %s")
+        parametros.append(hasta)
+    return (" WHERE " + " AND ".join(condiciones) if condiciones else ""), parametros
+
+
+def _consultar(sql, parametros):
+    with connection.cursor() as c:
+        c.execute(sql, parametros)
+        return c.fetchall()
+
+
+def libros_mas_prestados(desde=None, hasta=None, limite=TOP_LIBROS):
+    if not desde and not hasta:
+        # Toda la historia: los primeros del indice idx_estadisticas_libros_prestamos
+        filas = _consultar("""
+            SELECT l.titulo, e.prestamos, e.devoluciones, e.atrasadas, e.dias_prestado
+            FROM estadisticas_libros e JOIN libros l ON l.id = e.libro_id
+            WHERE e.prestamos > 0
+            ORDER BY e.prestamos DESC LIMIT %s""", [limite])
+    else:
+        where, parametros = _rango(desde, hasta)
+        filas = _consultar(f"""
+            SELECT l.titulo, t.prestamos, t.devoluciones, t.atrasadas, t.dias_prestado
+            FROM (SELECT libro_id, {SUMAS} FROM estadisticas_libros_dia{where}
+                  GROUP BY libro_id HAVING SUM(prestamos) > 0 ORDER BY prestamos DESC LIMIT %s) t
+            JOIN libros l ON l.id = t.libro_id
+            ORDER BY t.prestamos DESC""", parametros + [limite])
+    return [_fila(*fila) for fila in filas]
+
+
+def _por_grupo(tabla, columna, desde, hasta):
+    where, parametros = _rango(desde, hasta)
+    filas = _consultar(f"""
+        SELECT {columna}, {SUMAS} FROM {tabla}{where}
+        GROUP BY {columna} ORDER BY prestamos DESC, {columna}""", parametros)
+    return [_fila(*fila) for fila in filas]
+
+
+def demanda_por_genero(desde=None, hasta=None, limite=None):
+    return _por_grupo('estadisticas_generos_dia', 'genero', desde, hasta)
+
+
+def uso_por_universidad(desde=None, hasta=None, limite=None):
+    return _por_grupo('estadisticas_universidades_dia', 'universidad', desde, hasta)
+
+
+def resumen(desde=None, hasta=None, limite=None):
+    where, parametros = _rango(desde, hasta)
+    fila = _consultar(f"SELECT {SUMAS} FROM estadisticas_generos_dia{where}", parametros)[0]
+    return _fila('Total', *(valor or 0 for valor in fila))
+
+
+REPORTES = {
+    'summary': resumen,
+    'books': libros_mas_prestados,
+    'genres': demanda_por_genero,
+    'universities': uso_por_universidad,
+}
@@ -0,0 +1,98 @@
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.utils.functional import SimpleLazyObject
+
+from .models import Universitario, Bibliotecario
+
+# Rol del usuario autenticado, resuelto una vez y guardado en la sesion.
+# RolMiddleware deja request.perfil como atributo perezoso: solo las vistas que
+# lo usan hacen la consulta, y como mucho una vez por request.
+# Si cambia el perfil de un usuario (señales de Universitario / Bibliotecario)
+# se cambia su token en la cache y las sesiones con el token anterior lo vuelven a resolver.
+
+CLAVE_SESION = 'perfil'
+TTL_SESION = 300        # segundos; acota lo que dura un rol si la cache se reinicia y pierde el token
+
+
+class Perfil:
+    def __init__(self, rol):
+        self.rol = rol
+
+    @property
+    def es_bibliotecario(self):
+        return self.rol == "Bibliotecario"
+
+    def __bool__(self):
+        return self.rol is not None
+
+
+def _clave_token(usuario_id):
+    return f'perfil_token:{usuario_id}'
+
+
+def invalidar_perfil(usuario_id):
+    """Obliga a volver a resolver el rol de ese usuario en todas sus sesiones."""
+    cache.set(_clave_token(usuario_id), uuid.uuid4().hex, None)
+
+
+def resolver_rol(usuario_id):
+    """Rol del usuario con una sola consulta a las tablas de perfiles."""
+    with connection.cursor() as c:
+        c.execute("""
+            SELECT EXISTS (SELECT 1 FROM bibliotecarios WHERE usuario_id = %s),
+                   EXISTS (SELECT 1 FROM universitarios WHERE usuario_id = %s)
+        """, [usuario_id, usuario_id])
+        es_bibliotecario, _ = c.fetchone()
+    # Igual que antes: quien no es bibliotecario se trata como universitario
+    return "Bibliotecario" if es_bibliotecario else "Universitario"
+
+
+def perfil_de(request):
+    """Perfil del usuario del request; Perfil(None) si no hay sesión iniciada."""
+    user = request.user
+    if not user.is_authenticated:
+        return Perfil(None)
+
+    token = cache.get(_clave_token(user.pk))
+    guardado = request.session.get(CLAVE_SESION)
+    if (guardado and guardado['usuario_id'] == user.pk and guardado['token'] == token
+            and time.time() - guardado['resuelto'] < TTL_SESION):
+        return Perfil(guardado['rol'])
+
+    rol = resolver_rol(user.pk)
+    request.session[CLAVE_SESION] = {'usuario_id': user.pk, 'rol': rol, 'token': token, 'resuelto': time.time()}
+    return Perfil(rol)
+
+
+class RolMiddleware:
+    """
+    Agrega request.perfil (perezoso). Debe ir después de AuthenticationMiddleware.
+    Sirve para WSGI y ASGI: con vistas async no obliga a Django a pasar el request por un hilo.
+    En una vista async request.perfil se consulta dentro de en_pool (ver asincrono.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.perfil = SimpleLazyObject(lambda: perfil_de(request))
+        # En modo async get_response devuelve la corrutina y Django la espera
+        return self.get_response(request)
+
+
+def _al_cambiar_perfil(sender, instance, **kwargs):
+    invalidar_perfil(instance.pk)
+
+
+for _modelo in (Universitario, Bibliotecario):
+    post_save.connect(_al_cambiar_perfil, sender=_modelo, dispatch_uid=f'perfil_save_{_modelo.__name__}')
+    post_delete.connect(_al_cambiar_perfil, sender=_modelo, dispatch_uid=f'perfil_delete_{_modelo.__name__}')
@@ -0,0 +1,195 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+
+from .asincrono import en_pool
+from .models import Prestamo, Universitario
+
+# Serializacion en bloque para los listados: cada listado se resuelve con una
+# sola consulta values() que ya trae los joins (libro, universitario, usuario),
+# en vez de una consulta por fila para el perfil del usuario.
+# Las filas se leen por trozos (iterator) y la respuesta JSON se envia a medida
+# que se genera, asi la memoria no crece con el tamaño de la tabla.
+# Las versiones a* son para las vistas async: cada trozo es una visita al pool de la BD
+# (ver asincrono.py) que pide las siguientes filas por clave (keyset) segun el orden
+# del queryset; nunca se leen todos los ids de una vez.
+
+TAMANO_TROZO = 500
+
+CAMPOS_LIBRO = ('id', 'titulo', 'autor', 'genero', 'año', 'cantidad', 'disponibles', 'isbn')
+
+
+def libro_serializer(libro):
+    """Serializa un objeto Libro."""
+    return {campo: getattr(libro, campo) for campo in CAMPOS_LIBRO}
+
+
+def _universitario(usuario_id, nombre, email, prestamos_activos=None):
+    data = {
+        'id': usuario_id,
+        'username': email,
+        'name': nombre or email,
+        'doc': 'N/A',
+        'role': 'Universitario',
+    }
+    if prestamos_activos is not None:
+        data['active_loans'] = prestamos_activos
+    return data
+
+
+def iterar_universitarios(universitarios=None, chunk_size=TAMANO_TROZO):
+    """Genera los universitarios serializados de un queryset (por defecto todos) con una sola consulta."""
+    if universitarios is None:
+        universitarios = Universitario.objects.all()
+    # El conteo de prestamos activos va en la misma consulta (GROUP BY), el frontend ya no los cuenta
+    filas = (universitarios
+             .annotate(activos=Count('prestamo', filter=Q(prestamo__is_activo=True)))
+             .values_list('usuario_id', 'usuario__nombre', 'usuario__email', 'activos'))
+    for fila in filas.iterator(chunk_size=chunk_size):
+        yield _universitario(*fila)
+
+
+def serializar_universitarios(universitarios=None):
+    return list(iterar_universitarios(universitarios))
+
+
+def _cargar_universitarios(ids):
+    return list(iterar_universitarios(Universitario.objects.filter(usuario_id__in=ids)))
+
+
+async def aiterar_universitarios(universitarios=None, chunk_size=TAMANO_TROZO):
+    """Como iterar_universitarios, para vistas async (una consulta por trozo, en el pool de la BD)."""
+    if universitarios is None:
+        universitarios = Universitario.objects.all()
+    async for elemento in _por_clave(universitarios, _cargar_universitarios, chunk_size):
+        yield elemento
+
+
+def iterar_prestamos(prestamos=None, chunk_size=TAMANO_TROZO):
+    """
+    Genera los préstamos serializados de un queryset (respetando su orden) con una
+    sola consulta, con el libro y el universitario de cada préstamo.
+    """
+    if prestamos is None:
+        prestamos = Prestamo.objects.all()
+    campos_libro = [f'libro__{campo}' for campo in CAMPOS_LIBRO]
+    filas = prestamos.values(
+        'id', 'fch_prestamo', 'fch_devolucion', 'is_activo', 'fch_devolucion_real',
+        'universitario_id', 'universitario__usuario__nombre', 'universitario__usuario__email',
+        *campos_libro,
+    )
+    for fila in filas.iterator(chunk_size=chunk_size):
+        yield {
+            'id': fila['id'],
+            'libro': {campo: fila[f'libro__{campo}'] for campo in CAMPOS_LIBRO},
+            'universitario': _universitario(
+                fila['universitario_id'], fila['universitario__usuario__nombre'], fila['universitario__usuario__email']
+            ),
+            'fch_prestamo': fila['fch_prestamo'].isoformat(),
+            'fch_devolucion': fila['fch_devolucion'].isoformat(),
+            'is_activo': bool(fila['is_activo']),
+            'fch_devolucion_real': fila['fch_devolucion_real'].isoformat() if fila['fch_devolucion_real'] else None,
+        }
+
+
+def serializar_prestamos(prestamos=None):
+    return list(iterar_prestamos(prestamos))
+
+
+def _cargar_prestamos(ids):
+    return list(iterar_prestamos(Prestamo.objects.filter(pk__in=ids)))
+
+
+async def aiterar_prestamos(prestamos=None, chunk_size=TAMANO_TROZO):
+    """Como iterar_prestamos, para vistas async: mismo orden, una consulta por trozo en el pool de la BD."""
+    if prestamos is None:
+        prestamos = Prestamo.objects.all()
+    async for elemento in _por_clave(prestamos, _cargar_prestamos, chunk_size):
+        yield elemento
+
+
+def _orden(queryset):
+    # Campos del orden del queryset (no nulos), con la pk al final para que la clave sea unica
+    campos = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    nombres_pk = ('pk', queryset.model._meta.pk.name)
+    if not any(campo.lstrip('-') in nombres_pk for campo in campos):
+        campos.append('pk')
+    return campos
+
+
+def _despues_de(campos, valores):
+    # (a, b, c) > (va, vb, vc) en el orden de la consulta: a > va, o a = va y b > vb, o ...
+    condicion = Q()
+    for i, campo in enumerate(campos):
+        iguales = {anterior.lstrip('-'): valor for anterior, valor in zip(campos[:i], valores[:i])}
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        condicion |= Q(**iguales, **{f"{campo.lstrip('-')}__{operador}": valores[i]})
+    return condicion
+
+
+def _trozo(queryset, campos, ultimo, tamano, cargar):
+    # Una visita al pool: las claves de las siguientes filas y sus elementos serializados
+    if ultimo is not None:
+        queryset = queryset.filter(_despues_de(campos, ultimo))
+    claves = list(queryset.values_list(*[campo.lstrip('-') for campo in campos])[:tamano])
+    posicion_pk = _posicion_pk(queryset, campos)
+    ids = [clave[posicion_pk] for clave in claves]
+    # pk__in no respeta el orden de los ids
+    por_id = {elemento['id']: elemento for elemento in cargar(ids)} if ids else {}
+    return [por_id[i] for i in ids if i in por_id], (claves[-1] if claves else None), len(claves)
+
+
+def _posicion_pk(queryset, campos):
+    nombres_pk = ('pk', queryset.model._meta.pk.name)
+    return next(i for i, campo in enumerate(campos) if campo.lstrip('-') in nombres_pk)
+
+
+async def _por_clave(queryset, cargar, chunk_size):
+    campos = _orden(queryset)
+    # Un queryset recortado ([:limite]) no se puede filtrar: el limite se aplica aqui
+    limite = None
+    if queryset.query.is_sliced:
+        limite = queryset.query.high_mark - queryset.query.low_mark if queryset.query.high_mark is not None else None
+        if queryset.query.low_mark:
+            raise ValueError("Los listados en flujo no admiten desplazamiento (offset).")
+        queryset = queryset.all()
+        queryset.query.clear_limits()
+    ultimo, entregados = None, 0
+    while limite is None or entregados < limite:
+        tamano = chunk_size if limite is None else min(chunk_size, limite - entregados)
+        elementos, ultimo, leidos = await en_pool(_trozo, queryset, campos, ultimo, tamano, cargar)
+        for elemento in elementos:
+            yield elemento
+        entregados += leidos
+        if leidos < tamano:
+            break
+
+
+def _arreglo_json(elementos):
+    # '[' + elementos separados por ',' + ']' sin armar nunca la lista completa
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    yield '['
+    for i, elemento in enumerate(elementos):
+        yield (',' if i else '') + codificador.encode(elemento)
+    yield ']'
+
+
+async def _aarreglo_json(elementos):
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    yield '['
+    primero = True
+    async for elemento in elementos:
+        yield ('' if primero else ',') + codificador.encode(elemento)
+        primero = False
+    yield ']'
+
+
+def respuesta_json_en_flujo(elementos):
+    """
+    StreamingHttpResponse con un arreglo JSON generado elemento por elemento.
+    elementos puede ser un iterable async (vistas async bajo ASGI: no pasa por un hilo por cada trozo).
+    Con WSGI Django juntaría el iterable async en una lista: ahí va el generador síncrono (ver asincrono.bajo_asgi).
+    """
+    if hasattr(elementos, '__aiter__'):
+        return StreamingHttpResponse(_aarreglo_json(elementos), content_type='application/json')
+    return StreamingHttpResponse(_arreglo_json(elementos), content_type='application/json')
@@ -1,3 +1,398 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.db import connection
+from django.db import transaction, OperationalError
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models import Usuario, Universitario, Bibliotecario, Admin, Libro, Prestamo, Auditoria
+from .serializadores import (serializar_prestamos, serializar_universitarios, iterar_prestamos, aiterar_prestamos,
+                             aiterar_universitarios, respuesta_json_en_flujo)
+from .roles import RolMiddleware
+from . import cache_catalogo
+from .utils import AuditoriaMiddleware, log_auditoria
+from . import utils
+from .consulta_auditoria import leer_filtros, pagina
+from . import reportes
+
+# Los modelos no son administrados por Django (las tablas las crea BD.py),
+# asi que la base de pruebas los crea y borra aqui.
+MODELOS_NO_ADMINISTRADOS = [Usuario, Universitario, Bibliotecario, Admin, Libro, Prestamo, Auditoria]
+
+
+class ConTablasDeLaBiblioteca(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Fuera de la transaccion de la clase: el schema editor de SQLite no puede ir dentro de una
+        with connection.schema_editor() as editor:
+            for modelo in MODELOS_NO_ADMINISTRADOS:
+                editor.create_model(modelo)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for modelo in reversed(MODELOS_NO_ADMINISTRADOS):
+                editor.delete_model(modelo)
+
+
+def crear_prestamos(cantidad, desde=0):
+    hoy = date.today()
+    for i in range(desde, desde + cantidad):
+        usuario = Usuario.objects.create(nombre=f"Alumno {i}", email=f"alumno{i}@test.cl", password_hash="x", tipo="universitario")
+        universitario = Universitario.objects.create(usuario=usuario, universidad="Universidad")
+        libro = Libro.objects.create(titulo=f"Libro {i}", autor="Autor", genero="Novela", año=2000,
+                                     cantidad=2, disponibles=1, isbn=f"{i:010d}")
+        Prestamo.objects.create(universitario=universitario, libro=libro, dias=7, fch_prestamo=hoy,
+                                fch_devolucion=hoy + timedelta(days=7), is_activo=True)
+
+
+class SerializacionEnBloqueTest(ConTablasDeLaBiblioteca):
+
+    def test_prestamos_en_una_consulta_sin_importar_la_cantidad(self):
+        crear_prestamos(3)
+        with self.assertNumQueries(1):
+            pocos = serializar_prestamos(Prestamo.objects.order_by('id'))
+
+        crear_prestamos(40, desde=3)
+        with self.assertNumQueries(1):
+            muchos = serializar_prestamos(Prestamo.objects.order_by('id'))
+
+        self.assertEqual(len(pocos), 3)
+        self.assertEqual(len(muchos), 43)
+        primero = muchos[0]
+        self.assertEqual(primero['libro']['titulo'], "Libro 0")
+        self.assertEqual(primero['libro']['disponibles'], 1)
+        self.assertEqual(primero['universitario']['name'], "Alumno 0")
+        self.assertEqual(primero['universitario']['id'], Usuario.objects.get(email="alumno0@test.cl").pk)
+        self.assertTrue(primero['is_activo'])
+        self.assertIsNone(primero['fch_devolucion_real'])
+
+    def test_respuesta_en_flujo_es_el_mismo_arreglo_json(self):
+        crear_prestamos(7)
+        respuesta = respuesta_json_en_flujo(iterar_prestamos(Prestamo.objects.order_by('id'), chunk_size=3))
+        self.assertTrue(respuesta.streaming)
+        with self.assertNumQueries(1):
+            contenido = b"".join(respuesta.streaming_content)
+        self.assertEqual(json.loads(contenido), serializar_prestamos(Prestamo.objects.order_by('id')))
+        vacia = respuesta_json_en_flujo(iterar_prestamos(Prestamo.objects.none()))
+        self.assertEqual(json.loads(b"".join(vacia.streaming_content)), [])
+
+    async def test_version_async_mismo_arreglo_en_trozos(self):
+        await sync_to_async(crear_prestamos)(7)
+        prestamos = Prestamo.objects.order_by('-id')
+        respuesta = respuesta_json_en_flujo(aiterar_prestamos(prestamos, chunk_size=3))
+        self.assertTrue(respuesta.is_async)
+        contenido = b"".join([parte async for parte in respuesta.streaming_content])
+        self.assertEqual(json.loads(contenido), await sync_to_async(serializar_prestamos)(prestamos))
+        universitarios = [u async for u in aiterar_universitarios(Universitario.objects.order_by('-usuario_id'), chunk_size=2)]
+        self.assertEqual(universitarios, await sync_to_async(serializar_universitarios)(Universitario.objects.order_by('-usuario_id')))
+        # Orden de los listados del panel, con limite: los trozos siguen por clave
+        def variar():
+            for prestamo in Prestamo.objects.all():
+                Prestamo.objects.filter(pk=prestamo.pk).update(is_activo=prestamo.pk % 3 != 0,
+                                                               fch_prestamo=date(2026, 1, 1 + prestamo.pk % 2))
+        await sync_to_async(variar)()
+        recientes = Prestamo.objects.order_by('-is_activo', '-fch_prestamo', '-id')[:5]
+        self.assertEqual([p async for p in aiterar_prestamos(recientes, chunk_size=2)],
+                         await sync_to_async(serializar_prestamos)(recientes))
+
+    def test_universitarios_en_una_consulta(self):
+        crear_prestamos(25)
+        with self.assertNumQueries(1):
+            data = serializar_universitarios(Universitario.objects.order_by('usuario_id'))
+        self.assertEqual(len(data), 25)
+        self.assertEqual(data[0]['username'], "alumno0@test.cl")
+
+
+class ListadosEnFlujoTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="bib", password="x")
+        usuario = Usuario.objects.create(id=self.user.pk, nombre="Bibliotecaria", email="bib@test.cl", password_hash="x", tipo="bibliotecario")
+        Bibliotecario.objects.create(usuario=usuario, universidad="Universidad")
+        crear_prestamos(3, desde=1)
+
+    def test_wsgi_recorre_un_generador_sincrono(self):
+        self.client.force_login(self.user)
+        respuesta = self.client.get('/api/loans/all/')
+        self.assertFalse(respuesta.is_async)
+        self.assertEqual(len(json.loads(b"".join(respuesta.streaming_content))), 3)
+
+    async def test_asgi_recorre_un_iterador_async(self):
+        await self.async_client.aforce_login(self.user)
+        respuesta = await self.async_client.get('/api/users/')
+        self.assertTrue(respuesta.is_async)
+        contenido = b"".join([parte async for parte in respuesta.streaming_content])
+        self.assertEqual(len(json.loads(contenido)), 3)
+
+
+class DevolucionTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        with connection.cursor() as c:
+            # Tablas de BD.py (migraciones 5 y 15) que no tienen modelo
+            c.execute("CREATE TABLE IF NOT EXISTS valores_uf (fecha TEXT PRIMARY KEY, valor REAL NOT NULL, actualizado TEXT NOT NULL)")
+            c.execute("""CREATE TABLE IF NOT EXISTS multas (prestamo_id INTEGER PRIMARY KEY, universitario_id INTEGER NOT NULL,
+                         dias_atraso INTEGER NOT NULL, monto_uf REAL NOT NULL, valor_uf REAL, monto_clp REAL,
+                         calculada TEXT NOT NULL, estado TEXT NOT NULL,
+                         actualizado TEXT NOT NULL DEFAULT (datetime('now', 'localtime')))""")
+            c.execute("INSERT INTO valores_uf VALUES (%s, 40000, '')", [(date.today() - timedelta(days=30)).strftime('%Y-%m-%d')])
+        self.user = User.objects.create_user(username="bib", password="x")
+        usuario = Usuario.objects.create(id=self.user.pk, nombre="Bibliotecaria", email="bib@test.cl", password_hash="x", tipo="bibliotecario")
+        Bibliotecario.objects.create(usuario=usuario, universidad="Universidad")
+        crear_prestamos(1, desde=1)
+        self.client.force_login(self.user)
+
+    def test_la_devolucion_atrasada_deja_la_multa_final(self):
+        prestamo = Prestamo.objects.get()
+        Prestamo.objects.filter(pk=prestamo.pk).update(fch_prestamo=date.today() - timedelta(days=10),
+                                                      fch_devolucion=date.today() - timedelta(days=3))
+        respuesta = self.client.post(f'/api/loans/{prestamo.pk}/return/')
+        self.assertEqual(respuesta.status_code, 200)
+        with connection.cursor() as c:
+            c.execute("SELECT dias_atraso, monto_clp, estado FROM multas WHERE prestamo_id = %s", [prestamo.pk])
+            self.assertEqual(c.fetchall(), [(3, 1200.0, 'FINAL')])
+        self.assertEqual(Libro.objects.get(pk=prestamo.libro_id).disponibles, 2)
+
+
+class RolEnSesionTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="bib", password="x")
+        # El perfil se enlaza por id, igual que en las vistas
+        self.usuario = Usuario.objects.create(id=self.user.pk, nombre="Bibliotecaria", email="bib@test.cl", password_hash="x", tipo="bibliotecario")
+        self.session = SessionStore()
+
+    def request(self):
+        request = RequestFactory().get('/api/books/')
+        request.user = self.user
+        request.session = self.session
+        RolMiddleware(lambda r: None)(request)
+        return request
+
+    def test_rol_se_resuelve_una_vez_por_sesion(self):
+        request = self.request()
+        with self.assertNumQueries(1):
+            self.assertEqual(request.perfil.rol, "Universitario")
+            self.assertFalse(request.perfil.es_bibliotecario)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.request().perfil.rol, "Universitario")
+
+    def test_cambio_de_perfil_invalida_la_sesion(self):
+        self.assertFalse(self.request().perfil.es_bibliotecario)
+        Bibliotecario.objects.create(usuario=self.usuario, universidad="Universidad")
+        with self.assertNumQueries(1):
+            self.assertTrue(self.request().perfil.es_bibliotecario)
+
+
+class CacheCatalogoTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        cache.clear()
+        # En la BD real la tabla y su fila las crea la migracion 9 de BD.py
+        with connection.cursor() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS versiones (tabla TEXT PRIMARY KEY, version INTEGER, modificado TEXT)")
+            c.execute("INSERT OR REPLACE INTO versiones VALUES ('libros', 1, '2026-01-01 00:00:00')")
+        self.generadas = 0
+
+    def generar(self):
+        self.generadas += 1
+        return {'results': [], 'pagina': self.generadas}
+
+    def subir_version(self):
+        with connection.cursor() as c:
+            c.execute("UPDATE versiones SET version = version + 1 WHERE tabla = 'libros'")
+
+    def test_la_segunda_lectura_sale_de_la_cache(self):
+        self.assertFalse(cache_catalogo.obtener('pagina', self.generar)[1])
+        with self.assertNumQueries(0):
+            valor, desde_cache = cache_catalogo.obtener('pagina', self.generar)
+        self.assertTrue(desde_cache)
+        self.assertEqual(valor['pagina'], 1)
+        self.assertEqual(cache_catalogo.estadisticas()['hits'], 1)
+
+    def test_escritura_invalida_al_confirmar(self):
+        cache_catalogo.obtener('pagina', self.generar)
+        self.subir_version()
+        # Sin aviso se sigue usando la version guardada (como mucho VERIFICAR_CADA segundos)
+        self.assertTrue(cache_catalogo.obtener('pagina', self.generar)[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            cache_catalogo.notificar_cambio()
+        valor, desde_cache = cache_catalogo.obtener('pagina', self.generar)
+        self.assertFalse(desde_cache)
+        self.assertEqual(valor['pagina'], 2)
+
+    def test_libros_por_id_solo_consulta_los_faltantes(self):
+        libros = [Libro.objects.create(titulo=f"Libro {i}", autor="Autor", genero="Novela", año=2000,
+                                       cantidad=1, disponibles=1, isbn=f"{i:010d}") for i in range(3)]
+        ids = [libro.pk for libro in libros]
+        cache_catalogo.libros_por_id(ids[:2])
+        with self.assertNumQueries(1):
+            data = cache_catalogo.libros_por_id(ids)
+        self.assertEqual(data[ids[2]]['titulo'], "Libro 2")
+        with self.assertNumQueries(0):
+            cache_catalogo.libros_por_id(ids)
+
+
+@override_settings(AUDITORIA_EN_SEGUNDO_PLANO=False)
+class AuditoriaEnLoteTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        # Ids distintos a proposito: el evento lleva el id de usuarios, no el de auth_user
+        self.usuario = Usuario.objects.create(id=50, nombre="Bibliotecaria", email="bib@test.cl", password_hash="x", tipo="bibliotecario")
+        self.user = User.objects.create_user(username="bib", email="bib@test.cl", password="x")
+
+    def request(self, vista):
+        def confirmando(request):
+            # La prueba corre dentro de una transaccion: se simula que la vista confirma al terminar
+            with self.captureOnCommitCallbacks(execute=True):
+                vista(request)
+        with CaptureQueriesContext(connection) as consultas:
+            AuditoriaMiddleware(confirmando)(RequestFactory().post('/api/books/add/'))
+        return [c['sql'] for c in consultas.captured_queries if c['sql'].startswith('INSERT INTO "auditoria"')]
+
+    def test_eventos_del_request_en_un_solo_insert(self):
+        def vista(request):
+            for i in range(5):
+                log_auditoria(self.user, 'LIBRO_ADD', 'libros', f'Libro {i} agregado.', libro_id=i)
+            # Todavia no se escribe nada: se guardan al terminar el request
+            self.assertEqual(Auditoria.objects.count(), 0)
+
+        self.assertEqual(len(self.request(vista)), 1)
+        eventos = list(Auditoria.objects.order_by('id'))
+        self.assertEqual(len(eventos), 5)
+        self.assertEqual(json.loads(eventos[2].detalle), {'mensaje': 'Libro 2 agregado.', 'libro_id': 2})
+        self.assertEqual(eventos[0].tabla_afectada, 'libros')
+        self.assertEqual({e.usuario_id for e in eventos}, {self.usuario.pk})
+
+    def test_usuario_sin_fila_en_usuarios_queda_sin_usuario_id(self):
+        otro = User.objects.create_user(username="sinperfil", password="x")
+        self.request(lambda request: log_auditoria(otro, 'LOGIN', 'usuarios', 'Sin perfil.'))
+        evento = Auditoria.objects.get()
+        self.assertIsNone(evento.usuario_id)
+        self.assertEqual(json.loads(evento.detalle), {'mensaje': 'Sin perfil.', 'usuario': 'sinperfil'})
+
+    def test_al_cerrar_el_lote_del_escritor_va_al_archivo(self):
+        eventos = [Auditoria(usuario_id=self.usuario.pk, accion='LOGIN', tabla_afectada='usuarios', fecha='2026-01-01 10:00:00')]
+        with tempfile.TemporaryDirectory() as carpeta:
+            archivo = os.path.join(carpeta, 'no_guardada.jsonl')
+            # La BD siempre falla: el escritor toma el lote y queda reintentando
+            with self.settings(AUDITORIA_EN_SEGUNDO_PLANO=True, AUDITORIA_NO_GUARDADA=archivo), \
+                    mock.patch.object(utils, '_guardar', side_effect=OperationalError('database is locked')):
+                utils.entregar(eventos)
+                utils.vaciar(espera=0.2)
+                self.assertFalse(utils._escritor.is_alive())
+            with open(archivo, encoding='utf-8') as f:
+                self.assertEqual([json.loads(linea)[1] for linea in f], ['LOGIN'])
+
+    def test_transaccion_revertida_no_deja_eventos(self):
+        def vista(request):
+            try:
+                with transaction.atomic():
+                    log_auditoria(self.user, 'PRESTAMO_ADD', 'prestamos', 'Préstamo revertido.')
+                    raise ValueError
+            except ValueError:
+                pass
+            log_auditoria(self.user, 'PRESTAMO_ADD', 'prestamos', 'Préstamo confirmado.')
+
+        self.request(vista)
+        self.assertEqual([e.detalle for e in Auditoria.objects.all()], ['Préstamo confirmado.'])
+
+
+class ConsultaAuditoriaTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        with connection.cursor() as c:
+            c.execute("""CREATE TABLE IF NOT EXISTS auditoria_archivo (archivo TEXT PRIMARY KEY, periodo TEXT,
+                         filas INTEGER, primer_id INTEGER, ultimo_id INTEGER, fecha_min TEXT, fecha_max TEXT,
+                         bytes INTEGER, sellado TEXT)""")
+            c.execute("CREATE TABLE IF NOT EXISTS auditoria_archivo_usuarios (usuario_id INTEGER, archivo TEXT, filas INTEGER)")
+        self.carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(self.carpeta.cleanup)
+        # Enero sellado: 30 eventos en el archivo, alternando usuarios 1 y 2
+        archivadas = [[i, 1 + i % 2, 'LOGIN', 'usuarios', None, f'2026-01-{1 + i:02d} 10:00:00'] for i in range(1, 31)]
+        with gzip.open(os.path.join(self.carpeta.name, 'auditoria-2026-01.jsonl.gz'), 'wt', encoding='utf-8') as archivo:
+            archivo.writelines(json.dumps(fila) + "\n" for fila in archivadas)
+        with connection.cursor() as c:
+            c.execute("INSERT INTO auditoria_archivo VALUES ('auditoria-2026-01.jsonl.gz', '2026-01', 30, 1, 30, "
+                      "'2026-01-02 10:00:00', '2026-01-31 10:00:00', 0, NULL)")
+            c.execute("INSERT INTO auditoria_archivo_usuarios VALUES (1, 'auditoria-2026-01.jsonl.gz', 15), "
+                      "(2, 'auditoria-2026-01.jsonl.gz', 15)")
+        Auditoria.objects.bulk_create(
+            Auditoria(id=100 + i, usuario_id=1 + i % 2, accion='PRESTAMO_ADD', tabla_afectada='prestamos',
+                      detalle=json.dumps({'mensaje': 'Préstamo', 'prestamo_id': i}), fecha=f'2026-02-{1 + i:02d} 09:00:00')
+            for i in range(20))
+
+    def test_paginas_por_cursor_sobre_archivo_y_tabla(self):
+        filtros, _, _ = leer_filtros({'user_id': '1'})
+        vistos, despues_de = [], None
+        with self.settings(AUDITORIA_ARCHIVO=self.carpeta.name):
+            while True:
+                eventos, despues_de = pagina(filtros, despues_de, tamano=7)
+                vistos.extend(eventos)
+                if despues_de is None:
+                    break
+        self.assertEqual(len(vistos), 25)
+        self.assertTrue(all(e['usuario_id'] == 1 for e in vistos))
+        self.assertEqual([(e['fecha'], e['id']) for e in vistos], sorted((e['fecha'], e['id']) for e in vistos))
+        self.assertEqual(vistos[-1]['detalle'], {'mensaje': 'Préstamo', 'prestamo_id': 18})
+
+    def test_filtros_de_accion_y_fechas(self):
+        filtros, _, _ = leer_filtros({'action': 'login', 'from': '2026-01-10', 'to': '2026-01-12'})
+        with self.settings(AUDITORIA_ARCHIVO=self.carpeta.name):
+            eventos, siguiente = pagina(filtros)
+        self.assertEqual([e['id'] for e in eventos], [9, 10, 11])
+        self.assertIsNone(siguiente)
+        with self.assertRaises(ValueError):
+            leer_filtros({'from': '10/01/2026'})
+
+    def test_exportacion_en_flujo_con_wsgi(self):
+        user = User.objects.create_user(username="bib", password="x")
+        usuario = Usuario.objects.create(id=user.pk, nombre="Bibliotecaria", email="bib@test.cl", password_hash="x", tipo="bibliotecario")
+        Bibliotecario.objects.create(usuario=usuario, universidad="Universidad")
+        self.client.force_login(user)
+        with self.settings(AUDITORIA_ARCHIVO=self.carpeta.name):
+            respuesta = self.client.get('/api/audit/', {'export': '1', 'user_id': '2'})
+            self.assertFalse(respuesta.is_async)
+            eventos = json.loads(b"".join(respuesta.streaming_content))
+        self.assertEqual(len(eventos), 25)
+
+
+class ReportesTest(ConTablasDeLaBiblioteca):
+
+    def setUp(self):
+        # Las tablas de estadisticas y sus triggers los crea BD.py (migracion 14): aqui se llenan a mano
+        with connection.cursor() as c:
+            for tabla, claves in (('estadisticas_libros', 'libro_id'), ('estadisticas_libros_dia', 'dia, libro_id'),
+                                  ('estadisticas_generos_dia', 'dia, genero')):
+                c.execute(f"""CREATE TABLE IF NOT EXISTS {tabla} ({claves}, prestamos INTEGER, devoluciones INTEGER,
+                              atrasadas INTEGER, dias_prestado INTEGER, PRIMARY KEY ({claves}))""")
+            c.executemany("INSERT INTO estadisticas_libros_dia VALUES (%s, %s, %s, %s, %s, %s)", [
+                ('2026-03-01', 1, 4, 0, 0, 0), ('2026-03-05', 1, 0, 3, 1, 20), ('2026-04-01', 2, 6, 2, 2, 30)])
+            c.execute("INSERT INTO estadisticas_libros VALUES (1, 4, 3, 1, 20), (2, 6, 2, 2, 30)")
+            c.executemany("INSERT INTO estadisticas_generos_dia VALUES (%s, %s, %s, %s, %s, %s)", [
+                ('2026-03-01', 'Novela', 4, 0, 0, 0), ('2026-03-05', 'Novela', 0, 3, 1, 20), ('2026-04-01', 'Poesía', 6, 2, 2, 30)])
+        Libro.objects.create(id=1, titulo='Uno', autor='A', genero='Novela', año=2000, cantidad=5, disponibles=5, isbn='1')
+        Libro.objects.create(id=2, titulo='Dos', autor='B', genero='Poesía', año=2001, cantidad=5, disponibles=5, isbn='2')
+
+    def test_reportes_por_rango(self):
+        self.assertEqual([f['nombre'] for f in reportes.libros_mas_prestados()], ['Dos', 'Uno'])
+        self.assertEqual(reportes.libros_mas_prestados('2026-03-01', '2026-03-31'), [
+            {'nombre': 'Uno', 'prestamos': 4, 'devoluciones': 3, 'promedio_dias': 6.7, 'tasa_atraso': 0.333}])
+        self.assertEqual([(f['nombre'], f['prestamos']) for f in reportes.demanda_por_genero('2026-03-02')],
+                         [('Poesía', 6), ('Novela', 0)])
+        self.assertEqual(reportes.resumen()['tasa_atraso'], 0.6)
+        with self.assertRaises(ValueError):
+            reportes.leer_parametros({'to': 'marzo'})
@@ -11,6 +11,12 @@ urlpatterns = [
     path('api/login/', views.login_user, name='api_login'),
     path('api/logout/', views.logout_user, name='api_logout'),
 
+    # --- API DE BÚSQUEDA Y RESUMEN ---
+    path('api/search/', views.search, name='api_search'),
+    path('api/summary/', views.summary, name='api_summary'),
+    path('api/changes/', views.changes, name='api_changes'),
+    path('api/cache/stats/', views.cache_stats, name='api_cache_stats'),
+
     # --- API DE LIBROS ---
     path('api/books/', views.get_books, name='api_get_books'),
     path('api/books/add/', views.add_book, name='api_add_book'),
@@ -29,4 +35,10 @@ urlpatterns = [
     path('api/loans/<int:prestamo_id>/edit/', views.edit_loan, name='api_edit_loan'),
     path('api/loans/<int:prestamo_id>/return/', views.return_loan, name='api_return_loan'),
     path('api/loans/<int:prestamo_id>/delete/', views.delete_loan, name='api_delete_loan'),
+
+    # --- API DE AUDITORÍA ---
+    path('api/audit/', views.audit_log, name='api_audit_log'),
+
+    # --- REPORTES DE CIRCULACIÓN ---
+    path('api/reports/<str:reporte>/', views.circulation_report, name='api_circulation_report'),
 ]
\ No newline at end of file
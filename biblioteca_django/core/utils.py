@@ -0,0 +1,246 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import transaction, close_old_connections, DatabaseError, IntegrityError
+
+from .models import Auditoria, Usuario
+
+# Auditoria de las vistas. Los eventos de un request se juntan (AuditoriaMiddleware)
+# y se entregan todos juntos al terminar el request:
+# - un evento registrado dentro de una transaccion solo se junta si se confirma (on_commit);
+# - con AUDITORIA_EN_SEGUNDO_PLANO (por defecto) se entregan a una cola acotada y un hilo
+#   escritor guarda los de muchos requests con un bulk_create por transaccion. El request
+#   no abre una transaccion de escritura propia para la auditoria;
+# - si la cola esta llena el request espera (nunca se descartan eventos). Si la BD falla el
+#   escritor reintenta; lo que no se pudo guardar al cerrar el proceso, o lo que la BD
+#   rechaza, queda en settings.AUDITORIA_NO_GUARDADA. Al cerrar, vaciar() espera al escritor
+#   y el lote que tenia tomado tampoco se pierde.
+# El usuario de Django se registra con su fila de usuarios (la misma email). Si no tiene,
+# el evento lleva usuario_id NULL (migracion 16 de BD.py) y el nombre de usuario en detalle.
+# Solo se pierde lo que esta en memoria si el proceso se cae.
+
+TAMANO_COLA = 1000          # Lotes (uno por request) esperando al escritor
+MAX_POR_ESCRITURA = 500     # Eventos por bulk_create del escritor
+REINTENTO = 1.0             # Segundos entre reintentos si la BD falla (ej: bloqueada)
+ESPERA_AL_SALIR = 10.0      # Segundos que se espera al escritor al cerrar el proceso
+
+ARCHIVO_NO_GUARDADOS = 'auditoria_no_guardada.jsonl'    # Si no esta el setting AUDITORIA_NO_GUARDADA
+
+logger = logging.getLogger(__name__)
+
+_eventos_del_request = ContextVar('eventos_auditoria', default=None)
+_cola = queue.Queue(maxsize=TAMANO_COLA)
+_escritor = None
+_candado = threading.Lock()
+_cerrando = threading.Event()   # vaciar(): el escritor deja de reintentar y termina
+_en_curso = []                  # Lote que el escritor saco de la cola y todavia no guarda
+
+
+def en_segundo_plano():
+    return getattr(settings, 'AUDITORIA_EN_SEGUNDO_PLANO', True)
+
+
+def archivo_no_guardados():
+    return getattr(settings, 'AUDITORIA_NO_GUARDADA', ARCHIVO_NO_GUARDADOS)
+
+
+def usuario_de(user):
+    """Id en usuarios del usuario de Django (por email), o None si no tiene fila. Se consulta una vez por user."""
+    if not hasattr(user, '_usuario_auditoria'):
+        user._usuario_auditoria = (Usuario.objects.filter(email=user.email).values_list('id', flat=True).first()
+                                   if user.email else None)
+    return user._usuario_auditoria
+
+
+def log_auditoria(user, accion, tabla_afectada, detalle=None, **datos):
+    """
+    Registra un evento de auditoría hecho por user (usuario de Django). Los datos extra (ids,
+    valores anteriores, etc.) se guardan con el mensaje como JSON en detalle: {"mensaje": ..., **datos}.
+    """
+    usuario_id = usuario_de(user)
+    if usuario_id is None:
+        datos['usuario'] = user.get_username()
+    if datos:
+        detalle = json.dumps({'mensaje': detalle, **datos}, ensure_ascii=False, default=str)
+    evento = Auditoria(
+        usuario_id=usuario_id,
+        accion=accion,
+        tabla_afectada=tabla_afectada,
+        detalle=detalle,
+        fecha=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    )
+    eventos = _eventos_del_request.get()
+    if eventos is None:
+        # Fuera de un request (shell, comandos): se entrega al confirmar
+        transaction.on_commit(lambda: entregar([evento]))
+    else:
+        # Sin transaccion abierta on_commit lo ejecuta en el acto
+        transaction.on_commit(lambda: eventos.append(evento))
+
+
+def entregar(eventos):
+    """Entrega eventos confirmados: a la cola del escritor o, sin escritor, un bulk_create en el acto."""
+    if not eventos:
+        return
+    if en_segundo_plano():
+        _iniciar_escritor()
+        _cola.put(eventos)
+    else:
+        try:
+            _guardar(eventos)
+        except DatabaseError as e:
+            logger.error("No se pudo guardar la auditoría: %s", e)
+            _guardar_en_archivo(eventos)
+
+
+def _guardar(eventos):
+    try:
+        with transaction.atomic():
+            Auditoria.objects.bulk_create(eventos)
+    except IntegrityError:
+        # Un evento malo no se lleva al resto del lote: uno por uno, los rechazados al archivo
+        rechazados = []
+        for evento in eventos:
+            try:
+                with transaction.atomic():
+                    evento.save(force_insert=True)
+            except IntegrityError:
+                rechazados.append(evento)
+        if rechazados:
+            logger.error("La BD rechazó %d eventos de auditoría, se guardan en %s", len(rechazados), archivo_no_guardados())
+            _guardar_en_archivo(rechazados)
+
+
+def _guardar_en_archivo(eventos):
+    with _candado, open(archivo_no_guardados(), 'a', encoding='utf-8') as archivo:
+        for evento in eventos:
+            fila = [evento.usuario_id, evento.accion, evento.tabla_afectada, evento.detalle, evento.fecha]
+            archivo.write(json.dumps(fila, ensure_ascii=False) + "\n")
+
+
+def _iniciar_escritor():
+    global _escritor
+    with _candado:
+        if _escritor is None or not _escritor.is_alive():
+            _cerrando.clear()
+            _escritor = threading.Thread(target=_escribir, name='auditoria', daemon=True)
+            _escritor.start()
+
+
+def _escribir():
+    while True:
+        try:
+            eventos = list(_cola.get(timeout=REINTENTO))
+        except queue.Empty:
+            if _cerrando.is_set():
+                return
+            continue
+        lotes = 1
+        while len(eventos) < MAX_POR_ESCRITURA:
+            try:
+                eventos.extend(_cola.get_nowait())
+            except queue.Empty:
+                break
+            lotes += 1
+        with _candado:
+            _en_curso[:] = eventos
+        while True:
+            close_old_connections()
+            try:
+                _guardar(eventos)
+                break
+            except DatabaseError as e:
+                if _cerrando.is_set():
+                    # El proceso se esta cerrando: no se reintenta, el lote va al archivo
+                    _guardar_en_archivo(eventos)
+                    break
+                logger.warning("Auditoría no guardada, se reintenta en %ss: %s", REINTENTO, e)
+                _cerrando.wait(REINTENTO)
+            except Exception:
+                # Error que no se arregla reintentando: el lote no se pierde y el hilo sigue
+                logger.exception("Error al guardar la auditoría, se guarda en %s", archivo_no_guardados())
+                _guardar_en_archivo(eventos)
+                break
+        with _candado:
+            _en_curso.clear()
+        for _ in range(lotes):
+            _cola.task_done()
+        if _cerrando.is_set() and _cola.empty():
+            return
+
+
+def vaciar(espera=ESPERA_AL_SALIR):
+    """
+    Espera a que el escritor guarde lo encolado y lo detiene. Lo que no alcanzó a guardar
+    (en la cola o en el lote que tenía tomado) va al archivo.
+    """
+    limite = time.monotonic() + espera
+    with _cola.all_tasks_done:
+        while _cola.unfinished_tasks:
+            restante = limite - time.monotonic()
+            if restante <= 0 or not _cola.all_tasks_done.wait(restante):
+                break
+    _cerrando.set()
+    pendientes = []
+    while True:
+        try:
+            pendientes.extend(_cola.get_nowait())
+        except queue.Empty:
+            break
+        _cola.task_done()
+    if pendientes:
+        _guardar_en_archivo(pendientes)
+    # El escritor termina su lote (guardado, o al archivo si la BD falla) y sale
+    escritor = _escritor
+    if escritor is not None and escritor.is_alive():
+        escritor.join(max(limite - time.monotonic(), 0) + REINTENTO)
+        if escritor.is_alive():
+            # Sigue bloqueado en la BD: mejor un evento repetido en el archivo que uno perdido
+            with _candado:
+                en_curso = list(_en_curso)
+            if en_curso:
+                logger.error("El escritor de auditoría no terminó, %d eventos van a %s", len(en_curso), archivo_no_guardados())
+                _guardar_en_archivo(en_curso)
+
+
+atexit.register(vaciar)
+
+
+class AuditoriaMiddleware:
+    """Junta los eventos de auditoría del request y los entrega todos juntos al terminar."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        eventos = []
+        token = _eventos_del_request.set(eventos)
+        try:
+            return self.get_response(request)
+        finally:
+            _eventos_del_request.reset(token)
+            entregar(eventos)
+
+    async def _acall(self, request):
+        eventos = []
+        token = _eventos_del_request.set(eventos)
+        try:
+            return await self.get_response(request)
+        finally:
+            _eventos_del_request.reset(token)
+            if eventos:
+                await sync_to_async(entregar)(eventos)
@@ -1,79 +1,37 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseBase
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_http_methods
-from django.db import transaction
+from django.views.decorators.http import require_http_methods, condition
+from django.utils.cache import patch_cache_control
+from django.db import transaction, IntegrityError, connection
 import json
 from datetime import datetime, date
 from django.db.models import F
 from django.core.exceptions import ObjectDoesNotExist
 
+import multas  # Raiz del proyecto: el mismo registro de multas del CLI
+
 from .models import Libro, Prestamo, Universitario, Bibliotecario
 from .utils import log_auditoria
+from .busqueda import buscar_libros, buscar_todo, POR_PAGINA, TIPOS, LIMITE, MAX_LIMITE
+from .serializadores import (libro_serializer, iterar_universitarios, aiterar_universitarios, iterar_prestamos,
+                             aiterar_prestamos, respuesta_json_en_flujo)
+from .asincrono import en_pool, bajo_asgi
+from .cambios import cambios_desde, cursor_actual
+from .catalogo import etag_catalogo, leer_parametros, listar_libros
+from . import cache_catalogo
+from . import consulta_auditoria
+from . import reportes
 
 
 #SERIALIZADORES
 
-def is_bibliotecario(user):
-    """Verifica si el usuario es un bibliotecario."""
-    return Bibliotecario.objects.filter(usuario=user).exists()
-
-def user_serializer(user_instance, role_type):
-    """Serializa un objeto User y su rol asociado para el frontend."""
-    full_name = user_instance.get_full_name() or user_instance.username
-    doc = ""
-    
-    try:
-        if role_type == "Universitario":
-            profile = Universitario.objects.get(usuario=user_instance)
-            doc = profile.doc
-        elif role_type == "Bibliotecario":
-            profile = Bibliotecario.objects.get(usuario=user_instance)
-            doc = profile.doc or "N/A"
-    except ObjectDoesNotExist:
-        pass
-    
-    return {
-        'id': user_instance.pk,
-        'username': user_instance.username,
-        'name': full_name,
-        'doc': doc,
-        'role': role_type,
-    }
-
-def libro_serializer(libro):
-    """Serializa un objeto Libro."""
-    return {
-        'id': libro.pk,
-        'titulo': libro.titulo,
-        'autor': libro.autor,
-        'genero': libro.genero,
-        'año': libro.año,
-        'cantidad': libro.cantidad,
-        'isbn': libro.isbn,
-    }
-
-def prestamo_serializer(prestamo):
-    """Serializa un objeto Prestamo."""
-    try:
-        uni_data = user_serializer(prestamo.universitario.usuario, "Universitario")
-    except Exception:
-        uni_data = {'id': None, 'name': 'Usuario Eliminado', 'doc': 'N/A', 'role': 'Universitario'}
-        
-    return {
-        'id': prestamo.pk,
-        'libro': libro_serializer(prestamo.libro),
-        'universitario': uni_data,
-        'fch_prestamo': prestamo.fch_prestamo.isoformat(),
-        'fch_devolucion': prestamo.fch_devolucion.isoformat(),
-        'is_activo': prestamo.is_activo,
-        'fch_devolucion_real': prestamo.fch_devolucion_real.isoformat() if prestamo.fch_devolucion_real else None,
-    }
-
-
+def is_bibliotecario(request):
+    """Verifica si el usuario del request es un bibliotecario (rol resuelto una vez por sesión, ver roles.py)."""
+    return request.perfil.es_bibliotecario
 
 #VISTAS BASE (HTML)
 
@@ -85,34 +43,29 @@ def index(request):
 
 #VISTAS DE AUTENTICACIÓN Y SESIÓN
 
-@require_http_methods(["GET"])
-def check_session(request):
-    """Verifica si el usuario está autenticado y devuelve sus datos."""
-    if request.user.is_authenticated:
-        role = "Bibliotecario" if is_bibliotecario(request.user) else "Universitario"
-        
-        doc = ""
-        try:
-            profile = Universitario.objects.get(usuario=request.user)
-            doc = profile.doc
-        except ObjectDoesNotExist:
-            try:
-                profile = Bibliotecario.objects.get(usuario=request.user)
-                doc = profile.doc
-            except ObjectDoesNotExist:
-                pass
+# Las vistas de lectura que el panel consulta seguido son async (perfil ASGI, ver
+# biblioteca/settings_asgi.py): la sesión, el rol y las consultas corren en el pool de
+# la BD (asincrono.en_pool) y el proceso no necesita un hilo por conexión abierta.
 
+def _sesion(request):
+    if request.user.is_authenticated:
         return JsonResponse({
             'is_authenticated': True,
             'user_id': request.user.pk,
-            'role': role,
+            'role': request.perfil.rol,
             'full_name': request.user.get_full_name() or request.user.username,
-            'doc': doc or 'N/A',
+            'doc': 'N/A',
             'message': 'Sesión activa.'
         })
     return JsonResponse({'is_authenticated': False, 'message': 'No hay sesión activa.'})
 
 
+@require_http_methods(["GET"])
+async def check_session(request):
+    """Verifica si el usuario está autenticado y devuelve sus datos."""
+    return await en_pool(_sesion, request)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def register_user(request):
@@ -156,7 +109,7 @@ def register_user(request):
             elif role == "Universitario":
                 Universitario.objects.create(usuario=user, doc=doc) 
             
-            log_auditoria(user.id, 'REGISTRO', role, f'Usuario {username} registrado con rol {role}.')
+            log_auditoria(user, 'REGISTRO', 'usuarios', f'Usuario {username} registrado con rol {role}.', rol=role)
 
         return JsonResponse({'success': True, 'message': f'Usuario {username} registrado exitosamente.'}, status=201)
 
@@ -180,20 +133,10 @@ def login_user(request):
 
         if user is not None:
             login(request, user)
-            role = "Bibliotecario" if is_bibliotecario(user) else "Universitario"
-            
-            doc = ""
-            try:
-                profile = Universitario.objects.get(usuario=user)
-                doc = profile.doc
-            except ObjectDoesNotExist:
-                 try:
-                    profile = Bibliotecario.objects.get(usuario=user)
-                    doc = profile.doc
-                 except ObjectDoesNotExist:
-                    pass
-
-            log_auditoria(user.id, 'LOGIN', role, f'Usuario {username} ha iniciado sesión.')
+            # request.perfil es perezoso: se resuelve ahora con el usuario recién autenticado
+            role = request.perfil.rol
+
+            log_auditoria(user, 'LOGIN', 'usuarios', f'Usuario {username} ha iniciado sesión.', rol=role)
             
             return JsonResponse({
                 'success': True, 
@@ -201,7 +144,7 @@ def login_user(request):
                 'user_id': user.pk,
                 'role': role,
                 'full_name': user.get_full_name() or user.username,
-                'doc': doc or 'N/A'
+                'doc': 'N/A'
             })
         else:
             return JsonResponse({'success': False, 'message': 'Usuario o contraseña incorrectos.'}, status=401)
@@ -217,20 +160,218 @@ def login_user(request):
 def logout_user(request):
     """Cierra la sesión del usuario."""
     if request.user.is_authenticated:
-        log_auditoria(request.user.id, 'LOGOUT', 'User', f'Usuario {request.user.username} ha cerrado sesión.')
+        log_auditoria(request.user, 'LOGOUT', 'usuarios', f'Usuario {request.user.username} ha cerrado sesión.')
         logout(request)
         return JsonResponse({'success': True, 'message': 'Sesión cerrada exitosamente.'})
     return JsonResponse({'success': False, 'message': 'No hay sesión para cerrar.'})
 
 
+def _limite(request, por_defecto=None, maximo=None):
+    """Lee ?limit= (entero positivo). None si no se envía y no hay valor por defecto."""
+    valor = request.GET.get('limit')
+    if not valor:
+        return por_defecto
+    limite = int(valor)
+    if limite < 1:
+        raise ValueError("limit debe ser mayor que 0.")
+    return min(limite, maximo) if maximo else limite
+
+
+#VISTAS DE BÚSQUEDA Y RESUMEN
+
+@login_required
+@require_http_methods(["GET"])
+def search(request):
+    """Búsqueda global de la barra superior: ?q=&types=books,users,loans&limit=10. Devuelve un grupo por tipo."""
+    q = request.GET.get('q', '').strip()
+    tipos = [t for t in request.GET.get('types', ','.join(TIPOS)).split(',') if t in TIPOS]
+    try:
+        limite = _limite(request, LIMITE, MAX_LIMITE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'limit debe ser un número entero positivo.'}, status=400)
+
+    grupos = buscar_todo(q, tipos, limite, is_bibliotecario(request), request.user.pk)
+    return JsonResponse({'q': q, **grupos})
+
+
+@login_required
+@require_http_methods(["GET"])
+def summary(request):
+    """Indicadores del panel calculados en la BD (el frontend ya no descarga las tablas para contarlos)."""
+    with connection.cursor() as c:
+        c.execute("""
+            SELECT (SELECT COUNT(*) FROM libros),
+                   (SELECT COALESCE(SUM(disponibles), 0) FROM libros),
+                   (SELECT COUNT(*) FROM universitarios),
+                   (SELECT COUNT(*) FROM prestamos WHERE is_activo = 1)
+        """)
+        libros, disponibles, universitarios, activos = c.fetchone()
+    return JsonResponse({'books': libros, 'available': disponibles, 'users': universitarios, 'active_loans': activos})
+
+
+@login_required
+@require_http_methods(["GET"])
+def changes(request):
+    """
+    Cambios en libros, préstamos y usuarios desde ?since=<cursor> (filas nuevas o modificadas y
+    ids borrados). Sin since devuelve solo el cursor actual para empezar a sincronizar.
+    """
+    since = request.GET.get('since')
+    if not since:
+        return JsonResponse({'cursor': cursor_actual()})
+    try:
+        desde = int(since)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Cursor inválido.'}, status=400)
+    return JsonResponse(cambios_desde(desde, is_bibliotecario(request), request.user.pk))
+
+
 #VISTAS DE LIBROS (CRUD)
 
+def _etag_libros(request):
+    # La version sale de la cache del catalogo (ver cache_catalogo.py): sin consulta a la BD
+    return etag_catalogo(cache_catalogo.version()[0], request.GET.dict())
+
+def _modificado_libros(request):
+    return cache_catalogo.version()[1]
+
+
+@condition(etag_func=_etag_libros, last_modified_func=_modificado_libros)
+def _libros(request):
+    q = request.GET.get('q', '').strip()
+    if q:
+        try:
+            pagina = int(request.GET.get('page', 1))
+            por_pagina = min(int(request.GET.get('page_size', POR_PAGINA)), 100)
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Parámetros de paginación inválidos.'}, status=400)
+
+        def generar():
+            libros, hay_mas = buscar_libros(q, pagina, por_pagina)
+            return {
+                'results': [libro_serializer(libro) for libro in libros],
+                'page': max(1, pagina),
+                'has_more': hay_mas,
+            }
+        clave = f'buscar:{q}:{pagina}:{por_pagina}'
+    else:
+        try:
+            parametros = leer_parametros(request.GET)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+        def generar():
+            libros, siguiente = listar_libros(parametros)
+            return {
+                'results': libros,
+                'next_cursor': siguiente,
+                'has_more': siguiente is not None,
+            }
+        clave = 'listar:' + '&'.join(f'{k}={v}' for k, v in sorted(parametros.items()))
+
+    try:
+        data, desde_cache = cache_catalogo.obtener(clave, generar)
+    except ValueError as e:
+        # Cursor invalido: se detecta al generar la pagina
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    response = JsonResponse(data)
+    response['X-Cache'] = 'HIT' if desde_cache else 'MISS'
+    # El navegador guarda la respuesta pero la revalida siempre (If-None-Match -> 304)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_http_methods(["GET"])
+async def get_books(request):
+    """
+    Devuelve una página del catálogo: ?cursor=&page_size=&fields=&ordering=&genero=&autor=&año=&disponible=1.
+    Con ?q= busca por relevancia. Si el catálogo no cambió responde 304 (ETag / Last-Modified).
+    """
+    return await en_pool(_libros, request)
+
+
+@login_required
+@require_http_methods(["GET"])
+def cache_stats(request):
+    """Aciertos y antigüedad de la cache del catálogo. Solo para bibliotecarios."""
+    if not is_bibliotecario(request):
+        return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
+    return JsonResponse(cache_catalogo.estadisticas())
+
+
+@login_required
+def _filtros_auditoria(request):
+    if not is_bibliotecario(request):
+        return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
+    try:
+        return consulta_auditoria.leer_filtros(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+
+async def _exportar_auditoria(filtros, despues_de, tamano):
+    # Una visita al pool por pagina: la exportacion completa no retiene un hilo
+    while True:
+        eventos, despues_de = await en_pool(consulta_auditoria.pagina, filtros, despues_de, tamano)
+        for evento in eventos:
+            yield evento
+        if despues_de is None:
+            break
+
+
+def _exportar_auditoria_wsgi(filtros, despues_de, tamano):
+    # Con WSGI el servidor recorre el generador en su hilo (ver asincrono.bajo_asgi)
+    while True:
+        eventos, despues_de = consulta_auditoria.pagina(filtros, despues_de, tamano)
+        yield from eventos
+        if despues_de is None:
+            break
+
+
 @require_http_methods(["GET"])
-def get_books(request):
-    """Devuelve la lista de todos los libros."""
-    libros = Libro.objects.all()
-    data = [libro_serializer(libro) for libro in libros]
-    return JsonResponse(data, safe=False)
+async def audit_log(request):
+    """
+    Registro de auditoría filtrado (?user_id, action, table, from, to en AAAA-MM-DD) por páginas
+    con cursor. ?export=1 devuelve todos los eventos en un solo arreglo JSON en flujo. Solo para bibliotecarios.
+    """
+    filtros = await en_pool(_filtros_auditoria, request)
+    if isinstance(filtros, HttpResponseBase):
+        return filtros
+    filtros, despues_de, tamano = filtros
+    if request.GET.get('export'):
+        exportar = _exportar_auditoria if bajo_asgi(request) else _exportar_auditoria_wsgi
+        respuesta = respuesta_json_en_flujo(exportar(filtros, despues_de, consulta_auditoria.MAX_TAMANO_PAGINA))
+        respuesta['Content-Disposition'] = 'attachment; filename="auditoria.json"'
+        return respuesta
+    eventos, siguiente = await en_pool(consulta_auditoria.pagina, filtros, despues_de, tamano)
+    return JsonResponse({
+        'results': eventos,
+        'next_cursor': consulta_auditoria.cursor_de(siguiente),
+        'has_more': siguiente is not None,
+    })
+
+
+@login_required
+def _reporte(request, reporte):
+    if not is_bibliotecario(request):
+        return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
+    if reporte not in reportes.REPORTES:
+        return JsonResponse({'success': False, 'message': f"Reporte desconocido. Opciones: {', '.join(reportes.REPORTES)}."}, status=404)
+    try:
+        desde, hasta, limite = reportes.leer_parametros(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    resultado = reportes.REPORTES[reporte](desde, hasta, limite)
+    return JsonResponse({'from': desde, 'to': hasta, 'results': resultado})
+
+
+@require_http_methods(["GET"])
+async def circulation_report(request, reporte):
+    """
+    Reportes de circulación: summary, books (más prestados, ?limit=), genres y universities,
+    con ?from y ?to (AAAA-MM-DD, inclusivos). Solo para bibliotecarios.
+    """
+    return await en_pool(_reporte, request, reporte)
 
 
 @csrf_exempt
@@ -238,20 +379,22 @@ def get_books(request):
 @require_http_methods(["POST"])
 def add_book(request):
     """Agrega un nuevo libro. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
     
     try:
         data = json.loads(request.body)
-        Libro.objects.create(
+        libro = Libro.objects.create(
             titulo=data['titulo'],
             autor=data['autor'],
             genero=data['genero'],
             año=data.get('año', datetime.now().year),
             cantidad=data['cantidad'],
             isbn=data['isbn'],
+            disponibles=data['cantidad'],
         )
-        log_auditoria(request.user.id, 'LIBRO_ADD', 'Libro', f'Libro {data["titulo"]} agregado.')
+        cache_catalogo.notificar_cambio()
+        log_auditoria(request.user, 'LIBRO_ADD', 'libros', f'Libro {libro.titulo} agregado.', libro_id=libro.pk, cantidad=libro.cantidad)
         return JsonResponse({'success': True, 'message': 'Libro agregado exitosamente.'}, status=201)
     
     except KeyError as e:
@@ -265,7 +408,7 @@ def add_book(request):
 @require_http_methods(["DELETE"])
 def delete_book(request, libro_id):
     """Elimina un libro. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
         
     try:
@@ -273,8 +416,10 @@ def delete_book(request, libro_id):
         if Prestamo.objects.filter(libro=libro, is_activo=True).exists():
             return JsonResponse({'success': False, 'message': 'No se puede eliminar: tiene préstamos activos.'}, status=400)
         
-        log_auditoria(request.user.id, 'LIBRO_DEL', 'Libro', f'Libro {libro.titulo} eliminado.')
+        libro_id = libro.pk
         libro.delete()
+        cache_catalogo.notificar_cambio()
+        log_auditoria(request.user, 'LIBRO_DEL', 'libros', f'Libro {libro.titulo} eliminado.', libro_id=libro_id, isbn=libro.isbn)
         return JsonResponse({'success': True, 'message': 'Libro eliminado.'})
         
     except Libro.DoesNotExist:
@@ -286,17 +431,30 @@ def delete_book(request, libro_id):
 
 #VISTAS DE USUARIOS
 
+def _en_flujo(request, queryset, iterar, aiterar):
+    # queryset viene de una funcion del pool: puede ser la respuesta de error.
+    # Con ASGI cada trozo es una visita al pool; con WSGI el servidor recorre el generador en su hilo
+    if isinstance(queryset, HttpResponseBase):
+        return queryset
+    return respuesta_json_en_flujo(aiterar(queryset) if bajo_asgi(request) else iterar(queryset))
+
+
 @login_required
-@require_http_methods(["GET"])
-def get_users(request):
-    """Devuelve la lista de universitarios. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+def _universitarios(request):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
     
-    universitarios = Universitario.objects.select_related('usuario').all()
-    data = [user_serializer(u.usuario, "Universitario") for u in universitarios]
-    
-    return JsonResponse(data, safe=False)
+    try:
+        limite = _limite(request)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'limit debe ser un número entero positivo.'}, status=400)
+    return Universitario.objects.order_by('usuario_id')[:limite]
+
+
+@require_http_methods(["GET"])
+async def get_users(request):
+    """Devuelve la lista de universitarios (?limit= para solo los primeros). Solo para bibliotecarios."""
+    return _en_flujo(request, await en_pool(_universitarios, request), iterar_universitarios, aiterar_universitarios)
 
 
 @csrf_exempt
@@ -304,7 +462,7 @@ def get_users(request):
 @require_http_methods(["DELETE"])
 def delete_user(request, user_id):
     """Elimina un usuario (User). Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
         
     try:
@@ -318,8 +476,9 @@ def delete_user(request, user_id):
              if Prestamo.objects.filter(universitario=uni, is_activo=True).exists():
                  return JsonResponse({'success': False, 'message': 'No se puede eliminar: el usuario tiene préstamos activos.'}, status=400)
         
-        log_auditoria(request.user.id, 'USER_DEL', 'User', f'Usuario {user.username} eliminado.')
+        usuario_afectado = user.pk
         user.delete()
+        log_auditoria(request.user, 'USER_DEL', 'usuarios', f'Usuario {user.username} eliminado.', usuario_afectado=usuario_afectado)
         return JsonResponse({'success': True, 'message': 'Usuario y perfil asociado eliminados.'})
         
     except User.DoesNotExist:
@@ -331,40 +490,51 @@ def delete_user(request, user_id):
 
 # VISTAS DE PRÉSTAMOS
 
+# Las funciones _prestamos_* corren en el pool: validan permisos y parámetros y devuelven
+# el queryset a enviar, o la respuesta de error
+
 @login_required
-@require_http_methods(["GET"])
-def get_all_loans(request):
-    """Devuelve todos los préstamos. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+def _prestamos_de_todos(request):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
 
-    prestamos = Prestamo.objects.select_related('libro', 'universitario__usuario').all().order_by('-is_activo', '-fch_prestamo')
-    data = [prestamo_serializer(p) for p in prestamos]
-    return JsonResponse(data, safe=False)
+    try:
+        limite = _limite(request)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'limit debe ser un número entero positivo.'}, status=400)
+    return Prestamo.objects.order_by('-is_activo', '-fch_prestamo', '-id')[:limite]
 
 
 @login_required
-@require_http_methods(["GET"])
-def get_user_loans(request, user_id):
-    """Devuelve los préstamos de un usuario específico."""
-    if not is_bibliotecario(request.user) and request.user.pk != user_id:
+def _prestamos_de_usuario(request, user_id):
+    if not is_bibliotecario(request) and request.user.pk != user_id:
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
 
     try:
         universitario = Universitario.objects.get(usuario_id=user_id)
     except Universitario.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Perfil de universitario no encontrado.'}, status=404)
-        
-    prestamos = Prestamo.objects.filter(universitario=universitario).select_related('libro', 'universitario__usuario').order_by('-is_activo', '-fch_prestamo')
-    data = [prestamo_serializer(p) for p in prestamos]
-    return JsonResponse(data, safe=False)
+
+    return Prestamo.objects.filter(universitario=universitario).order_by('-is_activo', '-fch_prestamo', '-id')
+
+
+@require_http_methods(["GET"])
+async def get_all_loans(request):
+    """Devuelve todos los préstamos, activos primero (?limit= para solo los primeros). Solo para bibliotecarios."""
+    return _en_flujo(request, await en_pool(_prestamos_de_todos, request), iterar_prestamos, aiterar_prestamos)
+
+
+@require_http_methods(["GET"])
+async def get_user_loans(request, user_id):
+    """Devuelve los préstamos de un usuario específico."""
+    return _en_flujo(request, await en_pool(_prestamos_de_usuario, request, user_id), iterar_prestamos, aiterar_prestamos)
 
 
 @csrf_exempt
 @login_required
 @require_http_methods(["POST"])
 def add_loan(request):
-    """Registra un nuevo préstamo (Sin modificar el stock total del libro)."""
+    """Registra un nuevo préstamo descontando una copia disponible (el total del libro no cambia)."""
     try:
         data = json.loads(request.body)
         libro_id = data.get('libro_id')
@@ -375,7 +545,7 @@ def add_loan(request):
         if not all([libro_id, universitario_id, fch_prestamo_str, fch_devolucion_str]):
             return JsonResponse({'success': False, 'message': 'Faltan datos.'}, status=400)
 
-        if not is_bibliotecario(request.user) and request.user.pk != universitario_id:
+        if not is_bibliotecario(request) and request.user.pk != universitario_id:
             return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
         
         libro = Libro.objects.get(pk=libro_id)
@@ -384,9 +554,7 @@ def add_loan(request):
         if Prestamo.objects.filter(libro=libro, is_activo=True, universitario=universitario).exists():
              return JsonResponse({'success': False, 'message': 'El usuario ya tiene prestado este libro.'}, status=400)
 
-        prestados_actualmente = Prestamo.objects.filter(libro=libro, is_activo=True).count()
-        
-        if prestados_actualmente >= libro.cantidad:
+        if libro.disponibles is not None and libro.disponibles <= 0:
             return JsonResponse({'success': False, 'message': 'No quedan copias disponibles.'}, status=400)
 
         fch_prestamo = datetime.strptime(fch_prestamo_str, '%Y-%m-%d').date()
@@ -396,15 +564,23 @@ def add_loan(request):
             return JsonResponse({'success': False, 'message': 'Fecha de devolución inválida.'}, status=400)
 
         with transaction.atomic():
-            Prestamo.objects.create(
+            # Descuento condicional: la lectura anterior es solo para responder rápido,
+            # la reserva real es este UPDATE (dos solicitudes no toman la misma última copia)
+            reservadas = Libro.objects.filter(pk=libro.pk, disponibles__gt=0).update(disponibles=F('disponibles') - 1)
+            if not reservadas:
+                return JsonResponse({'success': False, 'message': 'No quedan copias disponibles.'}, status=400)
+            prestamo = Prestamo.objects.create(
                 libro=libro,
                 universitario=universitario,
+                dias=(fch_devolucion - fch_prestamo).days,
                 fch_prestamo=fch_prestamo,
                 fch_devolucion=fch_devolucion,
                 is_activo=True
             )
+            cache_catalogo.notificar_cambio()
         
-        log_auditoria(request.user.id, 'PRESTAMO_ADD', 'Prestamo', f'Préstamo de {libro.titulo} a {universitario.usuario.username}.')
+        log_auditoria(request.user, 'PRESTAMO_ADD', 'prestamos', f'Préstamo de {libro.titulo} a {universitario.usuario.username}.',
+                      prestamo_id=prestamo.pk, libro_id=libro.pk, universitario_id=universitario.pk)
 
         return JsonResponse({'success': True, 'message': 'Préstamo registrado exitosamente.'}, status=201)
 
@@ -418,21 +594,37 @@ def add_loan(request):
 @login_required
 @require_http_methods(["POST"])
 def return_loan(request, prestamo_id):
-    """Registra la devolución (Solo cambia el estado del préstamo)."""
+    """Registra la devolución y repone la copia disponible."""
     try:
         prestamo = Prestamo.objects.get(pk=prestamo_id)
 
-        if not is_bibliotecario(request.user) and prestamo.universitario.usuario != request.user:
+        if not is_bibliotecario(request) and prestamo.universitario.usuario != request.user:
             return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
 
         if not prestamo.is_activo:
             return JsonResponse({'success': False, 'message': 'Este préstamo ya fue devuelto.'}, status=400)
 
-        prestamo.is_activo = False
-        prestamo.fch_devolucion_real = date.today()
-        prestamo.save()
+        hoy = date.today()
+        valor_uf = None
+        if hoy > prestamo.fch_devolucion:
+            # UF guardada (cache valores_uf): la devolución no espera a la API
+            with connection.cursor() as c:
+                c.execute("SELECT " + multas.SQL_UF_DEL_DIA.format(fecha='%s'), [hoy.strftime('%Y-%m-%d')])
+                valor_uf = c.fetchone()[0]
+
+        with transaction.atomic():
+            # Solo repone la copia quien efectivamente cambia el préstamo de activo a devuelto
+            devueltos = Prestamo.objects.filter(pk=prestamo.pk, is_activo=True).update(
+                is_activo=False, fch_devolucion_real=hoy
+            )
+            if not devueltos:
+                return JsonResponse({'success': False, 'message': 'Este préstamo ya fue devuelto.'}, status=400)
+            Libro.objects.filter(pk=prestamo.libro_id).update(disponibles=F('disponibles') + 1)
+            # La multa queda en FINAL con la devolución, igual que en el CLI (misma conexión sqlite3)
+            multas.finalizar(connection.connection.cursor(), prestamo.pk, hoy, valor_uf)
+            cache_catalogo.notificar_cambio()
         
-        log_auditoria(request.user.id, 'PRESTAMO_RETURN', 'Prestamo', f'Devolución ID {prestamo.id}.')
+        log_auditoria(request.user, 'PRESTAMO_RETURN', 'prestamos', f'Devolución ID {prestamo.id}.', prestamo_id=prestamo.pk, libro_id=prestamo.libro_id)
 
         return JsonResponse({'success': True, 'message': 'Libro devuelto exitosamente.'})
 
@@ -447,23 +639,24 @@ def return_loan(request, prestamo_id):
 @require_http_methods(["DELETE"])
 def delete_loan(request, prestamo_id):
     """Elimina un registro de préstamo. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
 
     try:
         loan = Prestamo.objects.get(pk=prestamo_id)
 
         with transaction.atomic():
-            if loan.is_activo:
-                libro = loan.libro
-                libro.cantidad = F('cantidad') + 1
-                libro.save(update_fields=['cantidad'])
-                libro.refresh_from_db()
-                
             loan_id = loan.pk
-            loan.delete()
+            # El borrado de un préstamo activo repone su copia (el total del libro no cambia)
+            activos, _ = Prestamo.objects.filter(pk=loan_id, is_activo=True).delete()
+            if activos:
+                Libro.objects.filter(pk=loan.libro_id).update(disponibles=F('disponibles') + 1)
+                cache_catalogo.notificar_cambio()
+            else:
+                Prestamo.objects.filter(pk=loan_id).delete()
         
-        log_auditoria(request.user.id, 'PRESTAMO_DEL', 'Prestamo', f'Préstamo ID {loan_id} eliminado (Forzado).')
+        log_auditoria(request.user, 'PRESTAMO_DEL', 'prestamos', f'Préstamo ID {loan_id} eliminado (Forzado).',
+                      prestamo_id=loan_id, libro_id=loan.libro_id, estaba_activo=bool(activos))
         return JsonResponse({'success': True, 'message': 'Préstamo eliminado exitosamente.'})
     
     except Prestamo.DoesNotExist:
@@ -477,7 +670,7 @@ def delete_loan(request, prestamo_id):
 @require_http_methods(["POST"])
 def edit_book(request, libro_id):
     """Edita un libro existente. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
     
     try:
@@ -492,9 +685,16 @@ def edit_book(request, libro_id):
         if 'cantidad' in data:
              libro.cantidad = int(data['cantidad'])
 
-        libro.save()
+        # disponibles no se escribe desde aqui: el trigger de la BD la ajusta segun el nuevo total
+        try:
+            libro.save(update_fields=['titulo', 'autor', 'genero', 'isbn', 'cantidad'])
+        except IntegrityError as e:
+            if 'CHECK' in str(e):
+                return JsonResponse({'success': False, 'message': 'La cantidad no puede ser menor que las copias prestadas.'}, status=400)
+            raise
+        cache_catalogo.notificar_cambio()
         
-        log_auditoria(request.user.id, 'LIBRO_EDIT', 'Libro', f'Libro {libro.titulo} editado.')
+        log_auditoria(request.user, 'LIBRO_EDIT', 'libros', f'Libro {libro.titulo} editado.', libro_id=libro.pk, cambios=sorted(data))
         return JsonResponse({'success': True, 'message': 'Libro actualizado exitosamente.'})
 
     except Libro.DoesNotExist:
@@ -507,7 +707,7 @@ def edit_book(request, libro_id):
 @require_http_methods(["POST"])
 def edit_user(request, user_id):
     """Edita un usuario existente. Solo para bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
     
     try:
@@ -531,7 +731,7 @@ def edit_user(request, user_id):
                 uni.doc = data['doc']
                 uni.save()
 
-        log_auditoria(request.user.id, 'USER_EDIT', 'User', f'Usuario {target_user.username} editado.')
+        log_auditoria(request.user, 'USER_EDIT', 'usuarios', f'Usuario {target_user.username} editado.', usuario_afectado=target_user.pk, cambios=sorted(data))
         return JsonResponse({'success': True, 'message': 'Usuario actualizado exitosamente.'})
 
     except User.DoesNotExist:
@@ -544,7 +744,7 @@ def edit_user(request, user_id):
 @require_http_methods(["POST"])
 def edit_loan(request, prestamo_id):
     """Edita un préstamo activo (ej: extender fecha). Solo bibliotecarios."""
-    if not is_bibliotecario(request.user):
+    if not is_bibliotecario(request):
         return JsonResponse({'success': False, 'message': 'Permiso denegado.'}, status=403)
     
     try:
@@ -563,7 +763,7 @@ def edit_loan(request, prestamo_id):
 
         loan.save()
         
-        log_auditoria(request.user.id, 'LOAN_EDIT', 'Prestamo', f'Préstamo ID {loan.id} editado.')
+        log_auditoria(request.user, 'LOAN_EDIT', 'prestamos', f'Préstamo ID {loan.id} editado.', prestamo_id=loan.pk, cambios=sorted(data))
         return JsonResponse({'success': True, 'message': 'Préstamo actualizado exitosamente.'})
 
     except Prestamo.DoesNotExist:
@@ -0,0 +1,42 @@
+import re
+from conexion import get_conexion
+
+# Busqueda del catalogo sobre el indice FTS5 libros_fts (ver migracion 4 en BD.py)
+
+POR_PAGINA = 10
+
+# Peso de cada columna en bm25: titulo, autor, genero
+PESOS_BM25 = (10.0, 5.0, 1.0)
+
+
+def expresion_fts(texto):
+    """
+    Convierte el texto ingresado en una consulta FTS5 segura.
+    Cada palabra se busca como prefijo: 'garcia cien' -> '"garcia"* "cien"*'
+    """
+    terminos = re.findall(r'\w+', texto)
+    return " ".join(f'"{termino}"*' for termino in terminos)
+
+
+def buscar_libros(texto, pagina=1, por_pagina=POR_PAGINA):
+    """
+    Busca libros por titulo, autor o genero ordenados por relevancia (bm25).
+    Devuelve (filas, hay_mas) donde cada fila es (id, titulo, autor, disponibles).
+    """
+    consulta = expresion_fts(texto)
+    if not consulta:
+        return [], False
+    pagina = max(1, int(pagina))
+
+    c = get_conexion().cursor()
+    # Se pide una fila extra para saber si existe una pagina siguiente
+    c.execute(f"""
+        SELECT l.id, l.titulo, l.autor, l.disponibles
+        FROM libros_fts
+        JOIN libros l ON l.id = libros_fts.rowid
+        WHERE libros_fts MATCH ?
+        ORDER BY bm25(libros_fts, {', '.join(str(p) for p in PESOS_BM25)})
+        LIMIT ? OFFSET ?
+    """, (consulta, por_pagina + 1, (pagina - 1) * por_pagina))
+    filas = c.fetchall()
+    return filas[:por_pagina], len(filas) > por_pagina
@@ -1,7 +1,8 @@
-import sqlite3
 import bcrypt
 import re
 from datetime import datetime, timedelta, date
+from conexion import get_conexion, transaccion
+from prestamos import validar_dias, realizar_prestamos
 
 # Tengo que añadir prestamos para el Universitario
 # Ademas tiene que poder pedir un prestamo, y si el libro esta disponible que lo añada a prestamos
@@ -30,11 +31,9 @@ class Usuario:
             raise ValueError("La contraseña contiene caracteres no compatibles con latin-1.") # Latin-1 solo permite letras acentuadas, signos y simbolos especiales, Loggear error
         
     def mostrar_info(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
+        c = get_conexion().cursor()
         c.execute("SELECT id, nombre, email from usuarios where email = ?", (self._email,))
         fila = c.fetchone()
-        conn.close()
 
         if fila:
             id_usuario, nombre, email = fila
@@ -45,22 +44,30 @@ class Usuario:
             print("Usuario no encontrado.")
 
 
+    @classmethod
+    def desde_bd(cls, id_usuario, nombre, email, password_hash, universidad=None):
+        """Construye un usuario ya guardado desde su fila, sin validar ni volver a hashear la contraseña."""
+        usuario = cls.__new__(cls)
+        usuario.id = id_usuario
+        usuario.nombre = nombre
+        usuario._email = email
+        usuario._password_hash = password_hash
+        if universidad is not None:
+            usuario.universidad = universidad
+        return usuario
+
     def verificar_password(self, password):
         return bcrypt.checkpw(password.encode('latin-1'), self._password_hash)
     
     def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
-        fila = c.fetchone()
-        if fila:
-            conn.close()
-            raise ValueError("El usuario ya está registrado.")
-        else:
-            c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, ?, 'usuario')", (self.nombre, self._email, self._password_hash))
-            self.id = c.lastrowid
-            conn.commit()
-            conn.close()
+        with transaccion() as c:
+            c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
+            fila = c.fetchone()
+            if fila:
+                raise ValueError("El usuario ya está registrado.")
+            else:
+                c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, ?, 'usuario')", (self.nombre, self._email, self._password_hash))
+                self.id = c.lastrowid
     
 class Bibliotecario(Usuario):
     def __init__(self,nombre,email,password,universidad):
@@ -71,8 +78,7 @@ class Bibliotecario(Usuario):
             self.universidad = universidad
     
     def mostrar_info(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
+        c = get_conexion().cursor()
         
         c.execute("SELECT id, nombre, email FROM usuarios WHERE email = ? AND tipo = 'bibliotecario'", (self._email,))
         fila = c.fetchone()
@@ -89,27 +95,22 @@ class Bibliotecario(Usuario):
             print(f"Universidad: {universidad}")
         else:
             print("Usuario no encontrado o no es bibliotecario.")
-        
-        conn.close()
 
 
     def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
-        fila = c.fetchone()
-        if not fila:
-            super().save()
-            usuario_id = self.id
-        else:
-            usuario_id = fila[0]
-        c.execute("SELECT usuario_id FROM bibliotecarios WHERE usuario_id = ?", (usuario_id,))
-        if c.fetchone():
-            raise ValueError("El usuario ya está registrado.")
-        c.execute("INSERT INTO bibliotecarios (usuario_id, universidad) VALUES (?, ?)", (usuario_id, self.universidad))
-        c.execute("UPDATE usuarios SET tipo = 'bibliotecario' WHERE id = ?", (usuario_id,))
-        conn.commit()
-        conn.close()
+        with transaccion() as c:
+            c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
+            fila = c.fetchone()
+            if not fila:
+                super().save()
+                usuario_id = self.id
+            else:
+                usuario_id = fila[0]
+            c.execute("SELECT usuario_id FROM bibliotecarios WHERE usuario_id = ?", (usuario_id,))
+            if c.fetchone():
+                raise ValueError("El usuario ya está registrado.")
+            c.execute("INSERT INTO bibliotecarios (usuario_id, universidad) VALUES (?, ?)", (usuario_id, self.universidad))
+            c.execute("UPDATE usuarios SET tipo = 'bibliotecario' WHERE id = ?", (usuario_id,))
 
 class Universitario(Usuario):
     def __init__(self,nombre,email,password,universidad):
@@ -121,8 +122,7 @@ class Universitario(Usuario):
 
 
     def mostrar_info(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
+        c = get_conexion().cursor()
 
         c.execute("SELECT id, nombre, email FROM usuarios WHERE email = ?", (self._email,))
         fila = c.fetchone()
@@ -138,26 +138,22 @@ class Universitario(Usuario):
             print(f"Universidad: {universidad}")
         else:
             print("Usuario no encontrado.")
-        conn.close()
 
 
     def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
-        fila = c.fetchone()
-        if not fila:
-            super().save()
-            usuario_id = self.id
-        else:
-            usuario_id = fila[0]
-        c.execute("SELECT usuario_id FROM universitarios WHERE usuario_id = ?", (usuario_id,))
-        if c.fetchone():
-            raise ValueError("El usuario ya está registrado.")
-        c.execute("INSERT INTO universitarios (usuario_id, universidad) VALUES (?, ?)", (usuario_id, self.universidad))
-        c.execute("UPDATE usuarios SET tipo = 'universitario' WHERE id = ?", (usuario_id,))
-        conn.commit()
-        conn.close()
+        with transaccion() as c:
+            c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
+            fila = c.fetchone()
+            if not fila:
+                super().save()
+                usuario_id = self.id
+            else:
+                usuario_id = fila[0]
+            c.execute("SELECT usuario_id FROM universitarios WHERE usuario_id = ?", (usuario_id,))
+            if c.fetchone():
+                raise ValueError("El usuario ya está registrado.")
+            c.execute("INSERT INTO universitarios (usuario_id, universidad) VALUES (?, ?)", (usuario_id, self.universidad))
+            c.execute("UPDATE usuarios SET tipo = 'universitario' WHERE id = ?", (usuario_id,))
 
 
 
@@ -171,33 +167,28 @@ class Admin(Usuario):
         return super().mostrar_info()
 
     def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
-        fila = c.fetchone()
-        if not fila:
-            super().save()
-            usuario_id = self.id
-        else:
-            usuario_id = fila[0]
-        c.execute("SELECT usuario_id FROM admin WHERE usuario_id = ?", (usuario_id,))
-        if c.fetchone():
-            raise ValueError("El usuario ya está registrado.")
-        c.execute("INSERT INTO admin (usuario_id) VALUES (?)", (usuario_id,))
-        c.execute("UPDATE usuarios SET tipo = 'admin' WHERE id = ?", (usuario_id,))
-        conn.commit()
-        conn.close()
+        with transaccion() as c:
+            c.execute("SELECT id FROM usuarios WHERE email = ?", (self._email,))
+            fila = c.fetchone()
+            if not fila:
+                super().save()
+                usuario_id = self.id
+            else:
+                usuario_id = fila[0]
+            c.execute("SELECT usuario_id FROM admin WHERE usuario_id = ?", (usuario_id,))
+            if c.fetchone():
+                raise ValueError("El usuario ya está registrado.")
+            c.execute("INSERT INTO admin (usuario_id) VALUES (?)", (usuario_id,))
+            c.execute("UPDATE usuarios SET tipo = 'admin' WHERE id = ?", (usuario_id,))
 
 
 
     def modificar_usuario(self):
         buscar = input("Ingrese el ID del usuario que desea modificar: ").strip()
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
+        c = get_conexion().cursor()
         c.execute("SELECT id, nombre, email, tipo FROM usuarios WHERE id = ?", (buscar,))
         fila = c.fetchone()
         if not fila:
-            conn.close()
             raise ValueError("El usuario no existe.")
         id_usuario, nombre, email, tipo = fila
         print(f"\nID: {id_usuario}\nNombre: {nombre}\nEmail: {email}\nTipo: {tipo}")
@@ -217,71 +208,66 @@ class Admin(Usuario):
                 print("No se encontró universidad asociada.")
         else:
             print("Este usuario no tiene universidad asociada (tipo admin).")
-        conn.close()
         
 
         
+def usuario_desde_bd(id_usuario, nombre, email, password_hash, tipo, universidad=None):
+    """Crea el objeto de la clase que corresponde al tipo de usuario guardado en la base de datos."""
+    clases_por_tipo = {
+        'universitario': Universitario,
+        'bibliotecario': Bibliotecario,
+        'admin': Admin,
+    }
+    clase = clases_por_tipo.get(tipo, Usuario)
+    return clase.desde_bd(id_usuario, nombre, email, password_hash, universidad)
+
+
+def validar_libro(titulo, autor, genero, año, cantidad, isbn):
+    """Valida los datos de un libro con los patrones y devuelve (titulo, autor, genero, año, cantidad, isbn)."""
+    if not re.match(patron_nombre_libro, titulo):
+        raise ValueError("El titulo solo puede contener letras, numeros y espacios.") 
+    if not re.match(patron_nombre, autor):
+        raise ValueError("El autor solo puede contener letras y espacios.") 
+    if not re.match(patron_nombre, genero):
+        raise ValueError("El genero solo puede contener letras y espacios.") 
+    año_actual = datetime.now().year
+    if not re.match(r'^\d{4}$', str(año)) or not (1000 <= int(año) <= año_actual):
+        raise ValueError(f"Año inválido, debe estar entre 1000 y {año_actual}") 
+    try:
+        cantidad = int(cantidad)
+    except ValueError:
+        raise ValueError("La cantidad tiene que ser un numero entero.")
+    if cantidad < 0:
+        raise ValueError("La cantidad no puede ser negativa.")
+    if not re.match(patron_isbn, isbn):
+        raise ValueError("El ISBN no tiene un formato válido.") 
+    return titulo, autor, genero, int(año), cantidad, isbn
+
+
 class Libro:
     def __init__(self,titulo,autor,genero,año,cantidad,isbn):
-        if not re.match(patron_nombre_libro, titulo):
-            raise ValueError("El titulo solo puede contener letras, numeros y espacios.") 
-        else:
-            self.titulo = titulo
-        if not re.match(patron_nombre, autor):
-            raise ValueError("El autor solo puede contener letras y espacios.") 
-        else:
-            self.autor = autor
-        if not re.match(patron_nombre, genero):
-            raise ValueError("El genero solo puede contener letras y espacios.") 
-        else:
-            self.genero = genero
-        año_actual = datetime.now().year
-        if not re.match(r'^\d{4}$', str(año)) or not (1000 <= int(año) <= año_actual):
-            raise ValueError(f"Año inválido, debe estar entre 1000 y {año_actual}") 
-        else:
-            self.año = int(año)
-        try:
-            self.cantidad = int(cantidad)
-        except ValueError:
-            raise ValueError("La cantidad tiene que ser un numero entero.")
-        if not re.match(patron_isbn, isbn):
-            raise ValueError("El ISBN no tiene un formato válido.") 
-        else:
-            self.isbn = isbn
+        self.titulo, self.autor, self.genero, self.año, self.cantidad, self.isbn = validar_libro(titulo, autor, genero, año, cantidad, isbn)
             
     def mostrar_info(self):
         print(f"Título: {self.titulo}, Autor: {self.autor}, Género: {self.genero}, Año: {self.año}, Tipo: {self.tipo}, Cantidad: {self.cantidad}, ISBN: {self.isbn}") 
 
     def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        c.execute("SELECT id FROM libros WHERE isbn = ?", (self.isbn,))
-        fila = c.fetchone()
-        if fila:
-            conn.close()
-            raise ValueError("Ya existe un libro con ese ISBN.")
-        else:
-            c.execute("INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn) VALUES (?, ?, ?, ?, ?, ?)", (self.titulo, self.autor, self.genero, self.año, self.cantidad, self.isbn))
-            self.id = c.lastrowid
-            conn.commit()
-            conn.close()
+        with transaccion() as c:
+            c.execute("SELECT id FROM libros WHERE isbn = ?", (self.isbn,))
+            fila = c.fetchone()
+            if fila:
+                raise ValueError("Ya existe un libro con ese ISBN.")
+            else:
+                c.execute("INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn, disponibles) VALUES (?, ?, ?, ?, ?, ?, ?)", (self.titulo, self.autor, self.genero, self.año, self.cantidad, self.isbn, self.cantidad))
+                self.id = c.lastrowid
 
 
 from datetime import datetime, timedelta, date
-import sqlite3
 
 class Prestamo:
     def __init__(self, universitario, libro, dias):
         # Maximo 14 dias de prestamo
-        try:
-            dias = int(dias)
-        except ValueError:
-            raise ValueError("La cantidad de días debe ser un número entero.")
-        
-        if dias <= 0:
-            raise ValueError("El préstamo debe ser por al menos 1 día.")
-        if dias > 14:
-            raise ValueError("El préstamo no puede ser por más de 14 días (2 semanas).")
+        dias = validar_dias(dias)
 
         self._universitario = universitario
         self._libro = libro
@@ -292,53 +278,27 @@ class Prestamo:
         self._fch_devolucion_real = None 
         
     def ver_prestamo(self):
-        fch_dev_dt = datetime.strptime(self._fch_devolucion, '%Y-%m-%d').date()
-        fch_prestamo_dt = datetime.strptime(self._fch_prestamo, '%Y-%m-%d').date()
-        
-        dias_restantes = (fch_dev_dt - date.today()).days
-        
-        estado = "ACTIVO"
-        if not self._is_activo:
+        # Un préstamo recién creado no puede estar atrasado: vence en self._dias días
+        dias_restantes, estado = self._dias, "ACTIVO"
+        if getattr(self, 'id', None) is not None:
+            # Ya guardado: días restantes y estado se calculan en SQL (vista_prestamos)
+            c = get_conexion().cursor()
+            c.execute("SELECT dias_restantes, estado, fch_devolucion_real FROM vista_prestamos WHERE id = ?", (self.id,))
+            fila = c.fetchone()
+            if fila:
+                dias_restantes, estado, self._fch_devolucion_real = fila
+                self._is_activo = 0 if estado == "DEVUELTO" else 1
+        if estado == "DEVUELTO":
             estado = f"DEVUELTO ({self._fch_devolucion_real})"
-        elif dias_restantes < 0:
-            estado = "ATRASADO"
+        elif estado == "HOY":
+            estado = "ACTIVO"
         
         print(f"Universitario: {self._universitario.nombre}, Libro: {self._libro.titulo}")
-        print(f"Fecha de prestamo: {fch_prestamo_dt}, Vencimiento: {fch_dev_dt}, Estado: {estado}")
+        print(f"Fecha de prestamo: {self._fch_prestamo}, Vencimiento: {self._fch_devolucion}, Estado: {estado}")
         if dias_restantes >= 0 and self._is_activo:
             print(f"Días restantes: {dias_restantes}")
 
 
-    def save(self):
-        conn = sqlite3.connect('biblioteca.db')
-        c = conn.cursor()
-        
-        # 1. Verificar Universitario
-        c.execute("SELECT id FROM usuarios WHERE id = ? AND tipo = 'universitario'", (self._universitario.id,))
-        if not c.fetchone():
-            conn.close()
-            raise ValueError("El universitario no existe en la base de datos.")
-            
-        # 2. Verificar Libro
-        c.execute("SELECT cantidad FROM libros WHERE id = ?", (self._libro.id,))
-        fila = c.fetchone()
-        if not fila:
-            conn.close()
-            raise ValueError("El libro no existe.")
-        
-        cantidad = fila[0]
-        if cantidad <= 0:
-            conn.close()
-            raise ValueError("No hay copias disponibles de este libro.")
-            
-        # 3. Insertar el préstamo (incluyendo los nuevos campos de estado)
-        c.execute("INSERT INTO prestamos (universitario_id, libro_id, dias, fch_prestamo, fch_devolucion, is_activo) VALUES (?, ?, ?, ?, ?, ?)", 
-                  (self._universitario.id, self._libro.id, self._dias, self._fch_prestamo, self._fch_devolucion, self._is_activo))
-        
-        self.id = c.lastrowid
-        
-        # 4. Actualizar el inventario
-        c.execute("UPDATE libros SET cantidad = cantidad - 1 WHERE id = ?", (self._libro.id,))
-        
-        conn.commit()
-        conn.close()
+    def save(self, usuario_auditoria=None):
+        # Reserva atómica de la copia (ver prestamos.realizar_prestamos)
+        self.id = realizar_prestamos(self._universitario.id, [self._libro.id], self._dias, usuario_auditoria)[0]
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import atexit
+from contextlib import contextmanager
+
+# Ruta de la base de datos (se puede cambiar con la variable de entorno BIBLIOTECA_DB)
+DB_PATH = os.environ.get('BIBLIOTECA_DB', 'biblioteca.db')
+
+# Configuracion que se aplica una sola vez por conexion
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",        # Lectores y escritor no se bloquean entre terminales
+    "PRAGMA busy_timeout = 5000",       # Espera hasta 5s en vez de fallar con 'database is locked'
+    "PRAGMA synchronous = NORMAL",      # Seguro con WAL y evita un fsync por commit
+    "PRAGMA cache_size = -16000",       # 16 MB de cache de paginas
+    "PRAGMA mmap_size = 268435456",     # 256 MB de lectura mapeada en memoria
+)
+
+# Cada hilo reutiliza su propia conexion (sqlite3 no comparte conexiones entre hilos)
+_local = threading.local()
+_conexiones = []
+_lock = threading.Lock()
+_generacion = 0
+
+
+def _configurar(conn):
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+def get_conexion():
+    """Devuelve la conexion reutilizable del hilo actual, creandola si no existe."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generacion', None) != (_generacion, DB_PATH):
+        # isolation_level=None: las transacciones se controlan con transaccion()
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+        _configurar(conn)
+        _local.conn = conn
+        _local.generacion = (_generacion, DB_PATH)
+        _local.nivel = 0
+        with _lock:
+            _conexiones.append(conn)
+    return conn
+
+
+@contextmanager
+def transaccion(modo='DEFERRED'):
+    """
+    Abre una transaccion en la conexion del hilo y entrega un cursor.
+    Hace commit al salir o rollback si ocurre un error. Si ya hay una
+    transaccion abierta en el hilo, la reutiliza (no hace commit propio).
+    """
+    conn = get_conexion()
+    c = conn.cursor()
+    if _local.nivel > 0:
+        _local.nivel += 1
+        try:
+            yield c
+        finally:
+            _local.nivel -= 1
+        return
+
+    c.execute(f"BEGIN {modo}")
+    _local.nivel = 1
+    try:
+        yield c
+    except BaseException:
+        _local.nivel = 0
+        conn.rollback()
+        raise
+    else:
+        _local.nivel = 0
+        conn.commit()
+
+
+def en_transaccion():
+    """Indica si el hilo actual tiene una transaccion abierta."""
+    return getattr(_local, 'nivel', 0) > 0
+
+
+def cerrar_conexion_del_hilo():
+    """Cierra la conexion del hilo actual (hilos de corta vida: que no quede abierta al terminar)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    with _lock:
+        if conn in _conexiones:
+            _conexiones.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+    _local.__dict__.clear()
+
+
+def cerrar_conexiones():
+    """Cierra todas las conexiones abiertas (al salir del programa o en pruebas)."""
+    global _generacion
+    with _lock:
+        _generacion += 1
+        for conn in _conexiones:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _conexiones.clear()
+    _local.__dict__.clear()
+
+
+atexit.register(cerrar_conexiones)
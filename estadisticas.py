@@ -0,0 +1,146 @@
+import sys
+
+from conexion import get_conexion, transaccion
+
+# Estadisticas de circulacion: libros mas prestados, demanda por genero, uso por
+# universidad, duracion promedio de los prestamos y tasa de devoluciones atrasadas.
+#
+# Los reportes leen solo las tablas estadisticas_* (migracion 14 de BD.py), que los
+# triggers de prestamos mantienen en la misma transaccion de cada prestamo, devolucion,
+# modificacion o eliminacion, sea desde el CLI o desde Django. Asi un reporte recorre
+# los dias del rango pedido (o los primeros libros del indice), nunca el historial.
+#
+# Un prestamo se cuenta el dia de fch_prestamo y su devolucion el dia de fch_devolucion_real.
+# El genero y la universidad son los vigentes al registrar cada movimiento: si se
+# corrigen despues, reconstruir() vuelve a agrupar todo con los valores actuales.
+
+TOP_LIBROS = 10
+
+# Un prestamo y, si ya se devolvio, su devolucion (columnas de las tablas estadisticas_*)
+SQL_MOVIMIENTOS = """
+    SELECT date(fch_prestamo) AS dia, libro_id, universitario_id,
+           1 AS prestamos, 0 AS devoluciones, 0 AS atrasadas, 0 AS dias_prestado
+    FROM prestamos
+    UNION ALL
+    SELECT date(fch_devolucion_real), libro_id, universitario_id, 0, 1,
+           date(fch_devolucion_real) > date(fch_devolucion),
+           CAST(julianday(fch_devolucion_real) - julianday(fch_prestamo) AS INTEGER)
+    FROM prestamos
+    WHERE is_activo = 0 AND fch_devolucion_real IS NOT NULL
+"""
+
+SUMAS = ("SUM(prestamos) AS prestamos, SUM(devoluciones) AS devoluciones, "
+         "SUM(atrasadas) AS atrasadas, SUM(dias_prestado) AS dias_prestado")
+
+
+def reconstruir_en(c):
+    """Recalcula las tablas estadisticas_* desde prestamos, dentro de la transacción de c."""
+    c.execute("DELETE FROM estadisticas_libros")
+    c.execute("DELETE FROM estadisticas_libros_dia")
+    c.execute("DELETE FROM estadisticas_generos_dia")
+    c.execute("DELETE FROM estadisticas_universidades_dia")
+    c.execute(f"""INSERT INTO estadisticas_libros_dia (dia, libro_id, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT dia, libro_id, {SUMAS} FROM ({SQL_MOVIMIENTOS}) GROUP BY dia, libro_id""")
+    c.execute(f"""INSERT INTO estadisticas_libros (libro_id, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT libro_id, {SUMAS} FROM estadisticas_libros_dia GROUP BY libro_id""")
+    c.execute(f"""INSERT INTO estadisticas_generos_dia (dia, genero, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT e.dia, l.genero, {SUMAS}
+                  FROM estadisticas_libros_dia e JOIN libros l ON l.id = e.libro_id
+                  GROUP BY e.dia, l.genero""")
+    c.execute(f"""INSERT INTO estadisticas_universidades_dia (dia, universidad, prestamos, devoluciones, atrasadas, dias_prestado)
+                  SELECT m.dia, u.universidad, {SUMAS}
+                  FROM ({SQL_MOVIMIENTOS}) m JOIN universitarios u ON u.usuario_id = m.universitario_id
+                  GROUP BY m.dia, u.universidad""")
+
+
+def reconstruir():
+    """Recalcula todas las estadísticas (respaldo, o después de corregir géneros o universidades)."""
+    with transaccion('IMMEDIATE') as c:
+        reconstruir_en(c)
+        return c.execute("SELECT COALESCE(SUM(prestamos), 0) FROM estadisticas_libros").fetchone()[0]
+
+
+def _fila(nombre, prestamos, devoluciones, atrasadas, dias_prestado):
+    return {
+        'nombre': nombre,
+        'prestamos': prestamos,
+        'devoluciones': devoluciones,
+        'promedio_dias': round(dias_prestado / devoluciones, 1) if devoluciones else None,
+        'tasa_atraso': round(atrasadas / devoluciones, 3) if devoluciones else None,
+    }
+
+
+def _rango(desde, hasta):
+    condiciones, parametros = [], []
+    if desde:
+        condiciones.append("dia >= ?")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("dia <= ?")
+        parametros.append(hasta)
+    return (" WHERE " + " AND ".join(condiciones) if condiciones else ""), parametros
+
+
+def libros_mas_prestados(limite=TOP_LIBROS, desde=None, hasta=None):
+    """Libros con más préstamos (en el rango de días 'YYYY-MM-DD', inclusivo, o de toda la historia)."""
+    conn = get_conexion()
+    if not desde and not hasta:
+        # Toda la historia: los primeros del indice idx_estadisticas_libros_prestamos
+        filas = conn.execute(f"""
+            SELECT l.titulo, e.prestamos, e.devoluciones, e.atrasadas, e.dias_prestado
+            FROM estadisticas_libros e JOIN libros l ON l.id = e.libro_id
+            WHERE e.prestamos > 0
+            ORDER BY e.prestamos DESC LIMIT ?""", (limite,)).fetchall()
+    else:
+        where, parametros = _rango(desde, hasta)
+        filas = conn.execute(f"""
+            SELECT l.titulo, t.prestamos, t.devoluciones, t.atrasadas, t.dias_prestado
+            FROM (SELECT libro_id, {SUMAS} FROM estadisticas_libros_dia{where}
+                  GROUP BY libro_id HAVING SUM(prestamos) > 0 ORDER BY prestamos DESC LIMIT ?) t
+            JOIN libros l ON l.id = t.libro_id
+            ORDER BY t.prestamos DESC""", parametros + [limite]).fetchall()
+    return [_fila(*fila) for fila in filas]
+
+
+def _por_grupo(tabla, columna, desde, hasta):
+    where, parametros = _rango(desde, hasta)
+    filas = get_conexion().execute(f"""
+        SELECT {columna}, {SUMAS} FROM {tabla}{where}
+        GROUP BY {columna} ORDER BY prestamos DESC, {columna}""", parametros).fetchall()
+    return [_fila(*fila) for fila in filas]
+
+
+def demanda_por_genero(desde=None, hasta=None):
+    return _por_grupo('estadisticas_generos_dia', 'genero', desde, hasta)
+
+
+def uso_por_universidad(desde=None, hasta=None):
+    return _por_grupo('estadisticas_universidades_dia', 'universidad', desde, hasta)
+
+
+def resumen(desde=None, hasta=None):
+    """Totales del rango: préstamos, devoluciones, duración promedio y tasa de atraso."""
+    where, parametros = _rango(desde, hasta)
+    fila = get_conexion().execute(f"SELECT {SUMAS} FROM estadisticas_generos_dia{where}", parametros).fetchone()
+    return _fila('Total', *(valor or 0 for valor in fila))
+
+
+def mostrar(filas, titulo):
+    print(f"=== {titulo} ===")
+    if not filas:
+        print("Sin préstamos en el período.")
+    for fila in filas:
+        promedio = f"{fila['promedio_dias']} días" if fila['promedio_dias'] is not None else "-"
+        atraso = f"{fila['tasa_atraso']:.0%}" if fila['tasa_atraso'] is not None else "-"
+        print(f"{fila['nombre']} | Préstamos: {fila['prestamos']} | Devoluciones: {fila['devoluciones']} | "
+              f"Duración promedio: {promedio} | Atrasadas: {atraso}")
+
+
+if __name__ == "__main__":
+    # Uso: python estadisticas.py --reconstruir
+    import BD # Asegura el esquema (la migracion 14 crea las tablas y los triggers)
+    if '--reconstruir' in sys.argv[1:]:
+        print(f"Estadísticas reconstruidas: {reconstruir()} préstamos.")
+    else:
+        mostrar([resumen()], "Resumen")
+        mostrar(libros_mas_prestados(), "Libros más prestados")
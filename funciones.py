@@ -1,44 +1,35 @@
 import sqlite3
 import re
+import csv
 import bcrypt
-import requests # Importar requests para consumir la API
-from requests.exceptions import RequestException
 from datetime import datetime, timedelta, date 
-from clases import Usuario, Bibliotecario, Universitario, Libro, Prestamo, Admin 
+from clases import Usuario, Bibliotecario, Universitario, Libro, Prestamo, Admin, usuario_desde_bd
+from conexion import get_conexion, transaccion
+from busqueda import buscar_libros, expresion_fts
+from listados import navegar, navegar_paginas
+import auditoria
+import archivo_auditoria
+import estadisticas
+import multas
+from indicadores import get_valor_uf
+from importacion import importar_libros
+from registro import iniciar_hash, registrar_usuario
+from prestamos import realizar_prestamos, liberar
 
 # Patron de busqueda para encontrar prestamos por ID de usuario
 patron_id = r'^\d+$'
 
-# FUNCIONES DE SOPORTE DE API EXTERNA
-
-def get_valor_uf():
-    """Obtiene el valor actual de la UF de la API de Mindicador."""
-    url = "https://mindicador.cl/api/uf"
-    try:
-        response = requests.get(url, timeout=3)
-        response.raise_for_status()
-        data = response.json()
-        # El valor de la UF se encuentra en la primera posición del array 'serie'
-        if data and 'serie' in data and data['serie']:
-            return data['serie'][0]['valor']
-        return 0.0
-    except RequestException as e:
-        print(f"Alerta: Error al conectar con la API de indicadores. Multa calculada en 0. {e}")
-        return 0.0
-    except Exception:
-        return 0.0
-
-
 # FUNCIÓN DE AUDITORÍA
-def log_auditoria(usuario_id, accion, tabla_afectada, detalle):
+def log_auditoria(usuario_id, accion, tabla_afectada, detalle, cursor=None):
+    """
+    Registra un evento de auditoría. Pasando el cursor de la transacción en curso,
+    el registro se guarda junto con el cambio; si no, queda en el buffer de auditoria.
+    """
     try:
-        with sqlite3.connect('biblioteca.db') as conn:
-            c = conn.cursor()
-            fch_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S') 
-            c.execute("INSERT INTO auditoria (usuario_id, accion, tabla_afectada, detalle, fecha) VALUES (?, ?, ?, ?, ?)",
-                      (usuario_id, accion, tabla_afectada, detalle, fch_actual))
-            conn.commit()
+        auditoria.registrar(usuario_id, accion, tabla_afectada, detalle, cursor)
     except sqlite3.Error as e:
+        if cursor is not None:
+            raise
         print(f"Error al registrar auditoría: {e}")
 
 
@@ -58,35 +49,23 @@ def reglogin():
                     nombre = input("Ingrese su nombre: ")
                     email = input("Ingrese su email: ")
                     password = input("Ingrese su contraseña: ")
-                    usuario_nuevo = Usuario(nombre, email, password)
+                    # El hash se calcula en segundo plano mientras se completan los demás datos
+                    hash_futuro = iniciar_hash(password)
                 except ValueError as ve:
                     print(f"Error en el registro: {ve}")
                     continue
-                print("Usuario registrado exitosamente.")
-                log_auditoria(usuario_nuevo.id, 'REGISTRO', 'usuarios', f'Registro inicial de {usuario_nuevo.nombre}')
                 
                 print("Es usted un universitario o un bibliotecario?")
                 print("1. Universitario")
                 print("2. Bibliotecario")
                 print("3. Volver")
                 tipo_usuario = int(input("Seleccione una opción: "))
-                if tipo_usuario == 1:
+                if tipo_usuario in (1, 2):
+                    tipo = "universitario" if tipo_usuario == 1 else "bibliotecario"
                     try:
                         universidad = input("Ingrese su universidad: ")
-                        usuario_universitario = Universitario(nombre, email, password, universidad)
-                        usuario_universitario.save()
-                        print("Usuario actualizado a universitario exitosamente.")
-                        log_auditoria(usuario_universitario.id, 'ACTUALIZACION', 'universitarios', 'Perfil actualizado a universitario')
-                    except ValueError as ve:
-                        print(f"Error en el registro: {ve}")
-                        continue
-                elif tipo_usuario == 2:
-                    try:
-                        universidad = input("Ingrese su universidad: ")
-                        usuario_bibliotecario = Bibliotecario(nombre, email, password, universidad)
-                        usuario_bibliotecario.save()
-                        print("Usuario actualizado a bibliotecario exitosamente.")
-                        log_auditoria(usuario_bibliotecario.id, 'ACTUALIZACION', 'bibliotecarios', 'Perfil actualizado a bibliotecario')
+                        registrar_usuario(nombre, email, password, tipo, universidad, hash_futuro)
+                        print(f"Usuario registrado exitosamente como {tipo}.")
                     except ValueError as ve:
                         print(f"Error en el registro: {ve}")
                         continue
@@ -97,45 +76,32 @@ def reglogin():
             elif opcion == 2:
                 email = input("Ingrese su email: ").strip()
                 password = input("Ingrese su contraseña: ").strip()
-                conn = sqlite3.connect('biblioteca.db')
-                c = conn.cursor()
-                c.execute("SELECT id, nombre, email, password_hash, tipo FROM usuarios WHERE email = ?", (email,))
+                c = get_conexion().cursor()
+                # La universidad viene en la misma consulta (solo existe en una de las dos tablas)
+                c.execute("""
+                    SELECT u.id, u.nombre, u.email, u.password_hash, u.tipo, COALESCE(un.universidad, b.universidad)
+                    FROM usuarios u
+                    LEFT JOIN universitarios un ON un.usuario_id = u.id
+                    LEFT JOIN bibliotecarios b ON b.usuario_id = u.id
+                    WHERE u.email = ?
+                """, (email,))
                 fila = c.fetchone()
                 if not fila:
                     print("Usuario no encontrado.")
                     continue
-                id_usuario, nombre, email, password_hash, tipo = fila
+                id_usuario, nombre, email, password_hash, tipo, universidad = fila
                 if not bcrypt.checkpw(password.encode('latin-1'), password_hash):
                     print("Contraseña incorrecta.")
                     log_auditoria(id_usuario, 'LOGIN_FALLIDO', 'usuarios', f'Intento de login fallido para {email}')
                     continue
                 print(f"Bienvenido {nombre}, has iniciado sesión como {tipo}.")
                 log_auditoria(id_usuario, 'LOGIN_EXITOSO', 'usuarios', f'Inicio de sesión exitoso como {tipo}')
-                universidad = None
-                conn = sqlite3.connect('biblioteca.db')
-                c = conn.cursor()
-                if tipo == "universitario":
-                    c.execute("SELECT universidad FROM universitarios WHERE usuario_id = ?", (id_usuario,))
-                    fila = c.fetchone()
-                    if fila:
-                        universidad = fila[0]
-                    usuario_logeado = Universitario(nombre, email, "dummy_pass", universidad) 
-                elif tipo == "bibliotecario":
-                    c.execute("SELECT universidad FROM bibliotecarios WHERE usuario_id = ?", (id_usuario,))
-                    fila = c.fetchone()
-                    if fila:
-                        universidad = fila[0]
-                    usuario_logeado = Bibliotecario(nombre, email, "dummy_pass", universidad) 
-                elif tipo == "admin":
-                    usuario_logeado = Admin(nombre,email, "dummy_pass") 
-                else:
-                    usuario_logeado = Usuario(nombre, email, "dummy_pass") 
-                conn.close()
-                usuario_logeado.id = id_usuario
-                usuario_logeado._password_hash = password_hash 
+                # Usuario ya guardado: se construye desde la fila sin volver a hashear la contraseña
+                usuario_logeado = usuario_desde_bd(id_usuario, nombre, email, password_hash, tipo, universidad)
                 return tipo, usuario_logeado
             elif opcion == 3:
                 print("Saliendo del sistema.")
+                auditoria.flush()
                 exit()
             else:
                 print("Opción inválida.")
@@ -144,21 +110,182 @@ def reglogin():
 
 
 def ver_libros_disponibles():
-    conn = sqlite3.connect('biblioteca.db')
-    c = conn.cursor()
-    c.execute("SELECT id, titulo, autor, cantidad FROM libros WHERE cantidad > 0")
-    libros = c.fetchall()
-    conn.close()
-
-    if libros:
-        print("=== Libros disponibles ===")
-        for libro in libros:
-            id_libro, titulo, autor, cantidad = libro
-            print(f"ID: {id_libro}. {titulo} - {autor} | Copias disponibles: {cantidad}")
-        return libros
-    else:
+    """Muestra los libros con copias disponibles paginados. Devuelve la cantidad mostrada."""
+    def mostrar_libro(libro):
+        id_libro, titulo, autor, disponibles = libro
+        print(f"ID: {id_libro}. {titulo} - {autor} | Copias disponibles: {disponibles}")
+
+    mostrados = navegar(
+        "SELECT id, titulo, autor, disponibles FROM libros", ('id',), (0,), mostrar_libro,
+        condiciones=("disponibles > 0",),
+        encabezado=lambda: print("=== Libros disponibles ==="),
+    )
+    if not mostrados:
         print("No hay libros disponibles.")
-        return []
+    return mostrados
+
+
+def ver_catalogo(filtro=""):
+    """Lista todo el catálogo paginado, opcionalmente filtrado por título, autor o género."""
+    condiciones, parametros = [], []
+    consulta = expresion_fts(filtro)
+    if consulta:
+        condiciones.append("id IN (SELECT rowid FROM libros_fts WHERE libros_fts MATCH ?)")
+        parametros.append(consulta)
+
+    def mostrar_libro(libro):
+        id_libro, titulo, autor, cantidad, disponibles = libro
+        print(f"ID: {id_libro}. {titulo} - {autor} | Copias: {disponibles} de {cantidad} disponibles")
+
+    mostrados = navegar(
+        "SELECT id, titulo, autor, cantidad, disponibles FROM libros", ('id',), (0,), mostrar_libro,
+        condiciones, parametros,
+        encabezado=lambda: print("=== Libros en la biblioteca ==="),
+    )
+    if not mostrados:
+        print("No hay libros registrados." if not consulta else "No hay libros que coincidan con el filtro.")
+    return mostrados
+
+
+def ver_usuarios(tipo=""):
+    """Lista los usuarios paginados, opcionalmente solo los de un tipo."""
+    condiciones, parametros = [], []
+    if tipo:
+        condiciones.append("tipo = ?")
+        parametros.append(tipo)
+
+    def mostrar_usuario(usuario):
+        id_usuario, nombre, email, tipo_usuario = usuario
+        print(f"ID: {id_usuario}. {nombre} - {email} | Tipo: {tipo_usuario}")
+
+    mostrados = navegar(
+        "SELECT id, nombre, email, tipo FROM usuarios", ('id',), (0,), mostrar_usuario,
+        condiciones, parametros,
+        encabezado=lambda: print("=== Usuarios registrados ==="),
+    )
+    if not mostrados:
+        print("No hay usuarios registrados.")
+    return mostrados
+
+
+def mostrar_busqueda_libros(texto_buscar):
+    """Muestra los resultados de la búsqueda del catálogo página por página."""
+    pagina = 1
+    while True:
+        libros_encontrados, hay_mas = buscar_libros(texto_buscar, pagina)
+        if not libros_encontrados:
+            if pagina == 1:
+                print("No se encontraron libros para esa búsqueda.")
+            return
+        print(f"=== Resultados de la búsqueda (página {pagina}) ===")
+        for id_libro, titulo, autor, disponibles in libros_encontrados:
+            print(f"ID: {id_libro}. {titulo} - {autor} | Copias disponibles: {disponibles}")
+        if not hay_mas:
+            return
+        if input("Ver más resultados? (s/n): ").strip().lower() != 's':
+            return
+        pagina += 1
+
+
+# FUNCIONES DE AUDITORÍA
+
+def _fecha_filtro(mensaje):
+    while True:
+        texto = input(mensaje).strip()
+        if not texto:
+            return None
+        try:
+            return datetime.strptime(texto, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            print("Fecha inválida. Use el formato AAAA-MM-DD.")
+
+
+def pedir_filtros_auditoria():
+    """Pide los filtros de la consulta de auditoría. Devuelve un dict o None si el usuario no existe."""
+    filtros = {}
+    usuario = input("Usuario (ID o email, enter para todos): ").strip()
+    if usuario:
+        if re.match(patron_id, usuario):
+            filtros['usuario_id'] = int(usuario)
+        else:
+            fila = get_conexion().execute("SELECT id FROM usuarios WHERE email = ?", (usuario,)).fetchone()
+            if not fila:
+                print("Usuario no encontrado.")
+                return None
+            filtros['usuario_id'] = fila[0]
+    filtros['accion'] = input("Acción (ej: LOGIN_EXITOSO, PRESTAMO, enter para todas): ").strip().upper() or None
+    filtros['tabla'] = input("Tabla (libros/prestamos/usuarios, enter para todas): ").strip().lower() or None
+    filtros['desde'] = _fecha_filtro("Desde (AAAA-MM-DD, enter sin límite): ")
+    hasta = _fecha_filtro("Hasta, inclusive (AAAA-MM-DD, enter sin límite): ")
+    # La consulta excluye hasta: se pasa el dia siguiente
+    filtros['hasta'] = (datetime.strptime(hasta, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d') if hasta else None
+    return filtros
+
+
+def ver_auditoria(filtros):
+    """Muestra el registro de auditoría filtrado, página por página (incluye los meses archivados)."""
+    # Los eventos que siguen en el buffer tambien deben aparecer
+    auditoria.flush()
+
+    def mostrar_evento(evento):
+        id_evento, usuario_id, accion, tabla, detalle, fecha = evento
+        # Sin usuario_id: usuario de Django sin fila en usuarios (su nombre va en el detalle)
+        usuario = usuario_id if usuario_id is not None else "-"
+        print(f"{fecha} | #{id_evento} | Usuario {usuario} | {accion} ({tabla}) | {detalle}")
+
+    def pagina(despues_de):
+        return archivo_auditoria.pagina(despues_de=despues_de, **filtros)
+
+    mostrados = navegar_paginas(pagina, mostrar_evento, encabezado=lambda: print("=== Registro de auditoría ==="))
+    if not mostrados:
+        print("No hay eventos de auditoría con esos filtros.")
+    return mostrados
+
+
+def exportar_auditoria(filtros, ruta):
+    """Escribe en un CSV todos los eventos filtrados, a medida que se leen. Devuelve la cantidad."""
+    auditoria.flush()
+    cantidad = 0
+    with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(['id', 'usuario_id', 'accion', 'tabla_afectada', 'detalle', 'fecha'])
+        for evento in archivo_auditoria.consultar(**filtros):
+            escritor.writerow(evento)
+            cantidad += 1
+    return cantidad
+
+
+# REPORTES DE CIRCULACIÓN
+
+def menu_reportes():
+    """Reportes de circulación (leen las tablas de estadísticas, ver estadisticas.py)."""
+    while True:
+        print("\n--- Reportes de Circulación ---")
+        print("1. Resumen (préstamos, duración promedio, atrasos)")
+        print("2. Libros más prestados")
+        print("3. Demanda por género")
+        print("4. Uso por universidad")
+        print("5. Volver al menú principal")
+        try:
+            sub_opcion = int(input("Seleccione una opción: "))
+        except ValueError:
+            print("Por favor, ingrese un número válido.")
+            continue
+        if sub_opcion == 5:
+            break
+        if sub_opcion not in (1, 2, 3, 4):
+            print("Opción inválida.")
+            continue
+        desde = _fecha_filtro("Desde (AAAA-MM-DD, enter sin límite): ")
+        hasta = _fecha_filtro("Hasta, inclusive (AAAA-MM-DD, enter sin límite): ")
+        if sub_opcion == 1:
+            estadisticas.mostrar([estadisticas.resumen(desde, hasta)], "Resumen")
+        elif sub_opcion == 2:
+            estadisticas.mostrar(estadisticas.libros_mas_prestados(desde=desde, hasta=hasta), "Libros más prestados")
+        elif sub_opcion == 3:
+            estadisticas.mostrar(estadisticas.demanda_por_genero(desde, hasta), "Demanda por género")
+        else:
+            estadisticas.mostrar(estadisticas.uso_por_universidad(desde, hasta), "Uso por universidad")
 
 
 # FUNCIONES DE GESTIÓN DE PRÉSTAMOS
@@ -167,19 +294,16 @@ def mostrar_mis_prestamos(universitario_id):
     """
     Muestra todos los préstamos activos de un universitario específico (ACTUALIZADA con is_activo).
     """
-    conn = sqlite3.connect('biblioteca.db')
-    c = conn.cursor()
+    c = get_conexion().cursor()
     
     c.execute("""
-        SELECT 
-            p.id, l.titulo, p.fch_prestamo, p.fch_devolucion 
-        FROM prestamos p
-        JOIN libros l ON p.libro_id = l.id
-        WHERE p.universitario_id = ? AND p.is_activo = 1
+        SELECT id, titulo, fch_prestamo, fch_devolucion, dias_restantes, estado
+        FROM vista_prestamos
+        WHERE universitario_id = ? AND is_activo = 1
+        ORDER BY fch_devolucion
     """, (universitario_id,))
     
     prestamos = c.fetchall()
-    conn.close()
     
     if not prestamos:
         print("No tienes préstamos activos actualmente.")
@@ -187,65 +311,92 @@ def mostrar_mis_prestamos(universitario_id):
         
     print(f"\n--- Mis Préstamos Activos ---")
     
-    for id_prestamo, titulo_libro, fch_prestamo, fch_devolucion in prestamos:
-        fch_dev_dt = datetime.strptime(fch_devolucion, '%Y-%m-%d').date()
-        dias_restantes = (fch_dev_dt - datetime.now().date()).days
-        estado = "Atrasado" if dias_restantes < 0 else f"{dias_restantes} días restantes"
+    for id_prestamo, titulo_libro, fch_prestamo, fch_devolucion, dias_restantes, estado in prestamos:
+        estado = "Atrasado" if estado == 'ATRASADO' else f"{dias_restantes} días restantes"
         
         print(f"ID Préstamo: {id_prestamo} | Libro: {titulo_libro} | Prestado: {fch_prestamo} | Devolución límite: {fch_devolucion} | Estado: {estado}")
         
     print("----------------------------------------------------------")
 
 
-def mostrar_todos_prestamos_activos():
+def mostrar_mis_multas(universitario_id):
+    """Muestra las multas de un universitario desde el registro de multas."""
+    filas = multas.multas_de(universitario_id)
+    if not filas:
+        print("No tienes multas registradas.")
+        return
+
+    print(f"\n--- Mis Multas ---")
+    total_uf = total_clp = 0
+    for id_prestamo, titulo_libro, dias_atraso, monto_uf, monto_clp, calculada, estado in filas:
+        estado = "Final" if estado == multas.FINAL else f"En curso (al {calculada})"
+        clp = f"{monto_clp:,.0f} CLP" if monto_clp is not None else "cobrar en UF"
+        print(f"ID Préstamo: {id_prestamo} | Libro: {titulo_libro} | Atraso: {dias_atraso} días | Multa: {monto_uf:.2f} UF ({clp}) | {estado}")
+        total_uf += monto_uf
+        total_clp += monto_clp or 0
+    print(f"Total: {total_uf:.2f} UF ({total_clp:,.0f} CLP)")
+    print("----------------------------------------------------------")
+
+
+def mostrar_multas():
+    """Muestra el total de multas y el detalle por universitario desde el registro de multas."""
+    totales = multas.totales()
+    if not totales:
+        print("No hay multas registradas.")
+        return
+
+    print("\n--- Multas ---")
+    for estado, titulo in ((multas.ACUMULANDO, "En curso (préstamos atrasados)"), (multas.FINAL, "Finales (ya devueltos)")):
+        cantidad, monto_uf, monto_clp = totales.get(estado, (0, 0, 0))
+        print(f"{titulo}: {cantidad} | {monto_uf or 0:.2f} UF ({monto_clp or 0:,.0f} CLP)")
+    print(f"Último cálculo nocturno: {multas.ultimo_calculo() or 'nunca'}")
+    print("{:<10} {:<30} {:<10} {:<12} {:<15}".format("ID", "Universitario", "Multas", "UF", "CLP"))
+    print("-" * 80)
+    for universitario_id, nombre, cantidad, monto_uf, monto_clp in multas.por_universitario():
+        print("{:<10} {:<30} {:<10} {:<12} {:<15}".format(
+            universitario_id, nombre, cantidad, f"{monto_uf:.2f}", f"{monto_clp or 0:,.0f}"))
+
+
+def mostrar_todos_prestamos_activos(solo_atrasados=False):
     """
-    Muestra TODOS los préstamos activos en la base de datos (para uso administrativo).
+    Muestra TODOS los préstamos activos en la base de datos (para uso administrativo), paginados
+    por fecha de devolución. Devuelve la cantidad de préstamos mostrados.
     """
-    conn = sqlite3.connect('biblioteca.db')
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT 
-            p.id, u.nombre, l.titulo, p.fch_prestamo, p.fch_devolucion 
-        FROM prestamos p
-        JOIN usuarios u ON p.universitario_id = u.id
-        JOIN libros l ON p.libro_id = l.id
-        WHERE p.is_activo = 1
-        ORDER BY p.fch_devolucion ASC
-    """)
-    
-    prestamos = c.fetchall()
-    conn.close()
-    
-    if not prestamos:
-        print("\nNo hay préstamos activos registrados.")
-        return
-        
-    print("\n--- Todos los Préstamos Activos ---")
-    print("{:<15} {:<25} {:<30} {:<15} {:<15} {:<10}".format(
-        "ID Préstamo", "Universitario", "Libro", "Fch Préstamo", "Fch Devolución", "Estado"
-    ))
-    print("-" * 110)
-    
-    ids_activos = []
-    for id_prestamo, nombre_uni, titulo_libro, fch_prestamo, fch_devolucion in prestamos:
-        fch_dev_dt = datetime.strptime(fch_devolucion, '%Y-%m-%d').date()
-        dias_restantes = (fch_dev_dt - datetime.now().date()).days
+    condiciones = ["is_activo = 1"]
+    if solo_atrasados:
+        condiciones.append("fch_devolucion < date('now', 'localtime')")
+
+    def encabezado():
+        print("\n--- Todos los Préstamos Activos ---")
+        print("{:<15} {:<25} {:<30} {:<15} {:<15} {:<10}".format(
+            "ID Préstamo", "Universitario", "Libro", "Fch Préstamo", "Fch Devolución", "Estado"
+        ))
+        print("-" * 110)
+
+    def mostrar_prestamo(prestamo):
+        id_prestamo, nombre_uni, titulo_libro, fch_prestamo, fch_devolucion, dias_restantes, dias_atraso, estado = prestamo
         
-        if dias_restantes < 0:
-            estado = f"ATRASADO ({abs(dias_restantes)} días)"
-        elif dias_restantes == 0:
-            estado = "HOY"
-        else:
+        if estado == 'ATRASADO':
+            estado = f"ATRASADO ({dias_atraso} días)"
+        elif estado == 'ACTIVO':
             estado = f"{dias_restantes} días"
             
         print("{:<15} {:<25} {:<30} {:<15} {:<15} {:<10}".format(
             id_prestamo, nombre_uni, titulo_libro, fch_prestamo, fch_devolucion, estado
         ))
-        ids_activos.append(id_prestamo)
-        
-    print("-----------------------------------")
-    return ids_activos
+
+    # El orden por fecha de devolución deja primero a los más atrasados
+    mostrados = navegar("""
+        SELECT 
+            id, nombre_universitario, titulo, fch_prestamo, fch_devolucion, dias_restantes, dias_atraso, estado
+        FROM vista_prestamos
+    """, ('fch_devolucion', 'id'), (4, 0), mostrar_prestamo, condiciones, encabezado=encabezado)
+
+    if not mostrados:
+        print("\nNo hay préstamos activos registrados.")
+    else:
+        print("-----------------------------------")
+    return mostrados
 
 
 def realizar_devolucion_admin(prestamo_id, bibliotecario_id):
@@ -256,81 +407,69 @@ def realizar_devolucion_admin(prestamo_id, bibliotecario_id):
         print("Error: El ID de préstamo debe ser un número entero.")
         return False
         
-    conn = sqlite3.connect('biblioteca.db')
-    c = conn.cursor()
-    
     try:
         # 1. Verificar si el préstamo existe y está activo
+        c = get_conexion().cursor()
         c.execute("""
-            SELECT p.libro_id, l.titulo, u.nombre, p.fch_devolucion 
-            FROM prestamos p
-            JOIN libros l ON p.libro_id = l.id
-            JOIN usuarios u ON p.universitario_id = u.id
-            WHERE p.id = ? AND p.is_activo = 1
+            SELECT libro_id, titulo, nombre_universitario, dias_atraso 
+            FROM vista_prestamos
+            WHERE id = ? AND is_activo = 1
         """, (prestamo_id,))
         
         fila = c.fetchone()
         
         if not fila:
             print(f"Error: Préstamo ID {prestamo_id} no encontrado o ya ha sido devuelto.")
-            conn.close()
             return False
 
-        libro_id, titulo_libro, nombre_uni, fch_vencimiento_str = fila
-        
-        # 2. Marcar el préstamo como devuelto (is_activo = 0) y registrar la fecha real de devolución
-        fch_devolucion_real = datetime.now().strftime('%Y-%m-%d')
-        
-        c.execute("""
-            UPDATE prestamos 
-            SET is_activo = 0, fch_devolucion_real = ? 
-            WHERE id = ?
-        """, (fch_devolucion_real, prestamo_id))
-        
-        # 3. Aumentar la cantidad del libro en el inventario
-        c.execute("UPDATE libros SET cantidad = cantidad + 1 WHERE id = ?", (libro_id,))
-        
-        # 4. Verificar retraso (Integración con API para multa)
-        fch_vencimiento = datetime.strptime(fch_vencimiento_str, "%Y-%m-%d").date()
-        dias_retraso = (datetime.now().date() - fch_vencimiento).days
+        libro_id, titulo_libro, nombre_uni, dias_retraso = fila
+        fch_devolucion_real = date.today()
         
-        mensaje_retraso = ""
-        if dias_retraso > 0:
-            #Lógica de cálculo de multa con la API
-            VALOR_UF_HOY = get_valor_uf()
-            MULTA_POR_DIA_UF = 0.01 # Multa hipotética: 0.01 UF por día
+        # 2. Verificar retraso (Integración con API para multa)
+        # El valor de la UF se obtiene antes de abrir la transacción: puede requerir una consulta a la API
+        VALOR_UF = get_valor_uf(fch_devolucion_real) if dias_retraso > 0 else None
+
+        with transaccion() as c:
+            # 3. Marcar el préstamo como devuelto (is_activo = 0) y registrar la fecha real de devolución
+            c.execute("""
+                UPDATE prestamos 
+                SET is_activo = 0, fch_devolucion_real = ? 
+                WHERE id = ? AND is_activo = 1
+            """, (fch_devolucion_real.strftime('%Y-%m-%d'), prestamo_id))
+            if c.rowcount == 0:
+                # Otra terminal registró la devolución entre la consulta y la transacción
+                print(f"Error: Préstamo ID {prestamo_id} no encontrado o ya ha sido devuelto.")
+                return False
             
-            multa_total_uf = dias_retraso * MULTA_POR_DIA_UF
-            multa_total_clp = multa_total_uf * VALOR_UF_HOY
-            
-            mensaje_multa_clp = f"{multa_total_clp:,.0f}" if VALOR_UF_HOY > 0 else "N/A"
-            # -------------------------------------------------------------------
-            
-            mensaje_retraso = f" **¡ATENCIÓN!** Devolución con **{dias_retraso} días de retraso**.\n"
-            mensaje_retraso += f"    -> Multa calculada (0.01 UF/día): {multa_total_uf:.2f} UF ({mensaje_multa_clp} CLP)"
-        
-        conn.commit()
+            # 4. Reponer la copia en el inventario
+            liberar(c, libro_id)
+
+            # 5. La multa queda registrada (FINAL) con la devolución
+            multa = multas.finalizar(c, prestamo_id, fch_devolucion_real, VALOR_UF)
         
-        # 5. Auditoría
-        log_auditoria(bibliotecario_id, 'DEVOLUCION', 'prestamos', f'Devolución registrada de Préstamo ID {prestamo_id} (Libro: {titulo_libro})')
+            # 6. Auditoría (en la misma transacción que la devolución)
+            log_auditoria(bibliotecario_id, 'DEVOLUCION', 'prestamos', f'Devolución registrada de Préstamo ID {prestamo_id} (Libro: {titulo_libro})', c)
         
         print(f"\n--- Devolución Exitosa (ID Préstamo: {prestamo_id}) ---")
         print(f"Libro: '{titulo_libro}' por {nombre_uni}.")
         print(f"Fecha de devolución real: {fch_devolucion_real}")
-        print(mensaje_retraso)
+        if multa:
+            if multa['monto_clp'] is not None:
+                mensaje_multa_clp = f"{multa['monto_clp']:,.0f} CLP"
+            else:
+                mensaje_multa_clp = "valor UF no disponible, cobrar en UF"
+            print(f" **¡ATENCIÓN!** Devolución con **{multa['dias_atraso']} días de retraso**.")
+            print(f"    -> Multa registrada ({multas.MULTA_POR_DIA_UF} UF/día): {multa['monto_uf']:.2f} UF ({mensaje_multa_clp})")
         print("El inventario del libro ha sido actualizado.")
         print("------------------------------------------------")
         return True
 
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"Error de base de datos al realizar la devolución: {e}")
         return False
     except Exception as e:
         print(f"Error desconocido: {e}")
         return False
-    finally:
-        conn.close()
 
 
 # FUNCIÓN MENU UNIVERSITARIO
@@ -345,25 +484,14 @@ def menu_universitario(usuario_logeado):
             opcion = int(input("Seleccione una opción: "))
             if opcion == 1:
                 print("1. Ver libros disponibles")
-                print("2. Buscar libro por título")
+                print("2. Buscar libro por título, autor o género")
                 try:
                     input_opcion = int(input("Seleccione una opción: "))
                     if input_opcion == 1:
                         ver_libros_disponibles()
                     elif input_opcion == 2:
-                        titulo_buscar = input("Ingrese el título del libro a buscar: ").strip()
-                        conn = sqlite3.connect('biblioteca.db')
-                        c = conn.cursor()
-                        c.execute("SELECT id, titulo, autor, cantidad FROM libros WHERE titulo LIKE ?", ('%' + titulo_buscar + '%',))
-                        libros_encontrados = c.fetchall()
-                        conn.close()
-                        if libros_encontrados:
-                            print("=== Resultados de la búsqueda ===")
-                            for libro in libros_encontrados:
-                                id_libro, titulo, autor, cantidad = libro
-                                print(f"ID: {id_libro}. {titulo} - {autor} | Copias disponibles: {cantidad}")
-                        else:
-                            print("No se encontraron libros con ese título.")
+                        texto_buscar = input("Ingrese el título, autor o género a buscar: ").strip()
+                        mostrar_busqueda_libros(texto_buscar)
                 except ValueError:
                     print("Por favor, ingrese un número válido.")
 
@@ -372,39 +500,38 @@ def menu_universitario(usuario_logeado):
                     print("\n--- Gestión de Préstamos (Universitario) ---")
                     print("1. Ver mis préstamos activos")
                     print("2. Realizar un préstamo")
-                    print("3. Volver al menú principal")
+                    print("3. Ver mis multas")
+                    print("4. Volver al menú principal")
                     
                     try:
                         opcion_prestamo = int(input("Seleccione una opción: "))
                         if opcion_prestamo == 1:
                             mostrar_mis_prestamos(usuario_logeado.id) 
                         elif opcion_prestamo == 2:
-                            libros = ver_libros_disponibles()
-                            if not libros:
+                            if not ver_libros_disponibles():
                                 continue
                             
-                            isbn_libro = input("Ingrese el ISBN del libro que desea prestar: ").strip() 
+                            isbns = [isbn.strip() for isbn in input("Ingrese el ISBN del libro que desea prestar (varios separados por coma): ").split(",") if isbn.strip()]
                             dias_str = input("Ingrese la cantidad de días del préstamo (Max 14): ").strip()
 
                             try:
-                                conn = sqlite3.connect('biblioteca.db')
-                                c = conn.cursor()
-                                c.execute("SELECT id, titulo, autor, genero, año, cantidad, isbn FROM libros WHERE isbn = ?", (isbn_libro,))
-                                fila = c.fetchone()
-                                conn.close()
-                                if not fila:
+                                if not isbns:
                                     print("ISBN de libro inválido o libro no encontrado.")
                                     continue
+                                c = get_conexion().cursor()
+                                marcadores = ", ".join("?" * len(isbns))
+                                c.execute(f"SELECT isbn, id, titulo FROM libros WHERE isbn IN ({marcadores})", isbns)
+                                libros_por_isbn = {isbn: (libro_id, titulo) for isbn, libro_id, titulo in c.fetchall()}
+                                faltantes = [isbn for isbn in isbns if isbn not in libros_por_isbn]
+                                if faltantes:
+                                    print(f"ISBN de libro inválido o libro no encontrado: {', '.join(faltantes)}")
+                                    continue
                                 
-                                libro_id, titulo, autor, genero, año, cantidad_real, isbn = fila
-                                
-                                libro_seleccionado = Libro(titulo, autor, genero, año, cantidad_real, isbn)
-                                libro_seleccionado.id = libro_id
-                                
-                                prestamo = Prestamo(usuario_logeado, libro_seleccionado, dias_str)
-                                prestamo.save()
-                                print(f"Préstamo realizado: {libro_seleccionado.titulo} por {dias_str} días.")
-                                log_auditoria(usuario_logeado.id, 'PRESTAMO', 'prestamos', f'Nuevo préstamo ID {prestamo.id} de Libro {libro_id}')
+                                # Todos los libros se prestan en una sola transacción (o ninguno)
+                                libros_ids = [libros_por_isbn[isbn][0] for isbn in isbns]
+                                realizar_prestamos(usuario_logeado.id, libros_ids, dias_str, usuario_logeado.id)
+                                for isbn in isbns:
+                                    print(f"Préstamo realizado: {libros_por_isbn[isbn][1]} por {dias_str} días.")
                                 
                             except ValueError as ve:
                                 print(f"Error: {ve}")
@@ -412,6 +539,9 @@ def menu_universitario(usuario_logeado):
                                 print(f"Error desconocido: {e}")
                             
                         elif opcion_prestamo == 3:
+                            mostrar_mis_multas(usuario_logeado.id)
+
+                        elif opcion_prestamo == 4:
                             break 
                         else:
                             print("Opción inválida.")
@@ -424,6 +554,7 @@ def menu_universitario(usuario_logeado):
                 usuario_logeado.mostrar_info()
             elif opcion == 4:
                 print("Cerrando sesión.")
+                auditoria.flush()
                 break
             else:
                 print("Opción inválida.")
@@ -437,8 +568,9 @@ def menu_bibliotecario(usuario_logeado):
         print("=== Menú Bibliotecario ===")
         print("1. Gestionar libros")
         print("2. Gestionar préstamos")
-        print("3. Información de la cuenta")
-        print("4. Cerrar sesión")
+        print("3. Reportes de circulación")
+        print("4. Información de la cuenta")
+        print("5. Cerrar sesión")
         try:
             input_opcion = int(input("Seleccione una opción: "))
 
@@ -449,7 +581,8 @@ def menu_bibliotecario(usuario_logeado):
                     print("2. Ver libros")
                     print("3. Modificar libro")
                     print("4. Eliminar libro")
-                    print("5. Volver al menú principal")
+                    print("5. Importar libros desde archivo (CSV/JSONL)")
+                    print("6. Volver al menú principal")
                     sub_opcion = int(input("Seleccione una opción: "))
 
                     if sub_opcion == 1:
@@ -468,27 +601,16 @@ def menu_bibliotecario(usuario_logeado):
                             print(f"Error: {ve}")
 
                     elif sub_opcion == 2:
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
-                        c.execute("SELECT id, titulo, autor, cantidad FROM libros")
-                        libros = c.fetchall()
-                        conn.close()
-                        if libros:
-                            print("=== Libros en la biblioteca ===")
-                            for id_libro, titulo, autor, cantidad in libros:
-                                print(f"ID: {id_libro}. {titulo} - {autor} | Copias: {cantidad}")
-                        else:
-                            print("No hay libros registrados.")
+                        filtro = input("Filtrar por título, autor o género (enter para ver todos): ").strip()
+                        ver_catalogo(filtro)
 
                     elif sub_opcion == 3:
                         id_libro = int(input("Ingrese el ID del libro a modificar: "))
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
+                        c = get_conexion().cursor()
                         c.execute("SELECT titulo, autor, genero, año, cantidad, isbn FROM libros WHERE id = ?", (id_libro,))
                         libro = c.fetchone()
                         if not libro:
                             print("Libro no encontrado.")
-                            conn.close()
                             continue
                         print(f"Libro actual: {libro}")
                         titulo = input(f"Título ({libro[0]}): ").strip() or libro[0]
@@ -500,37 +622,48 @@ def menu_bibliotecario(usuario_logeado):
                         cantidad = int(cantidad) if cantidad else libro[4]
                         isbn = input(f"ISBN ({libro[5]}): ").strip() or libro[5]
                         try:
-                            c.execute("""
-                                UPDATE libros
-                                SET titulo = ?, autor = ?, genero = ?, año = ?, cantidad = ?, isbn = ?
-                                WHERE id = ?
-                            """, (titulo, autor, genero, año, cantidad, isbn, id_libro))
-                            conn.commit()
+                            with transaccion() as c:
+                                c.execute("""
+                                    UPDATE libros
+                                    SET titulo = ?, autor = ?, genero = ?, año = ?, cantidad = ?, isbn = ?
+                                    WHERE id = ?
+                                """, (titulo, autor, genero, año, cantidad, isbn, id_libro))
                             print("Libro modificado exitosamente.")
                             log_auditoria(usuario_logeado.id, 'LIBRO_MOD', 'libros', f'Libro ID {id_libro} modificado')
-                        except sqlite3.IntegrityError:
-                            print("Error: ISBN duplicado.")
-                        conn.close()
+                        except sqlite3.IntegrityError as e:
+                            if 'CHECK' in str(e):
+                                print("Error: La cantidad no puede ser menor que las copias prestadas actualmente.")
+                            else:
+                                print("Error: ISBN duplicado.")
 
                     elif sub_opcion == 4:
                         id_libro = int(input("Ingrese el ID del libro a eliminar: "))
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
+                        c = get_conexion().cursor()
                         c.execute("SELECT titulo FROM libros WHERE id = ?", (id_libro,))
                         libro = c.fetchone()
                         if not libro:
                             print("Libro no encontrado.")
-                            conn.close()
                             continue
                         confirm = input(f"¿Está seguro de eliminar '{libro[0]}'? (s/n): ").lower()
                         if confirm == 's':
-                            c.execute("DELETE FROM libros WHERE id = ?", (id_libro,))
-                            conn.commit()
+                            with transaccion() as c:
+                                c.execute("DELETE FROM libros WHERE id = ?", (id_libro,))
                             print("Libro eliminado exitosamente.")
                             log_auditoria(usuario_logeado.id, 'LIBRO_DEL', 'libros', f'Libro ID {id_libro} eliminado')
-                        conn.close()
 
                     elif sub_opcion == 5:
+                        ruta = input("Ruta del archivo CSV o JSONL: ").strip()
+                        try:
+                            resumen = importar_libros(ruta)
+                        except OSError as e:
+                            print(f"Error al leer el archivo: {e}")
+                            continue
+                        print(f"Leídas: {resumen['leidas']} | Insertadas: {resumen['insertadas']} | Rechazadas: {resumen['rechazadas']}")
+                        if resumen['rechazadas']:
+                            print(f"Reporte de rechazos: {resumen['archivo_rechazos']}")
+                        log_auditoria(usuario_logeado.id, 'LIBRO_IMPORT', 'libros', f"Importación de {ruta}: {resumen['insertadas']} libros agregados, {resumen['rechazadas']} rechazados")
+
+                    elif sub_opcion == 6:
                         break
                     else:
                         print("Opción inválida.")
@@ -542,17 +675,19 @@ def menu_bibliotecario(usuario_logeado):
                     print("2. Registrar una DEVOLUCIÓN (Marcar como Devuelto)")
                     print("3. Modificar un préstamo (Extender fecha)")
                     print("4. Eliminar un préstamo (Cancelación forzosa y actualización de stock)")
-                    print("5. Volver al menú principal")
+                    print("5. Ver multas")
+                    print("6. Recalcular multas ahora (proceso nocturno)")
+                    print("7. Volver al menú principal")
                     
                     try:
                         sub_opcion = int(input("Seleccione una opción: "))
 
                         if sub_opcion == 1:
-                            mostrar_todos_prestamos_activos() 
+                            solo_atrasados = input("¿Mostrar solo los préstamos atrasados? (s/n): ").strip().lower() == 's'
+                            mostrar_todos_prestamos_activos(solo_atrasados) 
 
                         elif sub_opcion == 2: 
-                            ids_activos = mostrar_todos_prestamos_activos()
-                            if not ids_activos:
+                            if not mostrar_todos_prestamos_activos():
                                 continue
                             try:
                                 id_prestamo = int(input("Ingrese el ID del préstamo a registrar como DEVUELTO: "))
@@ -564,35 +699,30 @@ def menu_bibliotecario(usuario_logeado):
                             mostrar_todos_prestamos_activos()
                             try:
                                 id_prestamo = int(input("Ingrese el ID del préstamo a modificar: "))
-                                conn = sqlite3.connect("biblioteca.db")
-                                c = conn.cursor()
+                                c = get_conexion().cursor()
                                 c.execute("SELECT fch_prestamo, fch_devolucion, is_activo FROM prestamos WHERE id = ?", (id_prestamo,))
                                 prestamo = c.fetchone()
                                 if not prestamo:
                                     print("Préstamo no encontrado.")
-                                    conn.close()
                                     continue
                                 
                                 if not prestamo[2]:
                                     print("Error: El préstamo ya fue devuelto y no puede modificarse.")
-                                    conn.close()
                                     continue
                                     
                                 print(f"Fecha de préstamo actual: {prestamo[0]} | Vencimiento actual: {prestamo[1]}")
                                 dias_extra = int(input("Ingrese días adicionales para extender el préstamo: "))
                                 if dias_extra <= 0:
                                     print("Debe ingresar un número positivo.")
-                                    conn.close()
                                     continue
 
                                 nueva_fecha_devolucion = datetime.strptime(prestamo[1], "%Y-%m-%d").date() + timedelta(days=dias_extra)
-                                c.execute("UPDATE prestamos SET fch_devolucion = ? WHERE id = ?", (nueva_fecha_devolucion, id_prestamo))
-                                conn.commit()
+                                with transaccion() as c:
+                                    c.execute("UPDATE prestamos SET fch_devolucion = ? WHERE id = ?", (nueva_fecha_devolucion.strftime('%Y-%m-%d'), id_prestamo))
                                 print(f"Préstamo extendido hasta {nueva_fecha_devolucion}.")
                                 log_auditoria(usuario_logeado.id, 'PRESTAMO_MOD', 'prestamos', f'Préstamo ID {id_prestamo} extendido hasta {nueva_fecha_devolucion}')
                             except ValueError:
                                 print("Entrada inválida. No se realizó el cambio.")
-                            conn.close()
 
                         elif sub_opcion == 4: 
                             mostrar_todos_prestamos_activos()
@@ -602,8 +732,7 @@ def menu_bibliotecario(usuario_logeado):
                                 print("ID inválido.")
                                 continue
 
-                            conn = sqlite3.connect("biblioteca.db")
-                            c = conn.cursor()
+                            c = get_conexion().cursor()
                             c.execute("""
                                 SELECT prestamos.id, libros.id, libros.titulo, prestamos.is_activo 
                                 FROM prestamos 
@@ -613,26 +742,36 @@ def menu_bibliotecario(usuario_logeado):
                             fila = c.fetchone()
                             if not fila:
                                 print("Préstamo no encontrado.")
-                                conn.close()
                                 continue
                             
                             _, id_libro, titulo_libro, is_activo = fila
                             
                             if not is_activo:
                                 print("Error: Este préstamo ya está marcado como devuelto. No es necesario cancelarlo.")
-                                conn.close()
                                 continue
                                 
                             confirm = input(f"¿Desea ELIMINAR el préstamo ACTIVO del libro '{titulo_libro}'? Esto devolverá el libro al inventario. (s/n): ").lower()
                             if confirm == 's':
-                                c.execute("DELETE FROM prestamos WHERE id = ?", (id_prestamo,))
-                                c.execute("UPDATE libros SET cantidad = cantidad + 1 WHERE id = ?", (id_libro,))
-                                conn.commit()
-                                print("Préstamo eliminado y libro devuelto al inventario.")
-                                log_auditoria(usuario_logeado.id, 'PRESTAMO_DEL', 'prestamos', f'Préstamo ID {id_prestamo} eliminado forzosamente')
-                            conn.close()
+                                with transaccion() as c:
+                                    # Solo si sigue activo: otra terminal pudo registrar la devolución mientras se confirmaba
+                                    c.execute("DELETE FROM prestamos WHERE id = ? AND is_activo = 1", (id_prestamo,))
+                                    eliminado = c.rowcount == 1
+                                    if eliminado:
+                                        liberar(c, id_libro)
+                                        log_auditoria(usuario_logeado.id, 'PRESTAMO_DEL', 'prestamos', f'Préstamo ID {id_prestamo} eliminado forzosamente', c)
+                                if eliminado:
+                                    print("Préstamo eliminado y libro devuelto al inventario.")
+                                else:
+                                    print("Error: El préstamo ya fue devuelto o eliminado. No se realizó el cambio.")
 
                         elif sub_opcion == 5:
+                            mostrar_multas()
+
+                        elif sub_opcion == 6:
+                            resultado = multas.calcular()
+                            print(f"Multas en curso: {resultado['acumulando']} | Finalizadas: {resultado['finalizadas']} | Quitadas: {resultado['quitadas']}")
+
+                        elif sub_opcion == 7:
                             break
                         else:
                             print("Opción inválida.")
@@ -643,10 +782,14 @@ def menu_bibliotecario(usuario_logeado):
 
 
             elif input_opcion == 3:
-                usuario_logeado.mostrar_info()
+                menu_reportes()
 
             elif input_opcion == 4:
+                usuario_logeado.mostrar_info()
+
+            elif input_opcion == 5:
                 print("Cerrando sesión.")
+                auditoria.flush()
                 break
 
             else:
@@ -662,7 +805,8 @@ def menu_admin(usuario_logeado):
         print("=== Menú Admin ===")
         print("1. Gestionar usuarios")
         print("2. Información de la cuenta")
-        print("3. Cerrar sesión")
+        print("3. Registro de auditoría")
+        print("4. Cerrar sesión")
 
         try:
             input_opcion = int(input("Seleccione una opción: "))
@@ -682,17 +826,8 @@ def menu_admin(usuario_logeado):
                         continue
 
                     if sub_opcion == 1:
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
-                        c.execute("SELECT id, nombre, email, tipo FROM usuarios")
-                        usuarios = c.fetchall()
-                        conn.close()
-                        if usuarios:
-                            print("=== Usuarios registrados ===")
-                            for id_usuario, nombre, email, tipo in usuarios:
-                                print(f"ID: {id_usuario}. {nombre} - {email} | Tipo: {tipo}")
-                        else:
-                            print("No hay usuarios registrados.")
+                        tipo = input("Filtrar por tipo (universitario/bibliotecario/admin, enter para todos): ").strip().lower()
+                        ver_usuarios(tipo)
 
                     elif sub_opcion == 2:
                         try:
@@ -701,13 +836,11 @@ def menu_admin(usuario_logeado):
                             print("ID inválido.")
                             continue
 
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
+                        c = get_conexion().cursor()
                         c.execute("SELECT id, nombre, email, tipo, password_hash FROM usuarios WHERE id = ?", (id_usuario,))
                         usuario = c.fetchone()
                         if not usuario:
                             print("Usuario no encontrado.")
-                            conn.close()
                             continue
 
                         id_u, nombre, email, tipo, password_hash = usuario
@@ -730,26 +863,25 @@ def menu_admin(usuario_logeado):
                         else:
                             nueva_pass_hash = password_hash
 
-                        c.execute("UPDATE usuarios SET nombre = ?, email = ?, password_hash = ? WHERE id = ?", 
-                                  (nuevo_nombre, nuevo_email, nueva_pass_hash, id_usuario))
-
+                        # Se piden todos los datos antes de abrir la transacción de escritura
+                        tabla_uni = None
+                        nueva_uni = ""
                         if tipo == "universitario":
-                            c.execute("SELECT universidad FROM universitarios WHERE usuario_id = ?", (id_usuario,))
-                            fila = c.fetchone()
-                            universidad_actual = fila[0] if fila else ""
-                            nueva_uni = input(f"Ingrese nueva universidad (enter para mantener '{universidad_actual}'): ").strip()
-                            if nueva_uni != "":
-                                c.execute("UPDATE universitarios SET universidad = ? WHERE usuario_id = ?", (nueva_uni, id_usuario))
+                            tabla_uni = "universitarios"
                         elif tipo == "bibliotecario":
-                            c.execute("SELECT universidad FROM bibliotecarios WHERE usuario_id = ?", (id_usuario,))
+                            tabla_uni = "bibliotecarios"
+                        if tabla_uni:
+                            c.execute(f"SELECT universidad FROM {tabla_uni} WHERE usuario_id = ?", (id_usuario,))
                             fila = c.fetchone()
                             universidad_actual = fila[0] if fila else ""
                             nueva_uni = input(f"Ingrese nueva universidad (enter para mantener '{universidad_actual}'): ").strip()
-                            if nueva_uni != "":
-                                c.execute("UPDATE bibliotecarios SET universidad = ? WHERE usuario_id = ?", (nueva_uni, id_usuario))
 
-                        conn.commit()
-                        conn.close()
+                        with transaccion() as c:
+                            c.execute("UPDATE usuarios SET nombre = ?, email = ?, password_hash = ? WHERE id = ?", 
+                                      (nuevo_nombre, nuevo_email, nueva_pass_hash, id_usuario))
+                            if tabla_uni and nueva_uni != "":
+                                c.execute(f"UPDATE {tabla_uni} SET universidad = ? WHERE usuario_id = ?", (nueva_uni, id_usuario))
+
                         print("Usuario modificado correctamente.")
                         log_auditoria(usuario_logeado.id, 'USUARIO_MOD', 'usuarios', f'Usuario ID {id_usuario} modificado')
 
@@ -760,30 +892,27 @@ def menu_admin(usuario_logeado):
                             print("ID inválido.")
                             continue
 
-                        conn = sqlite3.connect("biblioteca.db")
-                        c = conn.cursor()
+                        c = get_conexion().cursor()
                         c.execute("SELECT nombre, tipo FROM usuarios WHERE id = ?", (id_usuario,))
                         usuario = c.fetchone()
                         if not usuario:
                             print("Usuario no encontrado.")
-                            conn.close()
                             continue
 
                         nombre, tipo = usuario
                         confirm = input(f"¿Está seguro de eliminar '{nombre}'? (s/n): ").lower()
                         if confirm == 's':
-                            if tipo == "universitario":
-                                c.execute("DELETE FROM universitarios WHERE usuario_id = ?", (id_usuario,))
-                            elif tipo == "bibliotecario":
-                                c.execute("DELETE FROM bibliotecarios WHERE usuario_id = ?", (id_usuario,))
-                            elif tipo == "admin":
-                                c.execute("DELETE FROM admin WHERE usuario_id = ?", (id_usuario,))
-                            
-                            c.execute("DELETE FROM usuarios WHERE id = ?", (id_usuario,))
-                            conn.commit()
+                            with transaccion() as c:
+                                if tipo == "universitario":
+                                    c.execute("DELETE FROM universitarios WHERE usuario_id = ?", (id_usuario,))
+                                elif tipo == "bibliotecario":
+                                    c.execute("DELETE FROM bibliotecarios WHERE usuario_id = ?", (id_usuario,))
+                                elif tipo == "admin":
+                                    c.execute("DELETE FROM admin WHERE usuario_id = ?", (id_usuario,))
+                                
+                                c.execute("DELETE FROM usuarios WHERE id = ?", (id_usuario,))
                             print("Usuario eliminado exitosamente.")
                             log_auditoria(usuario_logeado.id, 'USUARIO_DEL', 'usuarios', f'Usuario ID {id_usuario} ({nombre}) eliminado')
-                        conn.close()
 
                     elif sub_opcion == 4:
                         break
@@ -794,7 +923,20 @@ def menu_admin(usuario_logeado):
                 usuario_logeado.mostrar_info()
 
             elif input_opcion == 3:
+                filtros = pedir_filtros_auditoria()
+                if filtros is None:
+                    continue
+                if ver_auditoria(filtros) and input("¿Exportar estos eventos a CSV? (s/n): ").strip().lower() == 's':
+                    ruta = input("Archivo de salida (enter para auditoria.csv): ").strip() or 'auditoria.csv'
+                    try:
+                        cantidad = exportar_auditoria(filtros, ruta)
+                        print(f"{cantidad} eventos exportados a {ruta}.")
+                    except OSError as e:
+                        print(f"No se pudo escribir el archivo: {e}")
+
+            elif input_opcion == 4:
                 print("Cerrando sesión.")
+                auditoria.flush()
                 break
 
             else:
@@ -0,0 +1,121 @@
+import os
+import sys
+import csv
+import json
+from itertools import islice
+from clases import validar_libro
+from conexion import transaccion
+
+# Importacion masiva del catalogo desde CSV o JSONL.
+# El archivo se lee como flujo y se procesa por lotes, asi la memoria usada
+# no depende del tamaño del archivo.
+
+TAMANO_LOTE = 1000
+MAX_PARAMETROS = 500      # ISBN por consulta IN (...) al buscar duplicados
+
+COLUMNAS = ('titulo', 'autor', 'genero', 'año', 'cantidad', 'isbn')
+
+# Un libro nuevo tiene todas sus copias disponibles
+SQL_INSERT = "INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn, disponibles) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+
+def leer_filas(ruta):
+    """Genera (numero_linea, dict) para cada registro del archivo CSV o JSONL."""
+    if ruta.lower().endswith(('.jsonl', '.json')):
+        with open(ruta, encoding='utf-8') as archivo:
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    yield numero, json.loads(linea)
+                except ValueError:
+                    yield numero, None
+    else:
+        with open(ruta, encoding='utf-8-sig', newline='') as archivo:
+            # La linea 1 es el encabezado
+            for numero, fila in enumerate(csv.DictReader(archivo), start=2):
+                yield numero, fila
+
+
+def _valor(fila, columna):
+    valor = fila.get(columna)
+    if valor is None and columna == 'año':
+        valor = fila.get('anio')
+    return str(valor).strip() if valor is not None else ""
+
+
+def _validar_lote(lote, rechazos):
+    """Valida un lote con las reglas de Libro y descarta ISBN repetidos dentro del lote."""
+    validos = {}
+    for numero, fila in lote:
+        if not isinstance(fila, dict):
+            rechazos.writerow([numero, "", "Registro con formato inválido."])
+            continue
+        try:
+            libro = validar_libro(*(_valor(fila, columna) for columna in COLUMNAS))
+        except ValueError as ve:
+            rechazos.writerow([numero, _valor(fila, 'isbn'), str(ve)])
+            continue
+        isbn = libro[5]
+        if isbn in validos:
+            rechazos.writerow([numero, isbn, "ISBN repetido en el archivo."])
+            continue
+        validos[isbn] = (numero, libro)
+    return validos
+
+
+def _isbn_existentes(c, isbns):
+    existentes = set()
+    isbns = list(isbns)
+    for i in range(0, len(isbns), MAX_PARAMETROS):
+        parte = isbns[i:i + MAX_PARAMETROS]
+        marcadores = ", ".join("?" * len(parte))
+        c.execute(f"SELECT isbn FROM libros WHERE isbn IN ({marcadores})", parte)
+        existentes.update(fila[0] for fila in c.fetchall())
+    return existentes
+
+
+def importar_libros(ruta, ruta_rechazos=None, tamano_lote=TAMANO_LOTE):
+    """
+    Importa libros desde un archivo CSV o JSONL con columnas titulo, autor, genero, año, cantidad, isbn.
+    Cada lote se inserta con executemany en su propia transaccion. Las filas rechazadas se
+    escriben en ruta_rechazos (CSV con linea, isbn y motivo).
+    Devuelve un resumen con las filas leidas, insertadas y rechazadas.
+    """
+    if ruta_rechazos is None:
+        ruta_rechazos = os.path.splitext(ruta)[0] + "_rechazos.csv"
+    resumen = {'leidas': 0, 'insertadas': 0, 'rechazadas': 0}
+
+    filas = leer_filas(ruta)
+    with open(ruta_rechazos, 'w', encoding='utf-8', newline='') as archivo_rechazos:
+        rechazos = csv.writer(archivo_rechazos)
+        rechazos.writerow(['linea', 'isbn', 'motivo'])
+
+        while True:
+            lote = list(islice(filas, tamano_lote))
+            if not lote:
+                break
+            resumen['leidas'] += len(lote)
+            validos = _validar_lote(lote, rechazos)
+
+            with transaccion('IMMEDIATE') as c:
+                for isbn in _isbn_existentes(c, validos):
+                    numero, _ = validos.pop(isbn)
+                    rechazos.writerow([numero, isbn, "Ya existe un libro con ese ISBN."])
+                c.executemany(SQL_INSERT, (libro + (libro[4],) for _, libro in validos.values()))
+            resumen['insertadas'] += len(validos)
+            resumen['rechazadas'] += len(lote) - len(validos)
+
+    resumen['archivo_rechazos'] = ruta_rechazos
+    return resumen
+
+
+if __name__ == "__main__":
+    # Uso: python importacion.py libros.csv [rechazos.csv]
+    if len(sys.argv) < 2:
+        print("Uso: python importacion.py <archivo.csv|archivo.jsonl> [rechazos.csv]")
+        sys.exit(1)
+    import BD # Asegura el esquema antes de importar
+    resultado = importar_libros(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Leídas: {resultado['leidas']} | Insertadas: {resultado['insertadas']} | Rechazadas: {resultado['rechazadas']}")
+    print(f"Reporte de rechazos: {resultado['archivo_rechazos']}")
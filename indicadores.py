@@ -0,0 +1,103 @@
+import os
+import json
+import threading
+import requests # Importar requests para consumir la API
+from requests.exceptions import RequestException
+from datetime import datetime, date, timedelta
+from conexion import get_conexion, transaccion, cerrar_conexion_del_hilo
+
+# Proveedor del valor de la UF con cache local en la tabla valores_uf (migracion 5 en BD.py).
+# Los valores de la UF de un dia no cambian, asi que una vez guardados se reutilizan siempre.
+# Si falta el valor del dia se entrega el ultimo conocido y la serie se refresca en segundo plano.
+
+# Para pruebas sin red: UF_API_URL apunta a un servidor local y UF_FIXTURE a un archivo JSON
+# con el mismo formato de mindicador.cl ({"serie": [{"fecha": "...", "valor": ...}, ...]})
+UF_API_URL = os.environ.get('UF_API_URL', "https://mindicador.cl/api/uf")
+UF_FIXTURE = os.environ.get('UF_FIXTURE')
+
+TTL = timedelta(hours=6)     # Tiempo antes de volver a consultar la API por valores nuevos
+DIAS_SERIE = 30              # La API entrega aprox. el ultimo mes en una sola consulta
+
+_refrescando = threading.Lock()
+
+
+def _leer_json(fecha=None):
+    if UF_FIXTURE:
+        with open(UF_FIXTURE, encoding='utf-8') as archivo:
+            return json.load(archivo)
+    url = UF_API_URL
+    if fecha is not None and (date.today() - fecha).days > DIAS_SERIE:
+        url = f"{UF_API_URL}/{fecha.strftime('%d-%m-%Y')}"
+    response = requests.get(url, timeout=3)
+    response.raise_for_status()
+    return response.json()
+
+
+def descargar_serie(fecha=None):
+    """Descarga la serie de la UF y la guarda en la cache. Devuelve la cantidad de valores guardados."""
+    try:
+        data = _leer_json(fecha)
+    except (RequestException, OSError, ValueError) as e:
+        print(f"Alerta: Error al conectar con la API de indicadores. {e}")
+        return 0
+
+    ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # La fecha viene como '2025-11-20T03:00:00.000Z' (medianoche de Chile)
+    filas = [(item['fecha'][:10], float(item['valor']), ahora) for item in data.get('serie', [])]
+    if filas:
+        with transaccion() as c:
+            c.executemany("INSERT OR REPLACE INTO valores_uf (fecha, valor, actualizado) VALUES (?, ?, ?)", filas)
+    return len(filas)
+
+
+def _refrescar():
+    # Solo un refresco a la vez por proceso
+    if not _refrescando.acquire(blocking=False):
+        return
+    try:
+        descargar_serie()
+    finally:
+        # El hilo termina aqui: su conexion no debe quedar abierta
+        cerrar_conexion_del_hilo()
+        _refrescando.release()
+
+
+def refrescar_en_segundo_plano():
+    threading.Thread(target=_refrescar, daemon=True).start()
+
+
+def _ultima_actualizacion(c):
+    c.execute("SELECT MAX(actualizado) FROM valores_uf")
+    fila = c.fetchone()
+    return datetime.strptime(fila[0], '%Y-%m-%d %H:%M:%S') if fila and fila[0] else None
+
+
+def get_valor_uf(fecha=None):
+    """
+    Devuelve el valor de la UF para la fecha indicada (hoy por defecto), o None si no se conoce.
+    Nunca debe llamarse dentro de una transaccion: puede hacer una consulta a la API.
+    """
+    fecha = fecha or date.today()
+    fecha_str = fecha.strftime('%Y-%m-%d')
+    c = get_conexion().cursor()
+
+    # 1. Valor exacto en cache
+    c.execute("SELECT valor FROM valores_uf WHERE fecha = ?", (fecha_str,))
+    fila = c.fetchone()
+    if fila:
+        return fila[0]
+
+    # 2. Hay un valor anterior: se entrega de inmediato y se revalida en segundo plano
+    c.execute("SELECT valor FROM valores_uf WHERE fecha <= ? ORDER BY fecha DESC LIMIT 1", (fecha_str,))
+    anterior = c.fetchone()
+    if anterior:
+        ultima = _ultima_actualizacion(c)
+        if ultima is None or datetime.now() - ultima > TTL:
+            refrescar_en_segundo_plano()
+        return anterior[0]
+
+    # 3. Cache vacia para esa fecha: se descarga ahora
+    descargar_serie(fecha)
+    c.execute("SELECT valor FROM valores_uf WHERE fecha <= ? ORDER BY fecha DESC LIMIT 1", (fecha_str,))
+    fila = c.fetchone()
+    return fila[0] if fila else None
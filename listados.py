@@ -0,0 +1,89 @@
+from conexion import get_conexion
+
+# Listados paginados por clave (keyset): cada pagina se pide con
+# WHERE (columnas de orden) > (ultima fila vista) ... LIMIT n,
+# asi mostrar la pagina 1 o la 1000 cuesta lo mismo y nunca se carga la tabla completa.
+
+TAMANO_PAGINA = 20
+
+
+def obtener_pagina(select, orden, indices_clave, condiciones=(), parametros=(), despues_de=None, tamano=None):
+    """
+    Devuelve (filas, clave_siguiente) para una pagina.
+    select: consulta sin WHERE ni ORDER BY.
+    orden: columnas de orden (deben identificar una fila de forma unica, ej: ('p.fch_devolucion', 'p.id')).
+    indices_clave: posicion de esas columnas dentro de cada fila devuelta.
+    clave_siguiente es None cuando no hay mas paginas.
+    """
+    tamano = tamano or TAMANO_PAGINA
+    where = list(condiciones)
+    params = list(parametros)
+    if despues_de is not None:
+        where.append(f"({', '.join(orden)}) > ({', '.join('?' * len(orden))})")
+        params.extend(despues_de)
+    sql = select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {', '.join(orden)} LIMIT ?"
+    # Una fila extra indica si existe una pagina siguiente
+    params.append(tamano + 1)
+
+    c = get_conexion().cursor()
+    c.execute(sql, params)
+    filas = c.fetchall()
+    if len(filas) <= tamano:
+        return filas, None
+    filas = filas[:tamano]
+    return filas, tuple(filas[-1][i] for i in indices_clave)
+
+
+def recorrer(select, orden, indices_clave, condiciones=(), parametros=(), tamano=None):
+    """Genera todas las filas pagina por pagina (para exportar o procesar sin cargar todo en memoria)."""
+    clave = None
+    while True:
+        filas, clave = obtener_pagina(select, orden, indices_clave, condiciones, parametros, clave, tamano)
+        yield from filas
+        if clave is None:
+            return
+
+
+def navegar(select, orden, indices_clave, mostrar_fila, condiciones=(), parametros=(), tamano=None, encabezado=None):
+    """
+    Muestra un listado paginado en la consola con navegacion siguiente/anterior.
+    Devuelve la cantidad de filas mostradas (0 si el listado esta vacio).
+    """
+    def pagina(despues_de):
+        return obtener_pagina(select, orden, indices_clave, condiciones, parametros, despues_de, tamano)
+    return navegar_paginas(pagina, mostrar_fila, encabezado)
+
+
+def navegar_paginas(pagina, mostrar_fila, encabezado=None):
+    """Como navegar, con otra fuente de paginas: pagina(despues_de) devuelve (filas, clave_siguiente)."""
+    # Pila con la clave de inicio de cada pagina visitada (None = primera pagina)
+    inicios = [None]
+    mostradas = 0
+    while True:
+        filas, clave_siguiente = pagina(inicios[-1])
+        if not filas:
+            return mostradas
+        if encabezado:
+            encabezado()
+        for fila in filas:
+            mostrar_fila(fila)
+        mostradas += len(filas)
+
+        opciones = []
+        if clave_siguiente is not None:
+            opciones.append("s = siguiente")
+        if len(inicios) > 1:
+            opciones.append("a = anterior")
+        if not opciones:
+            return mostradas
+        print(f"-- Página {len(inicios)} -- ({', '.join(opciones)}, enter = terminar)")
+        opcion = input("> ").strip().lower()
+        if opcion == 's' and clave_siguiente is not None:
+            inicios.append(clave_siguiente)
+        elif opcion == 'a' and len(inicios) > 1:
+            inicios.pop()
+        else:
+            return mostradas
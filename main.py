@@ -1,3 +1,4 @@
+import BD # Crea el esquema y aplica migraciones pendientes al iniciar
 import funciones
 
 
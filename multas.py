@@ -0,0 +1,167 @@
+import sys
+from datetime import date, datetime
+
+from conexion import get_conexion, transaccion
+from indicadores import get_valor_uf
+
+# Registro de multas por atraso (tabla multas, migracion 15 de BD.py).
+#
+# calcular() es el proceso nocturno (python multas.py, ej: desde cron): en una sola
+# transaccion y con sentencias sobre todo el conjunto (sin recorrer prestamos en Python)
+# recalcula la multa acumulada de cada prestamo activo atrasado con la UF del dia,
+# que se obtiene una vez (cache valores_uf). Ejecutarlo de nuevo el mismo dia deja
+# los mismos valores.
+#
+# Al registrar la devolucion (realizar_devolucion_admin en el CLI, return_loan en Django)
+# finalizar() deja la multa en FINAL con los dias reales de atraso. Las devoluciones hechas
+# por otra via las cierra el siguiente calcular() con la UF guardada del dia de la devolucion.
+# Las pantallas leen la tabla; no recalculan desde los prestamos.
+
+MULTA_POR_DIA_UF = 0.01     # Multa hipotetica: 0.01 UF por dia de atraso
+
+ACUMULANDO = 'ACUMULANDO'
+FINAL = 'FINAL'
+
+# UF guardada del dia (o la ultima anterior) de una fecha
+SQL_UF_DEL_DIA = "(SELECT valor FROM valores_uf WHERE fecha <= {fecha} ORDER BY fecha DESC LIMIT 1)"
+
+
+def calcular(hoy=None):
+    """Actualiza las multas acumuladas al día hoy. Devuelve {'acumulando', 'finalizadas', 'quitadas', 'valor_uf'}."""
+    hoy = hoy or date.today()
+    dia = hoy.strftime('%Y-%m-%d')
+    # Fuera de la transaccion: puede consultar la API
+    valor_uf = get_valor_uf(hoy)
+    parametros = {'hoy': dia, 'tarifa': MULTA_POR_DIA_UF, 'uf': valor_uf}
+
+    with transaccion('IMMEDIATE') as c:
+        # 1. Prestamos devueltos sin pasar por finalizar(): la multa se cierra con la fecha real
+        c.execute(f"""
+            UPDATE multas SET
+                dias_atraso = CAST(julianday(p.fch_devolucion_real) - julianday(p.fch_devolucion) AS INTEGER),
+                monto_uf = CAST(julianday(p.fch_devolucion_real) - julianday(p.fch_devolucion) AS INTEGER) * :tarifa,
+                valor_uf = {SQL_UF_DEL_DIA.format(fecha='date(p.fch_devolucion_real)')},
+                monto_clp = ROUND(CAST(julianday(p.fch_devolucion_real) - julianday(p.fch_devolucion) AS INTEGER) * :tarifa
+                                  * {SQL_UF_DEL_DIA.format(fecha='date(p.fch_devolucion_real)')}),
+                calculada = date(p.fch_devolucion_real),
+                estado = 'FINAL',
+                actualizado = datetime('now', 'localtime')
+            FROM prestamos p
+            WHERE p.id = multas.prestamo_id AND multas.estado = 'ACUMULANDO'
+              AND p.is_activo = 0 AND date(p.fch_devolucion_real) > date(p.fch_devolucion)
+        """, parametros)
+        finalizadas = c.rowcount
+
+        # 2. Prestamos eliminados, extendidos o devueltos a tiempo: ya no acumulan multa
+        c.execute("""
+            DELETE FROM multas
+            WHERE estado = 'ACUMULANDO'
+              AND prestamo_id NOT IN (SELECT id FROM prestamos WHERE is_activo = 1 AND fch_devolucion < :hoy)
+        """, parametros)
+        quitadas = c.rowcount
+
+        # 3. Multa acumulada de todos los prestamos activos atrasados (idx_prestamos_activo_devolucion)
+        c.execute("""
+            INSERT INTO multas (prestamo_id, universitario_id, dias_atraso, monto_uf, valor_uf, monto_clp, calculada, estado)
+            SELECT id, universitario_id, dias, dias * :tarifa, :uf, ROUND(dias * :tarifa * :uf), :hoy, 'ACUMULANDO'
+            FROM (SELECT id, universitario_id, CAST(julianday(:hoy) - julianday(fch_devolucion) AS INTEGER) AS dias
+                  FROM prestamos
+                  WHERE is_activo = 1 AND fch_devolucion < :hoy)
+            WHERE true
+            ON CONFLICT (prestamo_id) DO UPDATE SET
+                universitario_id = excluded.universitario_id,
+                dias_atraso = excluded.dias_atraso,
+                monto_uf = excluded.monto_uf,
+                valor_uf = excluded.valor_uf,
+                monto_clp = excluded.monto_clp,
+                calculada = excluded.calculada,
+                actualizado = datetime('now', 'localtime')
+            WHERE multas.estado = 'ACUMULANDO'
+        """, parametros)
+        acumulando = c.execute("SELECT COUNT(*) FROM multas WHERE estado = 'ACUMULANDO'").fetchone()[0]
+
+    return {'acumulando': acumulando, 'finalizadas': finalizadas, 'quitadas': quitadas, 'valor_uf': valor_uf}
+
+
+def finalizar(c, prestamo_id, fch_devolucion_real, valor_uf):
+    """
+    Deja en FINAL la multa de un préstamo que se devuelve, dentro de la transacción de c
+    (la misma de la devolución). Devuelve la multa (dict) o None si no hubo atraso.
+    """
+    calculada = fch_devolucion_real.strftime('%Y-%m-%d')
+    # Los dias en SQL: la conexion de Django devuelve las columnas DATE como date, la del CLI como texto
+    c.execute("SELECT universitario_id, CAST(julianday(?) - julianday(fch_devolucion) AS INTEGER) FROM prestamos WHERE id = ?",
+              (calculada, prestamo_id))
+    universitario_id, dias = c.fetchone()
+    if dias <= 0:
+        # Extendido despues del ultimo calculo: la multa en curso ya no corresponde
+        c.execute("DELETE FROM multas WHERE prestamo_id = ? AND estado = 'ACUMULANDO'", (prestamo_id,))
+        return None
+
+    multa = {
+        'prestamo_id': prestamo_id,
+        'universitario_id': universitario_id,
+        'dias_atraso': dias,
+        'monto_uf': dias * MULTA_POR_DIA_UF,
+        'valor_uf': valor_uf,
+        'monto_clp': round(dias * MULTA_POR_DIA_UF * valor_uf) if valor_uf else None,
+        'calculada': calculada,
+    }
+    c.execute("""
+        INSERT INTO multas (prestamo_id, universitario_id, dias_atraso, monto_uf, valor_uf, monto_clp, calculada, estado)
+        VALUES (:prestamo_id, :universitario_id, :dias_atraso, :monto_uf, :valor_uf, :monto_clp, :calculada, 'FINAL')
+        ON CONFLICT (prestamo_id) DO UPDATE SET
+            dias_atraso = excluded.dias_atraso,
+            monto_uf = excluded.monto_uf,
+            valor_uf = excluded.valor_uf,
+            monto_clp = excluded.monto_clp,
+            calculada = excluded.calculada,
+            estado = 'FINAL',
+            actualizado = datetime('now', 'localtime')
+    """, multa)
+    return multa
+
+
+def multas_de(universitario_id):
+    """Multas de un universitario: (prestamo_id, titulo, dias_atraso, monto_uf, monto_clp, calculada, estado)."""
+    return get_conexion().execute("""
+        SELECT m.prestamo_id, COALESCE(l.titulo, '(libro eliminado)'), m.dias_atraso, m.monto_uf, m.monto_clp, m.calculada, m.estado
+        FROM multas m
+        LEFT JOIN prestamos p ON p.id = m.prestamo_id
+        LEFT JOIN libros l ON l.id = p.libro_id
+        WHERE m.universitario_id = ?
+        ORDER BY m.estado, m.calculada DESC
+    """, (universitario_id,)).fetchall()
+
+
+def totales():
+    """Totales por estado: {estado: (cantidad, monto_uf, monto_clp)}."""
+    filas = get_conexion().execute(
+        "SELECT estado, COUNT(*), ROUND(SUM(monto_uf), 2), SUM(monto_clp) FROM multas GROUP BY estado").fetchall()
+    return {estado: (cantidad, monto_uf, monto_clp) for estado, cantidad, monto_uf, monto_clp in filas}
+
+
+def por_universitario():
+    """Total de multas de cada universitario, de mayor a menor: (id, nombre, cantidad, monto_uf, monto_clp)."""
+    return get_conexion().execute("""
+        SELECT m.universitario_id, COALESCE(u.nombre, '(eliminado)'), COUNT(*), ROUND(SUM(m.monto_uf), 2), SUM(m.monto_clp)
+        FROM multas m
+        LEFT JOIN usuarios u ON u.id = m.universitario_id
+        GROUP BY m.universitario_id
+        ORDER BY SUM(m.monto_uf) DESC
+    """).fetchall()
+
+
+def ultimo_calculo():
+    """Día del último cálculo nocturno ('YYYY-MM-DD') o None."""
+    return get_conexion().execute("SELECT MAX(calculada) FROM multas WHERE estado = 'ACUMULANDO'").fetchone()[0]
+
+
+if __name__ == "__main__":
+    # Uso: python multas.py [YYYY-MM-DD]   (por defecto hoy)
+    import BD # Asegura el esquema (migracion 15)
+    hoy = datetime.strptime(sys.argv[1], '%Y-%m-%d').date() if len(sys.argv) > 1 else None
+    resultado = calcular(hoy)
+    uf = f"{resultado['valor_uf']:,.2f}" if resultado['valor_uf'] else "no disponible"
+    print(f"Multas acumulando: {resultado['acumulando']} | Finalizadas: {resultado['finalizadas']} | "
+          f"Quitadas: {resultado['quitadas']} | UF: {uf}")
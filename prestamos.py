@@ -0,0 +1,149 @@
+import time
+import random
+import sqlite3
+from datetime import date, timedelta
+from conexion import transaccion, en_transaccion
+import auditoria
+
+# Motor de prestamos: la transaccion toma el bloqueo de escritura al comenzar
+# (BEGIN IMMEDIATE) y el stock se reserva con un UPDATE condicional, asi dos
+# mesones no pueden prestar la misma ultima copia.
+#
+# Disponibilidad: libros.cantidad es el total de copias y libros.disponibles las
+# que estan en estante. Todo prestamo descuenta disponibles y toda devolucion o
+# eliminacion de un prestamo activo la repone (CLI y Django), asi saber si hay
+# copias es leer una fila por su id y no contar el historial de prestamos.
+# Invariante: disponibles = cantidad - prestamos activos (ver reconciliar_disponibles).
+
+MAX_DIAS = 14
+
+MAX_REINTENTOS = 5
+ESPERA_BASE = 0.05      # segundos, se duplica en cada reintento
+ESPERA_MAXIMA = 1.0
+
+
+def validar_dias(dias):
+    """Valida la duración del préstamo (1 a 14 días) y la devuelve como entero."""
+    try:
+        dias = int(dias)
+    except ValueError:
+        raise ValueError("La cantidad de días debe ser un número entero.")
+    if dias <= 0:
+        raise ValueError("El préstamo debe ser por al menos 1 día.")
+    if dias > MAX_DIAS:
+        raise ValueError("El préstamo no puede ser por más de 14 días (2 semanas).")
+    return dias
+
+
+def _es_bloqueo(error):
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+def ejecutar_con_reintentos(operacion, intentos=MAX_REINTENTOS):
+    """
+    Ejecuta la operacion reintentando si la base esta ocupada, con espera exponencial acotada.
+    Dentro de una transaccion ya abierta no se reintenta (el error debe llegar a quien la abrio).
+    """
+    if en_transaccion():
+        return operacion()
+    for intento in range(intentos):
+        try:
+            return operacion()
+        except sqlite3.OperationalError as e:
+            if not _es_bloqueo(e) or intento == intentos - 1:
+                raise
+            espera = min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intento)
+            time.sleep(espera * random.uniform(0.5, 1.0))
+
+
+def reservar(c, universitario_id, libro_id, dias, fch_prestamo, fch_devolucion):
+    """Descuenta una copia y crea el préstamo dentro de la transacción de c. Devuelve el id del préstamo."""
+    # El descuento solo ocurre si queda stock: la condicion y la escritura son una sola sentencia
+    c.execute("UPDATE libros SET disponibles = disponibles - 1 WHERE id = ? AND disponibles > 0", (libro_id,))
+    if c.rowcount == 0:
+        c.execute("SELECT 1 FROM libros WHERE id = ?", (libro_id,))
+        if not c.fetchone():
+            raise ValueError("El libro no existe.")
+        raise ValueError("No hay copias disponibles de este libro.")
+    c.execute("INSERT INTO prestamos (universitario_id, libro_id, dias, fch_prestamo, fch_devolucion, is_activo) VALUES (?, ?, ?, ?, ?, 1)",
+              (universitario_id, libro_id, dias, fch_prestamo, fch_devolucion))
+    return c.lastrowid
+
+
+def liberar(c, libro_id):
+    """Repone la copia de un préstamo activo que se devuelve o elimina, dentro de la transacción de c."""
+    c.execute("UPDATE libros SET disponibles = disponibles + 1 WHERE id = ?", (libro_id,))
+
+
+def realizar_prestamos(universitario_id, libros_ids, dias, usuario_auditoria=None):
+    """
+    Presta uno o varios libros a un universitario en una sola transacción: se prestan
+    todos o ninguno. Devuelve la lista de ids de préstamo en el mismo orden que libros_ids.
+    Con usuario_auditoria, el registro de auditoría se guarda en la misma transacción.
+    """
+    dias = validar_dias(dias)
+    libros_ids = list(libros_ids)
+    if not libros_ids:
+        raise ValueError("Debe indicar al menos un libro.")
+    if len(set(libros_ids)) != len(libros_ids):
+        raise ValueError("No se puede prestar dos veces el mismo libro en una solicitud.")
+    fch_prestamo = date.today().strftime('%Y-%m-%d')
+    fch_devolucion = (date.today() + timedelta(days=dias)).strftime('%Y-%m-%d')
+
+    def operacion():
+        with transaccion('IMMEDIATE') as c:
+            c.execute("SELECT id FROM usuarios WHERE id = ? AND tipo = 'universitario'", (universitario_id,))
+            if not c.fetchone():
+                raise ValueError("El universitario no existe en la base de datos.")
+            ids = []
+            for libro_id in libros_ids:
+                prestamo_id = reservar(c, universitario_id, libro_id, dias, fch_prestamo, fch_devolucion)
+                if usuario_auditoria is not None:
+                    auditoria.registrar(usuario_auditoria, 'PRESTAMO', 'prestamos', f'Nuevo préstamo ID {prestamo_id} de Libro {libro_id}', c)
+                ids.append(prestamo_id)
+            return ids
+
+    return ejecutar_con_reintentos(operacion)
+
+
+SQL_DESCUADRES = """
+    SELECT l.id, l.titulo, l.cantidad, l.disponibles, l.cantidad - COUNT(p.id) AS esperadas
+    FROM libros l
+    LEFT JOIN prestamos p ON p.libro_id = l.id AND p.is_activo = 1
+    GROUP BY l.id
+    HAVING l.disponibles IS NOT l.cantidad - COUNT(p.id)
+"""
+
+
+def reconciliar_disponibles(corregir=False):
+    """
+    Compara libros.disponibles con cantidad - préstamos activos.
+    Devuelve la lista de descuadres (id, titulo, cantidad, disponibles, esperadas);
+    con corregir=True además deja disponibles en el valor esperado.
+    """
+    with transaccion('IMMEDIATE' if corregir else 'DEFERRED') as c:
+        c.execute(SQL_DESCUADRES)
+        descuadres = c.fetchall()
+        if corregir:
+            # Un total menor que las copias prestadas no se puede corregir aqui (CHECK disponibles >= 0)
+            c.executemany("UPDATE libros SET disponibles = ? WHERE id = ?",
+                          [(esperadas, libro_id) for libro_id, _, _, _, esperadas in descuadres if esperadas >= 0])
+    return descuadres
+
+
+if __name__ == "__main__":
+    # Uso: python prestamos.py [--corregir]
+    import sys
+    import BD # Asegura el esquema antes de revisar
+    corregir = '--corregir' in sys.argv[1:]
+    descuadres = reconciliar_disponibles(corregir)
+    for libro_id, titulo, cantidad, disponibles, esperadas in descuadres:
+        print(f"ID: {libro_id}. {titulo} | Total: {cantidad} | Disponibles: {disponibles} | Esperadas: {esperadas}")
+    if not descuadres:
+        print("Las copias disponibles cuadran con los préstamos activos.")
+    elif corregir:
+        print(f"{len(descuadres)} libros revisados y corregidos (los con esperadas < 0 requieren ajustar el total).")
+    else:
+        print(f"{len(descuadres)} libros descuadrados. Use --corregir para ajustarlos.")
+        sys.exit(1)
@@ -0,0 +1,75 @@
+import os
+import re
+import sqlite3
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from clases import patron_nombre, patron_email
+from conexion import transaccion
+import auditoria
+
+# Registro de usuarios: la contraseña se hashea una sola vez y la fila de usuarios
+# y la de su rol se insertan en una sola transaccion.
+# El hash corre en el pool mientras el CLI pide el resto de los datos (bcrypt libera el GIL).
+
+TABLAS_POR_TIPO = {
+    'universitario': 'universitarios',
+    'bibliotecario': 'bibliotecarios',
+}
+
+_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix='bcrypt')
+
+
+def validar_password(password):
+    if ' ' in password or password.strip() == "":
+        raise ValueError("La contraseña no puede contener espacios o estar vacia.")
+    try:
+        return password.encode('latin-1')
+    except UnicodeEncodeError:
+        raise ValueError("La contraseña contiene caracteres no compatibles con latin-1.")
+
+
+def validar_datos(nombre, email, tipo, universidad):
+    if not re.match(patron_nombre, nombre):
+        raise ValueError("El nombre solo puede contener letras y espacios.")
+    if not re.match(patron_email, email):
+        raise ValueError("El email no tiene un formato válido.")
+    if tipo not in TABLAS_POR_TIPO:
+        raise ValueError("Tipo de usuario inválido.")
+    if not universidad or not re.match(patron_nombre, universidad):
+        raise ValueError("El nombre de la universidad solo puede contener letras y espacios.")
+
+
+def _hashear(password_bytes):
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+
+
+def iniciar_hash(password):
+    """Valida la contraseña y comienza a hashearla en el pool. Devuelve un Future con el hash."""
+    return _pool.submit(_hashear, validar_password(password))
+
+
+def _insertar(nombre, email, password_hash, tipo, universidad):
+    try:
+        with transaccion('IMMEDIATE') as c:
+            # El UNIQUE de email reemplaza la consulta previa de existencia
+            c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, ?, ?)",
+                      (nombre, email, password_hash, tipo))
+            usuario_id = c.lastrowid
+            c.execute(f"INSERT INTO {TABLAS_POR_TIPO[tipo]} (usuario_id, universidad) VALUES (?, ?)",
+                      (usuario_id, universidad))
+            auditoria.registrar(usuario_id, 'REGISTRO', 'usuarios', f'Registro de {nombre} como {tipo}', c)
+    except sqlite3.IntegrityError:
+        raise ValueError("El usuario ya está registrado.")
+    return usuario_id
+
+
+def registrar_usuario(nombre, email, password, tipo, universidad, hash_futuro=None):
+    """
+    Registra un universitario o bibliotecario y devuelve su id.
+    hash_futuro permite reutilizar un hash iniciado antes con iniciar_hash().
+    """
+    validar_datos(nombre, email, tipo, universidad)
+    if hash_futuro is None:
+        hash_futuro = iniciar_hash(password)
+    return _insertar(nombre, email, hash_futuro.result(), tipo, universidad)
+
@@ -0,0 +1,70 @@
+import unittest
+from datetime import date
+
+# Primero la base temporal: BD.py se conecta al importarse
+from base_de_prueba import BaseDePrueba
+import conexion
+import archivo_auditoria
+
+
+class ArchivoAuditoriaTest(BaseDePrueba):
+
+    def setUp(self):
+        super().setUp()
+        with conexion.transaccion() as c:
+            for usuario_id in (1, 2):
+                c.execute("INSERT INTO usuarios (id, nombre, email, password_hash, tipo) VALUES (?, ?, ?, 'x', 'bibliotecario')",
+                          (usuario_id, f"Usuario {usuario_id}", f"u{usuario_id}@test.cl"))
+
+    def registrar(self, filas):
+        with conexion.transaccion() as c:
+            c.executemany("INSERT INTO auditoria (usuario_id, accion, tabla_afectada, detalle, fecha) VALUES (?, ?, 'libros', ?, ?)", filas)
+
+    def en_tabla(self):
+        return conexion.get_conexion().execute("SELECT COUNT(*) FROM auditoria").fetchone()[0]
+
+    def test_meses_antiguos_se_archivan_y_la_consulta_los_sigue_viendo(self):
+        hoy = date.today().strftime('%Y-%m-%d 10:00:00')
+        self.registrar([
+            (1, 'LIBRO_ADD', 'a', '2024-01-15 09:00:00'),
+            (2, 'LIBRO_DEL', 'b', '2024-01-03 12:00:00'),
+            (1, 'LIBRO_MOD', 'c', '2024-02-20 08:30:00'),
+            (2, 'LIBRO_ADD', 'd', hoy),
+        ])
+        todas = list(archivo_auditoria.consultar())
+
+        segmentos = archivo_auditoria.rotar()
+        self.assertEqual([s['archivo'] for s in segmentos], ['auditoria-2024-01.jsonl.gz', 'auditoria-2024-02.jsonl.gz'])
+        self.assertEqual(self.en_tabla(), 1)
+        self.assertEqual(list(archivo_auditoria.consultar()), todas)
+        self.assertEqual([f[4] for f in todas], ['b', 'a', 'c', 'd'])
+
+        self.assertEqual([f[4] for f in archivo_auditoria.consultar(usuario_id=1)], ['a', 'c'])
+        self.assertEqual([f[4] for f in archivo_auditoria.consultar(desde='2024-01-10', hasta='2024-03-01')], ['a', 'c'])
+        self.assertEqual(archivo_auditoria.rotar(), [])
+
+    def test_filas_tardias_van_a_un_segmento_nuevo(self):
+        self.registrar([(1, 'LOGIN', 'a', '2024-01-10 10:00:00'), (1, 'LOGIN', 'c', '2024-01-30 10:00:00')])
+        archivo_auditoria.rotar()
+        self.registrar([(1, 'LOGIN', 'b', '2024-01-20 10:00:00')])
+        # Antes de sellarla, la fila tardia se intercala con las archivadas
+        self.assertEqual([f[4] for f in archivo_auditoria.consultar()], ['a', 'b', 'c'])
+
+        segmentos = archivo_auditoria.rotar()
+        self.assertEqual([s['archivo'] for s in segmentos], ['auditoria-2024-01.2.jsonl.gz'])
+        self.assertEqual([f[4] for f in archivo_auditoria.consultar(usuario_id=1)], ['a', 'b', 'c'])
+        self.assertEqual(list(archivo_auditoria.consultar(usuario_id=2)), [])
+
+    def test_eventos_sin_usuario_se_archivan(self):
+        # Usuario de Django sin fila en usuarios (migracion 16)
+        self.registrar([(None, 'LOGIN', 'a', '2024-01-10 10:00:00'), (1, 'LOGIN', 'b', '2024-01-11 10:00:00')])
+        archivo_auditoria.rotar()
+        self.assertEqual([f[1] for f in archivo_auditoria.consultar()], [None, 1])
+        self.assertEqual([f[4] for f in archivo_auditoria.consultar(usuario_id=1)], ['b'])
+        # Los ids archivados no se vuelven a usar
+        self.registrar([(1, 'LOGIN', 'c', date.today().strftime('%Y-%m-%d 10:00:00'))])
+        self.assertEqual([f[0] for f in archivo_auditoria.consultar()], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+# Primero la base temporal: BD.py se conecta al importarse
+from base_de_prueba import BaseDePrueba
+import conexion
+import prestamos
+import estadisticas
+
+
+class EstadisticasTest(BaseDePrueba):
+
+    def setUp(self):
+        super().setUp()
+        with conexion.transaccion() as c:
+            self.universitarios = []
+            for i in range(3):
+                c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, 'x', 'universitario')",
+                          (f"Alumno {i}", f"alumno{i}@test.cl"))
+                self.universitarios.append(c.lastrowid)
+                c.execute("INSERT INTO universitarios (usuario_id, universidad) VALUES (?, 'Universidad')", (c.lastrowid,))
+            self.libros = []
+            for i in range(3):
+                c.execute("INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn) VALUES (?, 'Autor', 'Novela', 2000, 5, ?)",
+                          (f"Libro {i}", f'97800000000{i}'))
+                self.libros.append(c.lastrowid)
+
+    def test_estadisticas_incrementales_coinciden_con_reconstruir(self):
+        ids = []
+        for i, universitario_id in enumerate(self.universitarios):
+            ids += prestamos.realizar_prestamos(universitario_id, self.libros[:i + 1], 7)
+        with conexion.transaccion() as c:
+            # Una devolucion a tiempo, una atrasada, una extension y una eliminacion
+            c.execute("UPDATE prestamos SET fch_prestamo = '2026-03-01', fch_devolucion = '2026-03-08'")
+            c.execute("UPDATE prestamos SET is_activo = 0, fch_devolucion_real = '2026-03-05' WHERE id = ?", (ids[0],))
+            c.execute("UPDATE prestamos SET is_activo = 0, fch_devolucion_real = '2026-03-12' WHERE id = ?", (ids[1],))
+            c.execute("UPDATE prestamos SET fch_devolucion = '2026-03-20' WHERE id = ?", (ids[2],))
+            c.execute("DELETE FROM prestamos WHERE id = ?", (ids[3],))
+
+        tablas = ('estadisticas_libros', 'estadisticas_libros_dia', 'estadisticas_generos_dia', 'estadisticas_universidades_dia')
+        conn = conexion.get_conexion()
+
+        def contenido():
+            # Las filas que quedaron en cero equivalen a no tener fila
+            return {t: sorted(f for f in conn.execute(f"SELECT * FROM {t}") if any(f[-4:])) for t in tablas}
+
+        incremental = contenido()
+        estadisticas.reconstruir()
+        self.assertEqual(incremental, contenido())
+        self.assertEqual(estadisticas.resumen('2026-03-01', '2026-03-31'),
+                         {'nombre': 'Total', 'prestamos': 5, 'devoluciones': 2, 'promedio_dias': 7.5, 'tasa_atraso': 0.5})
+        self.assertEqual([f['prestamos'] for f in estadisticas.libros_mas_prestados()], [2, 2, 1])
+        self.assertEqual([f['nombre'] for f in estadisticas.demanda_por_genero()], ['Novela'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from datetime import date
+
+# Primero la base temporal: BD.py se conecta al importarse
+from base_de_prueba import BaseDePrueba
+import conexion
+import prestamos
+import multas
+
+
+class MultasTest(BaseDePrueba):
+
+    def setUp(self):
+        super().setUp()
+        with conexion.transaccion() as c:
+            self.universitarios = []
+            for i in range(2):
+                c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, 'x', 'universitario')",
+                          (f"Alumno {i}", f"alumno{i}@test.cl"))
+                self.universitarios.append(c.lastrowid)
+                c.execute("INSERT INTO universitarios (usuario_id, universidad) VALUES (?, 'Universidad')", (c.lastrowid,))
+            c.execute("INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn) VALUES ('Libro', 'Autor', 'Novela', 2000, 5, '9780000000999')")
+            self.libro_id = c.lastrowid
+            # UF del dia en la cache: no se consulta la API
+            c.execute("INSERT INTO valores_uf (fecha, valor, actualizado) VALUES ('2026-03-20', 40000, '2026-03-20 00:00:00')")
+
+    def test_multas_nocturnas_idempotentes_y_finalizadas_en_la_devolucion(self):
+        ids = [prestamos.realizar_prestamos(universitario_id, [self.libro_id], 7)[0] for universitario_id in self.universitarios]
+        hoy = date(2026, 3, 20)
+        with conexion.transaccion() as c:
+            c.execute("UPDATE prestamos SET fch_prestamo = '2026-03-01', fch_devolucion = '2026-03-10'")
+
+        conn = conexion.get_conexion()
+        for _ in range(2):
+            self.assertEqual(multas.calcular(hoy)['acumulando'], 2)
+            self.assertEqual(conn.execute("SELECT dias_atraso, monto_uf, monto_clp, estado FROM multas WHERE prestamo_id = ?",
+                                          (ids[0],)).fetchone(), (10, 0.1, 4000.0, 'ACUMULANDO'))
+
+        with conexion.transaccion() as c:
+            c.execute("UPDATE prestamos SET is_activo = 0, fch_devolucion_real = '2026-03-22' WHERE id = ?", (ids[0],))
+            multa = multas.finalizar(c, ids[0], date(2026, 3, 22), 40000)
+            # El segundo se extiende: deja de estar atrasado
+            c.execute("UPDATE prestamos SET fch_devolucion = '2026-03-30' WHERE id = ?", (ids[1],))
+        self.assertEqual(multa['dias_atraso'], 12)
+
+        resultado = multas.calcular(date(2026, 3, 23))
+        self.assertEqual((resultado['acumulando'], resultado['quitadas']), (0, 1))
+        self.assertEqual(conn.execute("SELECT dias_atraso, estado FROM multas").fetchall(), [(12, 'FINAL')])
+        self.assertEqual(multas.totales(), {'FINAL': (1, 0.12, 4800.0)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import unittest
+
+# Primero la base temporal: BD.py se conecta al importarse
+from base_de_prueba import BaseDePrueba
+import conexion
+import BD
+import prestamos
+
+
+class PrestamosTest(BaseDePrueba):
+
+    def crear_universitarios(self, cantidad):
+        with conexion.transaccion() as c:
+            ids = []
+            for i in range(cantidad):
+                c.execute("INSERT INTO usuarios (nombre, email, password_hash, tipo) VALUES (?, ?, ?, 'universitario')",
+                          (f"Alumno {i}", f"alumno{i}@test.cl", b"x"))
+                ids.append(c.lastrowid)
+                c.execute("INSERT INTO universitarios (usuario_id, universidad) VALUES (?, 'Universidad')", (c.lastrowid,))
+            return ids
+
+    def crear_libro(self, isbn, cantidad):
+        with conexion.transaccion() as c:
+            c.execute("INSERT INTO libros (titulo, autor, genero, año, cantidad, isbn) VALUES ('Libro', 'Autor', 'Novela', 2000, ?, ?)",
+                      (cantidad, isbn))
+            return c.lastrowid
+
+    def disponibles(self, libro_id):
+        return conexion.get_conexion().execute("SELECT disponibles FROM libros WHERE id = ?", (libro_id,)).fetchone()[0]
+
+    def prestamos_activos(self, libro_id):
+        return conexion.get_conexion().execute(
+            "SELECT COUNT(*) FROM prestamos WHERE libro_id = ? AND is_activo = 1", (libro_id,)).fetchone()[0]
+
+    def test_no_se_prestan_mas_copias_que_el_stock_con_32_escritores(self):
+        copias = 5
+        universitarios = self.crear_universitarios(32)
+        libro_id = self.crear_libro('1234567890', copias)
+
+        barrera = threading.Barrier(len(universitarios))
+        exitos, sin_stock, otros_errores = [], [], []
+
+        def pedir(universitario_id):
+            barrera.wait()
+            try:
+                exitos.append(prestamos.realizar_prestamos(universitario_id, [libro_id], 7))
+            except ValueError:
+                sin_stock.append(universitario_id)
+            except Exception as e:
+                otros_errores.append(e)
+
+        hilos = [threading.Thread(target=pedir, args=(u,)) for u in universitarios]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(otros_errores, [])
+        self.assertEqual(len(exitos), copias)
+        self.assertEqual(len(sin_stock), len(universitarios) - copias)
+        self.assertEqual(self.disponibles(libro_id), 0)
+        self.assertEqual(self.prestamos_activos(libro_id), copias)
+
+    def test_prestamo_de_varios_libros_es_todo_o_nada(self):
+        universitario_id = self.crear_universitarios(1)[0]
+        disponible = self.crear_libro('1111111111', 2)
+        agotado = self.crear_libro('2222222222', 0)
+
+        with self.assertRaises(ValueError):
+            prestamos.realizar_prestamos(universitario_id, [disponible, agotado], 3)
+
+        self.assertEqual(self.disponibles(disponible), 2)
+        self.assertEqual(self.prestamos_activos(disponible), 0)
+
+        ids = prestamos.realizar_prestamos(universitario_id, [disponible], 3)
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(self.disponibles(disponible), 1)
+
+    def test_reconciliacion_detecta_y_corrige_descuadres(self):
+        universitario_id = self.crear_universitarios(1)[0]
+        libro_id = self.crear_libro('3333333333', 3)
+        prestamos.realizar_prestamos(universitario_id, [libro_id], 5)
+        self.assertEqual(prestamos.reconciliar_disponibles(), [])
+
+        # Editar el total ajusta las disponibles (trigger de la migracion 8)
+        with conexion.transaccion() as c:
+            c.execute("UPDATE libros SET cantidad = 5 WHERE id = ?", (libro_id,))
+        self.assertEqual(self.disponibles(libro_id), 4)
+        with self.assertRaises(sqlite3.IntegrityError):
+            with conexion.transaccion() as c:
+                c.execute("UPDATE libros SET cantidad = 0 WHERE id = ?", (libro_id,))
+
+        with conexion.transaccion() as c:
+            c.execute("UPDATE libros SET disponibles = 1 WHERE id = ?", (libro_id,))
+        descuadres = prestamos.reconciliar_disponibles(corregir=True)
+        self.assertEqual([(d[0], d[3], d[4]) for d in descuadres], [(libro_id, 1, 4)])
+        self.assertEqual(self.disponibles(libro_id), 4)
+        self.assertEqual(prestamos.reconciliar_disponibles(), [])
+
+    def test_migracion_8_segun_la_base(self):
+        # Un libro de 3 copias con 1 prestamo activo, antes de la columna disponibles
+        def antes_de_la_migracion(es_django):
+            conn = sqlite3.connect(':memory:')
+            conn.execute("CREATE TABLE libros (id INTEGER PRIMARY KEY, cantidad INTEGER)")
+            conn.execute("CREATE TABLE prestamos (id INTEGER PRIMARY KEY, libro_id INTEGER, is_activo INTEGER)")
+            conn.execute("INSERT INTO libros VALUES (1, ?)", (3 if es_django else 2,))
+            conn.execute("INSERT INTO prestamos VALUES (1, 1, 1)")
+            if es_django:
+                conn.execute("CREATE TABLE django_migrations (id INTEGER PRIMARY KEY)")
+            return conn.cursor()
+
+        for es_django in (False, True):
+            c = antes_de_la_migracion(es_django)
+            BD._agregar_disponibles(c)
+            self.assertEqual(c.execute("SELECT cantidad, disponibles FROM libros").fetchone(), (3, 2))
+
+    def test_reintenta_mientras_la_base_esta_bloqueada(self):
+        intentos = []
+
+        def operacion():
+            intentos.append(1)
+            if len(intentos) < 3:
+                raise sqlite3.OperationalError("database is locked")
+            return "ok"
+
+        self.assertEqual(prestamos.ejecutar_con_reintentos(operacion), "ok")
+        self.assertEqual(len(intentos), 3)
+
+    def test_no_reintenta_otros_errores(self):
+        def operacion():
+            raise sqlite3.OperationalError("no such table: libros")
+
+        with self.assertRaises(sqlite3.OperationalError):
+            prestamos.ejecutar_con_reintentos(operacion)
+
+
+if __name__ == "__main__":
+    unittest.main()